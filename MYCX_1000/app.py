@@ -4,6 +4,7 @@ import traceback
 from datetime import datetime, timedelta, timezone
 
 # 引入后端逻辑
+import metrics
 from config import DEFAULT_CONFIG
 from predictor import DataHandler, fetch_recent_json, get_current_event_for_server
 
@@ -216,4 +217,18 @@ with col_info:
     # 这里会显示明确的北京时间
     st.write(f"最后更新: **{st.session_state['last_update_str']}**")
     
-    st.caption("机制说明：首次进入自动刷新，后续需手动点击按钮。")
\ No newline at end of file
+    st.caption("机制说明：首次进入自动刷新，后续需手动点击按钮。")
+
+    # 运行指标 (进程内累计，见 metrics.py)
+    with st.expander("运行指标"):
+        snap = metrics.snapshot()
+        stage_rows = [
+            {'阶段': item['labels'].get('stage'), '次数': item['count'],
+             '累计 (s)': round(item['sum'], 3), '最长 (s)': round(item['max'], 3)}
+            for item in snap['summaries'] if item['name'] == 'stage_wall_seconds'
+        ]
+        if stage_rows:
+            st.dataframe(stage_rows, hide_index=True)
+        for cache, ratio in snap['cache_hit_ratio'].items():
+            st.write(f"缓存 {cache} 命中率: **{ratio:.0%}**")
+        st.json(snap, expanded=False)
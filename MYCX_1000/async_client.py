@@ -0,0 +1,233 @@
+import asyncio
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from base_distribution import (
+    T10_SCALE_POINTS,
+    _event_data_ttl,
+    _meta_ttl,
+    event_meta_url,
+    eventtop_points_key,
+    eventtop_url,
+    parse_event_meta,
+    parse_tracker,
+    top10_max_speed,
+    tracker_url,
+)
+from cache import get_cache
+from config import ASYNC_CLIENT_CONFIG
+from eventtop_stream import EventtopPoints, stream_points
+from http_client import conditional_get, get_session
+
+# ==========================================
+# 异步 Bestdori 客户端 (AsyncBestdoriClient)
+# ==========================================
+# 在 asyncio 之上调度请求，实际 I/O 仍由共享的 requests Session 完成 (asyncio.to_thread)：
+#   - 全局并发上限 (Semaphore) 与按 host 的请求速率限制
+#   - 相同 URL 的并发请求合并为一次 (例如多个 tier 同时需要同一活动的 eventtop)
+#   - eventtop 流式解析，只读取计算 T10 极速所需的前若干个点
+#   - 单个候选活动的 meta / eventtop / tracker 三个请求同时发出，
+#     耗时取决于最慢的一个请求而不是三者之和
+# 与同步接口共用 DiskCache，缓存命中时不进入线程。
+# 一个客户端实例绑定一个事件循环；同步代码通过 run_sync 调用。
+
+
+class AsyncBestdoriClient:
+    def __init__(self, session=None, max_concurrency=None, per_host_rps=None, per_host_burst=None):
+        # 默认使用共享 Session (http_client.get_session)
+        self._session = session
+        self.max_concurrency = int(max_concurrency or ASYNC_CLIENT_CONFIG['max_concurrency'])
+        rps = per_host_rps if per_host_rps is not None else ASYNC_CLIENT_CONFIG['per_host_rps']
+        self.rate = float(rps) if rps else 0.0
+        self.burst = float(per_host_burst or ASYNC_CLIENT_CONFIG.get('per_host_burst', self.max_concurrency))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._inflight = {}     # url -> [Task, 等待者数量]
+        self._host_locks = {}   # host -> Lock
+        self._host_tokens = {}  # host -> (令牌数, 上次更新时间 monotonic)
+        self.stats = {'requests': 0, 'cache_hits': 0, 'coalesced': 0}
+
+    @property
+    def session(self):
+        return self._session if self._session is not None else get_session()
+
+    async def _throttle(self, url):
+        """按 host 的令牌桶：允许 burst 个请求立即发出，之后按 rate 匀速补充。"""
+        if self.rate <= 0:
+            return
+        host = urlsplit(url).netloc
+        lock = self._host_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            now = time.monotonic()
+            tokens, updated = self._host_tokens.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1.0:
+                wait = (1.0 - tokens) / self.rate
+                await asyncio.sleep(wait)
+                now += wait
+                tokens = 1.0
+            self._host_tokens[host] = (tokens - 1.0, now)
+
+    def _get_json_blocking(self, url, timeout):
+        stale = validators = None
+        cache = get_cache()
+        if cache is not None:
+            stale, validators = cache.get_stale(url)
+        return conditional_get(self.session, url, timeout, stale, validators)
+
+    async def _load(self, key, url, load, ttl, encode=None):
+        """
+        在并发与速率限制下于线程中执行 load()，并写入缓存 (encode 将结果转为可缓存的 JSON)。
+        load() 返回 (value, 条件请求验证器或 None)。
+        ttl: 秒数 / None (不可变) / callable(value) / awaitable (结果为秒数或 None)
+             callable 在事件循环中同步调用，不能阻塞；需要网络请求时应返回 awaitable (例如 asyncio.to_thread)
+        """
+        async with self._semaphore:
+            await self._throttle(url)
+            self.stats['requests'] += 1
+            value, validators = await asyncio.to_thread(load)
+        cache = get_cache()
+        if cache is not None:
+            try:
+                if callable(ttl):
+                    ttl = ttl(value)
+                # ttl 可以是等待中的任务 (例如 tracker 的有效期取决于同时请求的 meta)
+                if inspect.isawaitable(ttl):
+                    ttl = await ttl
+                cache.put(key, encode(value) if encode else value, ttl=ttl, validators=validators)
+            except Exception as e:
+                print(f"写入缓存失败 {key}: {e}")
+        return value
+
+    async def _cached(self, key, make_load, decode=None):
+        """缓存命中直接返回；否则与同一 key 的其他请求合并为一次 make_load()。"""
+        cache = get_cache()
+        if cache is not None:
+            hit = cache.get(key)
+            if hit is not None:
+                self.stats['cache_hits'] += 1
+                return decode(hit) if decode else hit
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.stats['coalesced'] += 1
+        else:
+            task = asyncio.ensure_future(make_load())
+            entry = [task, 0]
+            self._inflight[key] = entry
+            task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+        task = entry[0]
+        entry[1] += 1
+        try:
+            # shield: 某个等待者被取消时不影响其他合并到同一请求的等待者
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # 最后一个等待者被取消时，尚在排队 (未发出) 的请求也一并取消
+            if entry[1] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    async def get_json(self, url, timeout=10, ttl=None):
+        """GET 并解析 JSON，语义同 base_distribution._cached_get_json。"""
+        return await self._cached(
+            url, lambda: self._load(url, url, lambda: self._get_json_blocking(url, timeout), ttl)
+        )
+
+    async def get_eventtop_points(self, event_id, limit=None, until_ts=None, ttl=None):
+        """流式获取 eventtop points (EventtopPoints)，语义同 base_distribution.fetch_eventtop_buffer。"""
+        url = eventtop_url(event_id)
+        key = eventtop_points_key(event_id, limit, until_ts)
+
+        def load():
+            return stream_points(self.session, url, timeout=10, limit=limit, until_ts=until_ts), None
+
+        return await self._cached(
+            key,
+            lambda: self._load(key, url, load, ttl, encode=EventtopPoints.to_json),
+            decode=EventtopPoints.from_json,
+        )
+
+    # ---- Bestdori 接口 ----
+
+    async def fetch_event_meta(self, event_id):
+        try:
+            metadata = await self.get_json(event_meta_url(event_id), timeout=5, ttl=_meta_ttl)
+        except Exception:
+            return None
+        return parse_event_meta(event_id, metadata)
+
+    async def _meta_based_ttl(self, meta_task, event_id):
+        # 只等待完成，meta 请求失败时按 _event_data_ttl 的默认规则处理
+        await asyncio.wait([meta_task])
+        # meta 已写入缓存，这里通常不会再发请求
+        return await asyncio.to_thread(_event_data_ttl, event_id)
+
+    async def fetch_event_bundle(self, event_id, tiers=1000, need_info=True, metadata=None):
+        """
+        同时请求活动的 meta、eventtop 与 tracker。
+        返回 (meta, T10 scale, tracker DataFrame)；need_info=False 时只请求 tracker，meta / scale 为 None。
+        metadata: 已知的原始元数据 (例如 all.3.json 中的条目)，提供时不再请求 events/{id}.json，
+                  数据的缓存有效期也直接由它决定。
+        任一部分失败时对应位置为 None。
+        """
+        meta_task = ttl_task = None
+        if metadata is not None:
+            data_ttl = _meta_ttl(metadata)
+        elif need_info:
+            meta_task = asyncio.ensure_future(self.fetch_event_meta(event_id))
+            ttl_task = asyncio.ensure_future(self._meta_based_ttl(meta_task, event_id))
+            data_ttl = ttl_task
+        else:
+            # 只在需要写缓存时才确定有效期；_event_data_ttl 可能请求 meta，放到线程中执行
+            data_ttl = lambda _d: asyncio.to_thread(_event_data_ttl, event_id)
+
+        async def tracker():
+            try:
+                return parse_tracker(await self.get_json(tracker_url(event_id, tiers), timeout=10, ttl=data_ttl))
+            except Exception:
+                return None
+
+        async def scale():
+            try:
+                points = await self.get_eventtop_points(event_id, limit=T10_SCALE_POINTS, ttl=data_ttl)
+            except Exception as e:
+                print(f"Error fetching T10 for {event_id}: {e}")
+                return None
+            return top10_max_speed(points, event_id)
+
+        try:
+            if not need_info:
+                return None, None, await tracker()
+            if meta_task is None:
+                scale_value, df = await asyncio.gather(scale(), tracker())
+                return parse_event_meta(event_id, metadata), scale_value, df
+            meta, scale_value, df = await asyncio.gather(meta_task, scale(), tracker())
+            await ttl_task
+            return meta, scale_value, df
+        finally:
+            # ttl_task 可能被合并的 tracker / eventtop 请求共用，不在这里取消
+            if meta_task is not None and not meta_task.done():
+                meta_task.cancel()
+
+
+def run_sync(coro):
+    """
+    在同步代码中运行协程。当前线程已有运行中的事件循环时（例如 notebook），
+    改在独立线程中运行，避免 asyncio.run 报错。
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def fetch_event_bundles(event_ids, tiers=1000):
+    """同步接口：并发获取多个活动的 (meta, scale, tracker)，按输入顺序返回。"""
+    async def _run():
+        client = AsyncBestdoriClient()
+        return await asyncio.gather(*(client.fetch_event_bundle(eid, tiers) for eid in event_ids))
+    return run_sync(_run())
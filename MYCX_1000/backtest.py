@@ -0,0 +1,225 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from base_distribution import event_is_final, fetch_eventtop_buffer
+from config import BACKTEST_CONFIG
+from predictor import DataHandler, logger, write_json_atomic
+
+# ==========================================
+# 历史回测 (Backtest)
+# ==========================================
+# 对一批已结束的活动，在观测时刻网格 (默认开始后每 6 小时) 上逐个冻结时间并预测，
+# 与活动的真实分数线比较。每个时刻只使用当时可得的数据：
+#   - 目标分数线与 T10 极速截断到冻结时刻 (与 debug_hours 相同)
+#   - 历史活动只从目标活动开始前已经结束的活动中选取 (_plan_candidates)
+# 节律表使用当前版本 (由全部已结束活动统计)，这是唯一来自"未来"的输入。
+#
+# 同一活动的整个网格在一个 DataHandler 内按时刻递增完成：历史活动、历史拟合与 T10 流式状态只处理一次，
+# 目标活动的 eventtop 也只下载一次 (读到活动结束)，各时刻由 TopSpeedTracker 按冻结时刻截取，
+# 每个时刻的预测通过 DataHandler.sweep 计算 (与 run_prediction 结果相同，但不写 JSON)。
+# 不同活动分配到进程池并行执行。
+#
+# 输出:
+#   {output_dir}/backtest_results.csv  每个 (活动, tier, 时刻, 配置) 一行
+#   {output_dir}/backtest_summary.json 整体与按观测时刻的 MAPE / bias
+
+
+def hour_grid(total_hours, step=None):
+    """开始后每 step 小时一个观测时刻，不含活动结束时刻"""
+    step = float(step or BACKTEST_CONFIG['hour_step'])
+    return [float(h) for h in np.arange(step, total_hours, step)]
+
+
+def _freeze(handler, start_at, hours):
+    """把 handler 的时间冻结在开始后 hours 小时 (等价于 DataHandler(debug_hours=hours))"""
+    handler.debug_hours = hours
+    handler.debug_limit_ts = start_at + int(hours * 3600 * 1000)
+
+
+def _path_ape(cutoffs, actual):
+    """预测分数线在冻结时刻之后各真实数据点上的平均绝对百分比误差"""
+    if actual.empty:
+        return float('nan')
+    pred_t = np.array([c['time'] for c in cutoffs], dtype=float)
+    pred_ep = np.array([c['ep'] for c in cutoffs], dtype=float)
+    act_t = actual['time'].values.astype(float)
+    act_ep = actual['ep'].values.astype(float)
+    valid = act_ep > 0
+    if not np.any(valid):
+        return float('nan')
+    pred = np.interp(act_t[valid], pred_t, pred_ep)
+    return float(np.mean(np.abs(pred - act_ep[valid]) / act_ep[valid]))
+
+
+def backtest_event(event_id, hours=None, tiers=None, overrides=None, hour_step=None, quiet=True):
+    """
+    回测单个活动：返回行的列表 (dict)。
+    hours 为 None 时按 hour_step 生成网格；overrides 为 DataHandler.sweep 的配置列表 (默认只用当前配置)。
+    """
+    tiers = list(tiers or BACKTEST_CONFIG['tiers'])
+    overrides = list(overrides or [{}])
+    rows = []
+    sink = io.StringIO() if quiet else None
+    with (contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext()):
+        try:
+            # debug_hours 非空：关闭自动进度，冻结时刻由 _freeze 控制
+            handler = DataHandler(event_id, debug_hours=1)
+        except Exception as e:
+            logger.warning(f"Backtest: failed to init event={event_id}: {e}")
+            return [{'event_id': event_id, 'status': f"init: {e}"}]
+        try:
+            meta = handler.meta
+            if not event_is_final(meta):
+                return [{'event_id': event_id, 'status': 'not_final'}]
+            start_at = meta['start_at']
+            total_hours = (meta['end_at'] - start_at) / 3600000
+            grid = sorted(hours) if hours else hour_grid(total_hours, hour_step)
+            try:
+                # 整个活动只读取一次；若按每个时刻的 until_ts 读取，每个网格点都要重新下载并解析
+                handler.target_eventtop = fetch_eventtop_buffer(event_id, until_ts=meta['end_at'])
+            except Exception as e:
+                logger.warning(f"Backtest: failed to fetch eventtop for event={event_id}: {e}")
+            searched = set()
+            for h in grid:
+                _freeze(handler, start_at, h)
+                for tier in tiers:
+                    base = {'event_id': event_id, 'event_type': handler.event_type, 'tier': tier,
+                            'hours': h, 'progress': h / total_hours}
+                    try:
+                        handler.load_target_data(tier)
+                        if tier not in searched:
+                            handler.find_similar_events(tiers=tier)
+                            searched.add(tier)
+                        handler._activate_tier(tier)
+                        if not handler.history_events:
+                            rows.append(dict(base, status='no_history'))
+                            continue
+                        full = handler.full_target_data
+                        actual_final = float(full['ep'].iloc[-1])
+                        future = full[full['time'] > handler.debug_limit_ts]
+                        table, curves = handler.sweep(overrides, tiers=tier, curves=True)
+                        for config_id, (pred_final, cutoffs) in enumerate(zip(table['final_score'], curves)):
+                            err = pred_final / actual_final - 1.0 if actual_final > 0 else float('nan')
+                            rows.append(dict(
+                                base, config_id=config_id, status='ok',
+                                actual_final=actual_final, pred_final=float(pred_final),
+                                error=err, ape=abs(err), path_ape=_path_ape(cutoffs['cutoffs'], future),
+                            ))
+                    except Exception as e:
+                        logger.warning(f"Backtest: event={event_id} tier={tier} hours={h} failed: {e}")
+                        logger.debug(traceback.format_exc())
+                        rows.append(dict(base, status=f"error: {e}"))
+        finally:
+            handler.close()
+    return rows
+
+
+def _backtest_task(task):
+    return backtest_event(**task)
+
+
+def summarize(results):
+    """整体与按 (配置, 观测时刻) 汇总的 MAPE (最终分数)、bias (带符号的平均误差) 与 path MAPE"""
+    ok = results[results['status'] == 'ok'] if 'status' in results.columns else results.iloc[0:0]
+
+    def metrics(df):
+        return {
+            'runs': int(len(df)),
+            'events': int(df['event_id'].nunique()),
+            'mape': float(df['ape'].mean()),
+            'median_ape': float(df['ape'].median()),
+            'bias': float(df['error'].mean()),
+            'path_mape': float(df['path_ape'].mean()),
+        }
+
+    summary = {
+        'generated_at': int(time.time()),
+        'events': sorted(int(e) for e in results['event_id'].unique()) if len(results) else [],
+        'failed_runs': int(len(results) - len(ok)),
+    }
+    if ok.empty:
+        summary['overall'] = None
+        summary['by_hour'] = []
+        return summary
+    summary['overall'] = {int(cid): metrics(df) for cid, df in ok.groupby('config_id')}
+    summary['by_hour'] = [
+        dict(metrics(df), config_id=int(cid), hours=float(h))
+        for (cid, h), df in ok.groupby(['config_id', 'hours'])
+    ]
+    return summary
+
+
+def run_backtest(event_ids, hours=None, tiers=None, overrides=None, hour_step=None, workers=None, output_dir=None):
+    """
+    回测一批活动并写出结果文件；返回 (结果 DataFrame, 汇总 dict)。
+    各活动的结果按 event_ids 的顺序合并，与 worker 数无关。
+    """
+    workers = int(workers or BACKTEST_CONFIG['workers'])
+    output_dir = output_dir or BACKTEST_CONFIG['output_dir']
+    tasks = [
+        {'event_id': int(eid), 'hours': hours, 'tiers': tiers, 'overrides': overrides, 'hour_step': hour_step}
+        for eid in event_ids
+    ]
+    started = time.time()
+    if workers > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            per_event = list(pool.map(_backtest_task, tasks))
+    else:
+        per_event = [_backtest_task(task) for task in tasks]
+
+    results = pd.DataFrame([row for rows in per_event for row in rows])
+    summary = summarize(results)
+    summary['overrides'] = list(overrides or [{}])
+    summary['elapsed_seconds'] = round(time.time() - started, 2)
+
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, 'backtest_results.csv')
+    tmp = f"{results_path}.{os.getpid()}.tmp"
+    results.to_csv(tmp, index=False)
+    os.replace(tmp, results_path)
+    write_json_atomic(os.path.join(output_dir, 'backtest_summary.json'), summary)
+    logger.info(f"Backtest: {len(tasks)} events, {len(results)} rows in {summary['elapsed_seconds']}s -> {output_dir}")
+    return results, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="历史活动回测 (多个冻结时刻)")
+    parser.add_argument('events', type=int, nargs='+', help="活动 ID；给出两个 ID 并加 --range 时表示闭区间")
+    parser.add_argument('--range', action='store_true', help="把 events 的两个 ID 视为闭区间")
+    parser.add_argument('--hours', type=float, nargs='+', default=None, help="观测时刻 (小时)，默认每 hour_step 小时")
+    parser.add_argument('--step', type=float, default=None, help="观测时刻间隔 (小时)")
+    parser.add_argument('--tiers', type=int, nargs='+', default=None, help="回测的档位")
+    parser.add_argument('--workers', type=int, default=None, help="并行进程数")
+    parser.add_argument('--output-dir', default=None, help="结果输出目录")
+    parser.add_argument('--overrides', default=None, help="配置覆盖的 JSON 列表，例如 '[{}, {\"ratio_max\": 2.0}]'")
+    args = parser.parse_args()
+
+    event_ids = args.events
+    if args.range:
+        if len(event_ids) != 2:
+            parser.error("--range 需要两个活动 ID")
+        event_ids = list(range(min(event_ids), max(event_ids) + 1))
+    overrides = json.loads(args.overrides) if args.overrides else None
+
+    results, summary = run_backtest(
+        event_ids, hours=args.hours, tiers=args.tiers, overrides=overrides,
+        hour_step=args.step, workers=args.workers, output_dir=args.output_dir,
+    )
+    print(f"回测完成: {len(event_ids)} 个活动, {len(results)} 行, 失败 {summary['failed_runs']} 行, 用时 {summary['elapsed_seconds']}s")
+    for cid, m in (summary['overall'] or {}).items():
+        print(f"  配置 {cid}: MAPE={m['mape']:.2%} bias={m['bias']:+.2%} path MAPE={m['path_mape']:.2%} ({m['runs']} 次)")
+    for item in summary['by_hour']:
+        print(f"  [{item['config_id']}] +{item['hours']:.0f}h: MAPE={item['mape']:.2%} bias={item['bias']:+.2%} ({item['runs']} 次)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,102 @@
-import requests
 import pandas as pd
 import numpy as np
 import time
 import json
-from datetime import datetime, timedelta
 import os
-from chinese_calendar import is_workday
+import threading
+from collections import OrderedDict
 from io import BytesIO
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-# Module-level session to enable connection reuse and avoid FD leaks
-HTTP_SESSION = requests.Session()
-try:
-    adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=3)
-    HTTP_SESSION.mount('http://', adapter)
-    HTTP_SESSION.mount('https://', adapter)
-except Exception:
-    pass
+from cache import get_cache
+from calendar_service import CALENDAR
+from config import CACHE_CONFIG
+from eventtop_stream import EventtopPoints, max_speed, stream_points
+from http_client import conditional_get, get_session
+
+# 与 predictor 共用的 Session 与连接池 (http_client.get_session)
+HTTP_SESSION = get_session()
 
 # ================= 配置区域 =================
 EVENT_RANGE = range(200, 300) 
 BASE_URL = "https://bestdori.com/api/"
 SERVER = 3 # 国服
 OUTPUT_FILE = "base_speed_distribution.json"
+T10_SCALE_POINTS = 500 # 计算历史活动 T10 极速时使用的 eventtop 点数
 
 # ================= 核心工具函数 =================
 
-def fetch_event_meta(event_id):
-    """获取活动元数据"""
+def _cached_get_json(url, timeout, ttl=None):
+    """
+    经由本地缓存的 GET 请求，返回解析后的 JSON。
+    ttl: 秒数 / None (不可变) / callable(data) -> 秒数或 None
+    """
+    cache = get_cache()
+    stale = validators = None
+    if cache is not None:
+        hit = cache.get(url)
+        if hit is not None:
+            return hit
+        # 已过期但带有 ETag / Last-Modified 的内容：发送条件请求，304 时无需重新下载
+        stale, validators = cache.get_stale(url)
+    data, validators = conditional_get(HTTP_SESSION, url, timeout, stale, validators)
+    if cache is not None:
+        try:
+            cache.put(url, data, ttl=ttl(data) if callable(ttl) else ttl, validators=validators)
+        except Exception as e:
+            print(f"写入缓存失败 {url}: {e}")
+    return data
+
+def _meta_ttl(metadata):
+    """根据活动元数据决定缓存有效期：已结束的活动不可变，进行中的活动短 TTL。"""
+    try:
+        end_at = int(metadata["endAt"][SERVER])
+    except Exception:
+        # 本服尚未开放或字段缺失，稍后可能补全
+        return CACHE_CONFIG['pending_ttl']
+    grace_ms = CACHE_CONFIG['ended_grace_hours'] * 3600 * 1000
+    if end_at + grace_ms < time.time() * 1000:
+        return None
+    return CACHE_CONFIG['live_ttl']
+
+def event_is_final(meta):
+    """活动 (fetch_event_meta 的结果) 是否已结束足够久，其数据不会再变化。"""
+    if not meta or meta.get("end_at") is None:
+        return False
+    grace_ms = CACHE_CONFIG['ended_grace_hours'] * 3600 * 1000
+    return meta["end_at"] + grace_ms < time.time() * 1000
+
+def _event_data_ttl(event_id):
+    """tracker / eventtop 数据的有效期跟随其所属活动的状态。"""
+    try:
+        metadata = _cached_get_json(event_meta_url(event_id), timeout=5, ttl=_meta_ttl)
+        return _meta_ttl(metadata)
+    except Exception:
+        return CACHE_CONFIG['live_ttl']
+
+def fetch_events_index():
+    """获取 all.3.json 活动索引 (短 TTL 缓存)"""
+    try:
+        return _cached_get_json(f"{BASE_URL}events/all.3.json", timeout=8, ttl=CACHE_CONFIG['index_ttl'])
+    except Exception:
+        return None
+
+# ---- URL 与解析 (同步接口与 async_client 共用) ----
+
+def event_meta_url(event_id):
+    return f"{BASE_URL}events/{event_id}.json"
+
+def tracker_url(event_id, tiers=1000):
+    return f"{BASE_URL}tracker/data?server={SERVER}&event={event_id}&tier={tiers}"
+
+def eventtop_url(event_id):
+    # 使用 1小时 (3600000ms) 的间隔来获取较为平滑的极速，避免瞬时爆发的噪声
+    return f"{BASE_URL}eventtop/data?server={SERVER}&event={event_id}&mid=0&interval=3600000"
+
+def parse_event_meta(event_id, metadata):
+    """events/{id}.json -> 精简的活动元数据；本服未开放时返回 None"""
     try:
-        meta_url = f"{BASE_URL}events/{event_id}.json"
-        r = HTTP_SESSION.get(meta_url, timeout=5)
-        r.raise_for_status()
-        metadata = r.json()
         return {
             "event_id": event_id,
             "start_at": int(metadata["startAt"][SERVER]),
@@ -43,80 +106,126 @@ def fetch_event_meta(event_id):
     except:
         return None
 
-def fetch_tier_1000_data(event_id,tiers):
+def parse_tracker(tracker_data):
+    """tracker/data 响应 -> cutoffs DataFrame；无数据时返回 None"""
+    if not tracker_data or not tracker_data.get("result"):
+        return None
+    return pd.DataFrame(tracker_data["cutoffs"])
+
+def eventtop_points_key(event_id, limit=None, until_ts=None):
+    """流式解析结果 (EventtopPoints) 的缓存键；不同截取方式分别缓存"""
+    return f"{eventtop_url(event_id)}#points?limit={limit}&until={until_ts}"
+
+def top10_max_speed(points, event_id=None):
+    """
+    由 eventtop points (EventtopPoints) 计算该活动理论最大速度 (Scale Factor)
+    取 Top 3 速度的平均值，比单一最大值更稳定，计算见 eventtop_stream.max_speed
+    """
+    try:
+        return max_speed(points)
+    except Exception as e:
+        print(f"Error computing T10 speed for {event_id}: {e}")
+        return None
+
+# ---- 同步接口 ----
+
+def fetch_event_meta(event_id):
+    """获取活动元数据"""
+    try:
+        metadata = _cached_get_json(event_meta_url(event_id), timeout=5, ttl=_meta_ttl)
+    except:
+        return None
+    return parse_event_meta(event_id, metadata)
+
+# 进行中活动的 tracker 响应：url -> (data, validators)。缓存关闭时也能发送条件请求。
+# 按 LRU 只保留最近的 LIVE_TRACKER_ENTRIES 个 URL (当前活动的各 tier)，常驻服务中不会随活动切换无限增长
+_LIVE_TRACKERS = OrderedDict()
+_LIVE_TRACKERS_LOCK = threading.Lock()
+LIVE_TRACKER_ENTRIES = 16
+
+def _remember_live_tracker(url, data, validators):
+    with _LIVE_TRACKERS_LOCK:
+        _LIVE_TRACKERS[url] = (data, validators)
+        _LIVE_TRACKERS.move_to_end(url)
+        while len(_LIVE_TRACKERS) > LIVE_TRACKER_ENTRIES:
+            _LIVE_TRACKERS.popitem(last=False)
+
+def fetch_tracker_data(event_id, tiers=1000, revalidate=False):
+    """
+    获取 tracker/data 原始响应，失败时返回 None。
+    revalidate=True 用于进行中的目标活动：不看缓存有效期，每次都向服务器确认，
+    带上次响应的 ETag / Last-Modified；内容未变化时服务器返回 304，只需一次往返且不重新下载。
+    """
+    url = tracker_url(event_id, tiers)
+    try:
+        if not revalidate:
+            # 有效期只在写入缓存时才需要 (缓存关闭时不必为此请求 meta)
+            return _cached_get_json(url, timeout=10, ttl=lambda _d: _event_data_ttl(event_id))
+        cache = get_cache()
+        with _LIVE_TRACKERS_LOCK:
+            stale, validators = _LIVE_TRACKERS.get(url, (None, None))
+        if stale is None and cache is not None:
+            stale, validators = cache.get_stale(url)
+        data, validators = conditional_get(HTTP_SESSION, url, 10, stale, validators)
+        _remember_live_tracker(url, data, validators)
+        if cache is not None and data is not stale:
+            try:
+                cache.put(url, data, ttl=CACHE_CONFIG['live_ttl'], validators=validators)
+            except Exception as e:
+                print(f"写入缓存失败 {url}: {e}")
+        return data
+    except:
+        return None
+
+def tracker_signature(tracker_data):
+    """tracker/data 响应的 (点数, 最后一点的 time, ep)；内容相同则签名相同，无需重新解析"""
+    if not tracker_data or not tracker_data.get("result"):
+        return None
+    cutoffs = tracker_data.get("cutoffs") or []
+    if not cutoffs:
+        return (0, None, None)
+    last = cutoffs[-1]
+    return (len(cutoffs), last.get("time"), last.get("ep"))
+
+def fetch_tier_1000_data(event_id, tiers=1000):
     """获取 T1000 分数线数据 (Tracker API)"""
-    tracker_url = f"{BASE_URL}tracker/data?server={SERVER}&event={event_id}&tier={tiers}"
-    
     try:
-        r = HTTP_SESSION.get(tracker_url, timeout=10)
-        r.raise_for_status()
-        tracker_data = r.json()
-        if not tracker_data["result"]:
-            return None
-        return pd.DataFrame(tracker_data["cutoffs"])
+        return parse_tracker(fetch_tracker_data(event_id, tiers))
     except:
         return None
 
+def fetch_eventtop_buffer(event_id, limit=None, until_ts=None):
+    """
+    流式获取 T10 (eventtop) 数据，1小时间隔；返回 EventtopPoints。
+    limit / until_ts 见 eventtop_stream.read_points，满足后立即停止下载。
+    """
+    key = eventtop_points_key(event_id, limit, until_ts)
+    cache = get_cache()
+    if cache is not None:
+        hit = cache.get(key)
+        if hit is not None:
+            return EventtopPoints.from_json(hit)
+    points = stream_points(HTTP_SESSION, eventtop_url(event_id), timeout=10, limit=limit, until_ts=until_ts)
+    if cache is not None:
+        try:
+            cache.put(key, points.to_json(), ttl=_event_data_ttl(event_id))
+        except Exception as e:
+            print(f"写入缓存失败 {key}: {e}")
+    return points
+
 def fetch_top10_max_speed(event_id):
     """
     获取 T10 数据并计算该活动理论最大速度 (Scale Factor)
     API: eventtop
     """
-    # 使用 1小时 (3600000ms) 的间隔来获取较为平滑的极速，避免瞬时爆发的噪声
-    url = f"{BASE_URL}eventtop/data?server={SERVER}&event={event_id}&mid=0&interval=3600000"
-    
+    # 只需要开局的一段数据通常足够覆盖开局爆发期：取前 500 个点，
+    # eventtop 返回的是所有 top10 玩家的点，10个玩家每小时1个点，500 个点约 50 小时。
     try:
-        r = HTTP_SESSION.get(url, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        if not data or "points" not in data:
-            return None
-        
-        # 转换为 DataFrame
-        # 只需要前 200 条数据通常足够覆盖开局爆发期，但为了保险起见，
-        # 我们这里取前 500 条以确保覆盖到至少几小时的数据量，
-        # 因为 eventtop 返回的是所有 top10 玩家的点，10个玩家每小时1个点，100条只够10小时。
-        df = pd.DataFrame(data["points"]).head(500)
-        
-        if df.empty:
-            return None
-            
-        # 优化：仅处理前 N 条数据以节省性能
-        # df = df.head(500) 
-        
-        # === 核心逻辑：按 UID 分组计算速度 ===
-        # 1. 排序
-        df = df.sort_values(by=["uid", "time"])
-        
-        # 2. 计算差分 (每个 UID 内部计算)
-        df["pt_diff"] = df.groupby("uid")["value"].diff()
-        df["time_diff"] = df.groupby("uid")["time"].diff()
-        
-        # 3. 计算速度 (EP / 分钟)
-        # time_diff 单位是毫秒，所以要 / 1000 / 60
-        df["speed"] = df["pt_diff"] / (df["time_diff"] / 1000 / 60)
-        
-        # 4. 清洗数据
-        # 去除 NaN (第一条数据没有差分)
-        # 去除 速度 < 0 (可能是掉档或数据错误)
-        # 去除 速度过大
-        valid_speeds = df[(df["speed"] > 0) & (df["speed"] < 1000000)]["speed"]
-        
-        if valid_speeds.empty:
-            return None
-            
-        # 5. 获取极速
-        # 取最大的前几个值的平均，或者直接取最大值（需排除极端异常值）
-        # 这里采用取 Top 3 的平均值作为 Scale Factor，比单一最大值更稳定
-        top_speeds = valid_speeds.nlargest(3).values
-        if len(top_speeds) > 0:
-            return np.mean(top_speeds)
-        else:
-            return valid_speeds.max()
-            
+        points = fetch_eventtop_buffer(event_id, limit=T10_SCALE_POINTS)
     except Exception as e:
         print(f"Error fetching T10 for {event_id}: {e}")
         return None
+    return top10_max_speed(points, event_id)
 
 def calculate_speed_tracker(df):
     """计算 Tracker 数据 (T1000) 的速度"""
@@ -129,104 +238,25 @@ def calculate_speed_tracker(df):
     return df
 
 def get_day_type(dt):
-    """判断日期类型 (工作日 vs 周末)"""
-    # 1. 优先判断特定时间段的模式切换
-    # 周五 17:00 后 -> 周末模式
-    if dt.weekday() == 4 and dt.hour >= 17:
-        return "weekend"
-    # 周日 23:00 后 -> 工作日模式
-    if dt.weekday() == 6 and dt.hour >= 23:
-        return "weekday"
-
-    # 2. 使用 chinesecalendar (如果可用)
-    if is_workday is not None:
-        try:
-            if is_workday(dt.date()):
-                return "weekday"
-            else:
-                return "weekend"
-        except:
-            pass
-
-    # 3. Fallback
-    if dt.weekday() >= 5:
-        return "weekend"
-    return "weekday"
+    """判断日期类型 (工作日 vs 周末)，规则见 calendar_service"""
+    return CALENDAR.day_type(dt)
 
 # ================= 主逻辑 =================
 
-def main():
-    distribution_data = {
-        "weekday": {h: [] for h in range(24)},
-        "weekend": {h: [] for h in range(24)}
-    }
-    
-    valid_event_count = 0
+def main(resume=None, update=False, tiers=None):
     print("🐱 CatGPT 正在启动分析引擎喵...")
 
-    for event_id in EVENT_RANGE:
-        # 1. 获取基础信息
-        meta = fetch_event_meta(event_id)
-        if not meta:
-            continue
-            
-        # 2. 获取 T1000 数据
-        df_1000 = fetch_tier_1000_data(event_id)
-        if df_1000 is None or df_1000.empty:
-            continue
-            
-        # 3. 【新逻辑】获取 T10 极速作为 Scale Factor
-        scale_factor = fetch_top10_max_speed(event_id)
-        
-        if not scale_factor or scale_factor < 100: # 速度太小说明数据有问题
-            print(f"⚠️ Event {event_id}: 无法计算有效的 T10 极速，跳过。")
-            continue
-            
-        # 4. 处理 T1000 数据
-        df_1000 = calculate_speed_tracker(df_1000)
-        
-        # 归一化
-        df_1000["norm_speed"] = df_1000["speed"] / scale_factor
-        
-        # 5. 筛选有效时间段 (排除首日24h，尾日48h)
-        start_ts = meta["start_at"]
-        end_ts = meta["end_at"]
-        valid_start = start_ts + 24 * 3600 * 1000
-        valid_end = end_ts - 48 * 3600 * 1000
-        
-        df_valid = df_1000[(df_1000["time"] >= valid_start) & (df_1000["time"] <= valid_end)].copy()
-        
-        # 转换时间
-        df_valid["dt"] = pd.to_datetime(df_valid["time"], unit="ms") + timedelta(hours=8)
-        
-        # 填入数据桶
-        for _, row in df_valid.iterrows():
-            hour = row["dt"].hour
-            day_type = get_day_type(row["dt"])
-            
-            # 过滤异常归一化值 (T1000 速度不应超过 T10 极速太多)
-            if 0 <= row["norm_speed"] <= 1.2: 
-                distribution_data[day_type][hour].append(row["norm_speed"])
-        
-        valid_event_count += 1
-        print(f"✅ Event {event_id} | T10极速: {scale_factor:.0f} EP/min | 已归档")
-        time.sleep(0.5)
-
-    # ================= 聚合输出 =================
-    final_distribution = {"weekday": {}, "weekend": {}}
-    
-    for dtype in ["weekday", "weekend"]:
-        for h in range(24):
-            speeds = distribution_data[dtype][h]
-            if speeds:
-                final_distribution[dtype][h] = {
-                    "mean": float(np.mean(speeds)),
-                    "median": float(np.median(speeds)),
-                    "std": float(np.std(speeds)),
-                    "count": len(speeds)
-                }
-            else:
-                final_distribution[dtype][h] = None
+    # 基础信息、T1000 数据与 T10 极速 (Scale Factor) 由异步客户端并发获取，
+    # 每个活动的分桶结果写入检查点，中断后可续跑；update=True 时只折叠新结束的活动，见 distribution_builder
+    # 每个 tier 生成 all 与各活动类型的节律表 (seasonality_store)；T1000 的 all 表同时输出为 OUTPUT_FILE
+    from distribution_builder import build_tables
+    tiers = list(tiers or [1000])
+    built = build_tables(list(EVENT_RANGE), tiers=tiers, resume=resume, update=update)
+    if 1000 not in tiers:
+        print(f"\n🎉 分析结束！已生成 T{tiers} 的节律表。")
+        return
+    state = built[(1000, None)]
+    final_distribution, valid_event_count = state.summary(), state.valid_event_count
 
     with open(OUTPUT_FILE, "w") as f:
         json.dump(final_distribution, f, indent=4)
@@ -306,4 +336,10 @@ def main():
         print(f"Plotting failed: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="重建 base_speed_distribution.json")
+    parser.add_argument('--fresh', action='store_true', help="忽略已有检查点，从头开始")
+    parser.add_argument('--update', action='store_true', help="只把尚未计入的活动折叠进已有的分布状态")
+    parser.add_argument('--tiers', type=int, nargs='+', default=None, help="生成节律表的档位，默认 1000")
+    args = parser.parse_args()
+    main(resume=False if args.fresh else None, update=args.update, tiers=args.tiers)
\ No newline at end of file
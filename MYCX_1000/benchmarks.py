@@ -0,0 +1,342 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from base_distribution import calculate_speed_tracker, fetch_event_meta, fetch_tracker_data, parse_tracker
+from config import BENCHMARK_CONFIG, DEFAULT_CONFIG
+from predictor import CosineModeler, DataHandler, SeasonalityHandler, _prepare_history_task, write_json_atomic
+import prediction_stages as stages
+
+# ==========================================
+# 性能基准 (Benchmarks)
+# ==========================================
+# 对预测流程中的热点分别计时并记录峰值内存 (tracemalloc)，与保存的基线比较：
+#   calculate_speed_tracker / remove_seasonality / apply_seasonality / CosineModeler.fit /
+#   历史活动处理 (去节律化 + 拟合，history_count 个) / 顶部平滑 / plot_final
+# 数据集:
+#   synthetic   按 BENCHMARK_CONFIG 生成的 9 天活动与历史活动 (固定随机种子，不访问网络)
+#   event{id}   真实活动的 tracker 数据 (--event，经 HTTP 缓存获取)
+# 基线按数据集分别保存在 benchmarks_baseline.json；任一用例的最短耗时 (比中位数更不受机器负载影响)
+# 或峰值内存超过基线 x tolerance 时退出码为 1，可直接放在定时任务之前运行。
+# 基线只对录制它的机器与依赖版本有意义，因此不随仓库提交：在目标机器上先运行一次 --save-baseline。
+# 运行环境 (environment()) 与基线不一致时不做比较，退出码为 2。
+
+H = 3600 * 1000
+
+
+def _synthetic_tracker(start_at, days, interval_minutes, seed, amp=1.0):
+    """tracker/data 格式的 cutoffs：昼夜波动 + 线性增长 + 最后一天冲刺，带噪声"""
+    rng = np.random.default_rng(seed)
+    total_hours = days * 24
+    t = start_at + np.arange(0, total_hours * H + 1, interval_minutes * 60 * 1000, dtype=np.int64)
+    hours = (t - start_at) / H
+    speed = amp * (400 + 150 * np.sin((hours - 6) / 24 * 2 * np.pi) + 2 * hours
+                   + np.where(hours > total_hours - 24, (hours - (total_hours - 24)) * 40, 0))
+    speed = np.clip(speed * (1 + 0.05 * rng.standard_normal(len(t))), 0, None)
+    ep = np.cumsum(speed * interval_minutes).astype(np.int64)
+    return {"result": True, "cutoffs": [{"time": int(a), "ep": int(b)} for a, b in zip(t, ep)]}
+
+
+def _prepare_frame(tracker, start_at, scale):
+    df = calculate_speed_tracker(parse_tracker(tracker))
+    df['hours_elapsed'] = (df['time'] - start_at) / H
+    df['norm_speed'] = df['speed'] / scale
+    return df
+
+
+def synthetic_dataset(cfg=BENCHMARK_CONFIG):
+    days = int(cfg['event_days'])
+    interval = int(cfg['interval_minutes'])
+    # 国服活动通常 15:00 (UTC+8) 开始
+    start_at = 1700000000000 - (1700000000000 % H) + 7 * H
+    histories = []
+    for i in range(int(cfg['history_count'])):
+        h_start = start_at - (i + 1) * 30 * 24 * H
+        tracker = _synthetic_tracker(h_start, days, interval, seed=100 + i, amp=1.0 + 0.05 * i)
+        histories.append((h_start, h_start + days * 24 * H, tracker))
+    return _dataset('synthetic', start_at, start_at + days * 24 * H,
+                    _synthetic_tracker(start_at, days, interval, seed=1), histories, cfg)
+
+
+def recorded_dataset(event_id, history_ids=None, tier=1000, cfg=BENCHMARK_CONFIG):
+    """真实活动数据；history_ids 缺省时取之前 history_count 个有数据的活动"""
+    meta = fetch_event_meta(event_id)
+    tracker = fetch_tracker_data(event_id, tier)
+    if not meta or parse_tracker(tracker) is None:
+        raise ValueError(f"无法获取活动 {event_id} 的数据")
+    candidates = history_ids or range(event_id - 1, max(event_id - 40, 0), -1)
+    histories = []
+    for eid in candidates:
+        if len(histories) >= int(cfg['history_count']):
+            break
+        h_meta = fetch_event_meta(eid)
+        h_tracker = fetch_tracker_data(eid, tier)
+        if h_meta and parse_tracker(h_tracker) is not None:
+            histories.append((h_meta['start_at'], h_meta['end_at'], h_tracker))
+    return _dataset(f"event{event_id}", meta['start_at'], meta['end_at'], tracker, histories, cfg)
+
+
+def _dataset(name, start_at, end_at, tracker, histories, cfg):
+    # 计时只关心数据规模，归一化使用固定的 T10 scale
+    scale = 20000.0
+    with contextlib.redirect_stdout(io.StringIO()):
+        seasonality = SeasonalityHandler(
+            json_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'base_speed_distribution.json'),
+            tz_offset=8,
+            panic_ease_power=DEFAULT_CONFIG['panic_ease_power'],
+            weekend_multiplier=DEFAULT_CONFIG['weekend_multiplier'],
+            panic_scaler=DEFAULT_CONFIG['panic_scaler'],
+        )
+    target = _prepare_frame(tracker, start_at, scale)
+    observed = target[target['hours_elapsed'] <= float(cfg['observed_hours'])]
+    history_frames = []
+    for h_start, h_end, h_tracker in histories:
+        history_frames.append((h_start, (h_end - h_start) / H, _prepare_frame(h_tracker, h_start, scale)))
+    return {
+        'name': name,
+        'start_at': start_at,
+        'end_at': end_at,
+        'total_hours': (end_at - start_at) / H,
+        'tracker': tracker,
+        'target': target,
+        'observed': observed,
+        'histories': history_frames,
+        'seasonality': seasonality,
+    }
+
+
+def _history_task(ds, h_start, total_hours, df):
+    return {
+        'seasonality': ds['seasonality'],
+        'time': df['time'].values,
+        'hours_elapsed': df['hours_elapsed'].values,
+        'norm_speed': df['norm_speed'].values,
+        'start_at': h_start,
+        'total_hours': total_hours,
+        'popt': None,
+    }
+
+
+def _plot_handler(ds):
+    """plot_final 需要的最小 DataHandler (不经过 __init__，不访问网络)"""
+    handler = DataHandler.__new__(DataHandler)
+    handler.meta = {'start_at': ds['start_at'], 'end_at': ds['end_at']}
+    handler.target_event_id = ds['name']
+    handler.debug_hours = float(ds['observed']['hours_elapsed'].max())
+    handler.target_data = ds['observed']
+    handler.full_target_data = ds['target']
+    handler._active_tier = 1000
+    handler._seasonality_by_tier = {1000: ds['seasonality']}
+    return handler
+
+
+def build_cases(ds, cfg=BENCHMARK_CONFIG):
+    """[(用例名, 无参数函数)]；准备工作在这里完成，不计入耗时"""
+    seasonality = ds['seasonality']
+    modeler = CosineModeler()
+    total_hours = ds['total_hours']
+    t_grid = np.linspace(0, total_hours, int(cfg['grid_points']))
+
+    h_start, h_total, h_df = ds['histories'][0]
+    fit_task = _history_task(ds, h_start, h_total, h_df)
+    season_factor, skeleton, _, _ = _prepare_history_task(fit_task)
+    fit_mask = np.isfinite(skeleton)
+    fit_t, fit_y = h_df['hours_elapsed'].values[fit_mask], skeleton[fit_mask]
+    history_tasks = [_history_task(ds, *h) for h in ds['histories']]
+
+    popt = modeler.fit(fit_t, fit_y, h_total)
+    skeleton_pred = modeler.shape_function(t_grid, *popt, total_hours)
+    speed_pred, _ = seasonality.apply_seasonality(t_grid, skeleton_pred, ds['start_at'], total_hours=total_hours, t_panic=popt[4])
+    # 让曲线覆盖平滑的两个阶段与硬上限
+    norm_pred = speed_pred / np.max(speed_pred) * 0.95
+
+    observed = ds['observed']
+    target_df = seasonality.remove_seasonality(observed)
+    t_score = np.concatenate([observed['hours_elapsed'].values, t_grid[t_grid >= observed['hours_elapsed'].max()]])
+    y_score = np.linspace(0, float(ds['target']['ep'].iloc[-1]), len(t_score))
+    handler = _plot_handler(ds)
+    raw = parse_tracker(ds['tracker'])
+
+    smooth_args = (DEFAULT_CONFIG['smooth_thresh1'], DEFAULT_CONFIG['smooth_thresh2'], DEFAULT_CONFIG['smooth_hard_cap'])
+    return [
+        ('calculate_speed_tracker', lambda: calculate_speed_tracker(raw.copy())),
+        ('remove_seasonality', lambda: seasonality.remove_seasonality(ds['target'])),
+        ('apply_seasonality', lambda: seasonality.apply_seasonality(
+            t_grid, skeleton_pred, ds['start_at'], total_hours=total_hours, t_panic=popt[4])),
+        ('fit', lambda: modeler.fit(fit_t, fit_y, h_total)),
+        (f"history_fits[{len(history_tasks)}]", lambda: [_prepare_history_task(task) for task in history_tasks]),
+        ('top_smoothing', lambda: stages.smooth_top(norm_pred, *smooth_args)),
+        ('plot_final', lambda: handler.plot_final(
+            target_df, t_grid, skeleton_pred, norm_pred, t_score, y_score, return_type='bytes')),
+    ]
+
+
+def measure(fn, repeat=None, min_sample_seconds=None):
+    """返回 {'median_ms', 'min_ms', 'number', 'peak_kib'}；number 为每个样本内的调用次数"""
+    repeat = int(repeat or BENCHMARK_CONFIG['repeat'])
+    min_sample = float(min_sample_seconds or BENCHMARK_CONFIG['min_sample_seconds'])
+    fn()  # 预热 (导入、缓存、workspace 分配)
+
+    # 与 timeit.autorange 相同：调用次数逐步翻倍，直到单个样本足够长
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - started >= min_sample or number >= 1 << 16:
+            break
+        number *= 2
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started) / number * 1000.0)
+
+    # 峰值内存单独测量一次，避免 tracemalloc 的开销影响计时
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'median_ms': statistics.median(samples),
+        'min_ms': min(samples),
+        'number': number,
+        'peak_kib': peak / 1024.0,
+    }
+
+
+def run_benchmarks(ds, only=None, repeat=None):
+    results = {}
+    for name, fn in build_cases(ds):
+        if only and not any(key in name for key in only):
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = measure(fn, repeat=repeat)
+    return results
+
+
+def load_baseline(path=None):
+    path = path or BENCHMARK_CONFIG['baseline_path']
+    if not os.path.exists(path):
+        return {'datasets': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(dataset, results, path=None):
+    """更新一个数据集的基线 (其他数据集保持不变)"""
+    path = path or BENCHMARK_CONFIG['baseline_path']
+    baseline = load_baseline(path)
+    baseline.setdefault('datasets', {})[dataset] = {
+        'recorded_at': int(time.time()),
+        'environment': environment(),
+        'results': results,
+    }
+    write_json_atomic(path, baseline)
+
+
+def environment():
+    import scipy
+    return {
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scipy': scipy.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def environment_mismatch(recorded, current=None):
+    """基线的录制环境与当前环境不同的项 [(键, 基线, 当前)]"""
+    current = current or environment()
+    recorded = recorded or {}
+    return [(key, recorded.get(key), value) for key, value in current.items() if recorded.get(key) != value]
+
+
+def compare(results, baseline_results, time_tolerance=None, memory_tolerance=None):
+    """[(用例名, 本次结果, 基线结果或 None, 状态)]；状态为 ok / slower / memory / new"""
+    time_tol = float(time_tolerance or BENCHMARK_CONFIG['time_tolerance'])
+    mem_tol = float(memory_tolerance or BENCHMARK_CONFIG['memory_tolerance'])
+    rows = []
+    for name, current in results.items():
+        base = (baseline_results or {}).get(name)
+        if base is None:
+            status = 'new'
+        elif current['min_ms'] > base['min_ms'] * time_tol:
+            status = 'slower'
+        elif current['peak_kib'] > base['peak_kib'] * mem_tol:
+            status = 'memory'
+        else:
+            status = 'ok'
+        rows.append((name, current, base, status))
+    return rows
+
+
+def report(rows):
+    print(f"{'case':<26}{'median ms':>12}{'min ms':>10}{'peak KiB':>11}{'base min':>10}{'x':>7}{'base KiB':>10}  status")
+    for name, cur, base, status in rows:
+        base_ms = f"{base['min_ms']:.3f}" if base else '-'
+        ratio = f"{cur['min_ms'] / base['min_ms']:.2f}" if base and base['min_ms'] > 0 else '-'
+        base_kib = f"{base['peak_kib']:.0f}" if base else '-'
+        print(f"{name:<26}{cur['median_ms']:>12.3f}{cur['min_ms']:>10.3f}{cur['peak_kib']:>11.0f}{base_ms:>10}{ratio:>7}{base_kib:>10}  {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预测热点的性能基准")
+    parser.add_argument('--event', type=int, default=None, help="使用真实活动的数据 (默认使用合成数据)")
+    parser.add_argument('--history', type=int, nargs='+', default=None, help="与 --event 一起使用的历史活动 ID")
+    parser.add_argument('--only', nargs='+', default=None, help="只运行名称包含这些关键字的用例")
+    parser.add_argument('--repeat', type=int, default=None, help="每个用例的计时样本数")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果保存为该数据集的基线")
+    parser.add_argument('--baseline', default=None, help="基线文件路径")
+    args = parser.parse_args()
+
+    if args.event is not None:
+        ds = recorded_dataset(args.event, args.history)
+    else:
+        ds = synthetic_dataset()
+    print(f"数据集 {ds['name']}: 目标 {len(ds['target'])} 点 ({ds['total_hours']:.0f}h), 历史活动 {len(ds['histories'])} 个")
+
+    results = run_benchmarks(ds, only=args.only, repeat=args.repeat)
+    baseline = load_baseline(args.baseline).get('datasets', {}).get(ds['name'])
+    mismatch = environment_mismatch(baseline.get('environment')) if baseline else []
+    # 环境不同时只显示结果，不与基线比较
+    rows = compare(results, baseline['results'] if baseline and not mismatch else None)
+    report(rows)
+
+    if args.save_baseline:
+        save_baseline(ds['name'], results, args.baseline)
+        print(f"基线已保存: {args.baseline or BENCHMARK_CONFIG['baseline_path']} [{ds['name']}]")
+        return
+    if mismatch:
+        for key, recorded, current in mismatch:
+            print(f"  {key}: 基线 {recorded} / 当前 {current}")
+        print("基线来自不同的机器或依赖版本，未做比较；请在本机运行 --save-baseline")
+        sys.exit(2)
+    if not baseline:
+        print("没有该数据集的基线，未做比较；请在本机运行 --save-baseline")
+        sys.exit(2)
+    regressions = [name for name, _, _, status in rows if status in ('slower', 'memory')]
+    if regressions:
+        print(f"性能退化: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from config import CACHE_CONFIG
+
+# ==========================================
+# 本地磁盘缓存 (Content-addressed DiskCache)
+# ==========================================
+# 结构:
+#   {cache_dir}/index.sqlite         key -> (digest, size, expires_at, atime, validators)
+#   {cache_dir}/blobs/ab/abcdef....  gzip 压缩的 JSON 内容，文件名为内容的 sha256
+# 相同内容只存一份（例如大量 `{"result": false}` 的空响应），按 atime 做 LRU 淘汰。
+# 过期条目不会立即删除：带有 ETag / Last-Modified 的内容可以用条件请求重新验证 (get_stale)。
+#
+# daemon、Streamlit、历史拟合进程池与回测进程池共用同一个目录，索引放在 sqlite 中由其处理跨进程锁：
+#   - put 只写入一行，其他进程立即可见，不会覆盖彼此的条目
+#   - 删除条目与检查 blob 是否仍被引用在同一个写事务内完成，不会删掉其他进程刚写入的 blob
+#   - 读取时的 atime 更新先在内存中累积，由 flush() 批量写入 (超过 FLUSH_EVERY 条或 FLUSH_SECONDS 秒)，
+#     LRU 淘汰也在 flush() 中进行
+# 旧版本的 index.json 在首次打开时导入。
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    atime REAL NOT NULL,
+    validators TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime);
+"""
+
+
+class DiskCache:
+    FLUSH_EVERY = 256
+    FLUSH_SECONDS = 60.0
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, 'blobs')
+        self.db_path = os.path.join(cache_dir, 'index.sqlite')
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.RLock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._conn = None
+        self._pid = None
+        self._touched = {}          # key -> atime，尚未写入索引
+        self._last_flush = time.time()
+        self._db()
+        self._migrate_json_index()
+
+    def _db(self):
+        # 进程池 fork 出的子进程不能沿用父进程的连接
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+            self._touched = {}
+        return self._conn
+
+    @contextmanager
+    def _write(self):
+        """跨进程的写事务 (BEGIN IMMEDIATE)"""
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            # COMMIT 本身失败 (例如超时后的 SQLITE_BUSY) 时事务仍未结束，也要回滚，否则之后的写入都会失败
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+    def _migrate_json_index(self):
+        legacy = os.path.join(self.cache_dir, 'index.json')
+        if not os.path.exists(legacy):
+            return
+        try:
+            with open(legacy, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            rows = [
+                (key, e['digest'], int(e['size']), e.get('expires_at'), float(e.get('atime', 0)),
+                 json.dumps(e['validators']) if e.get('validators') else None)
+                for key, e in (data.items() if isinstance(data, dict) else [])
+            ]
+            with self._lock, self._write() as conn:
+                conn.executemany('INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?, ?, ?)', rows)
+        except Exception:
+            # 索引损坏时直接丢弃，blob 会在淘汰时被清理
+            pass
+        try:
+            os.remove(legacy)
+        except OSError:
+            pass
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _write_atomic(self, path, payload):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+
+    def _entry(self, key):
+        row = self._db().execute(
+            'SELECT digest, expires_at, validators FROM entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'digest': row[0], 'expires_at': row[1], 'validators': json.loads(row[2]) if row[2] else None}
+
+    def _read(self, key, entry):
+        try:
+            with open(self._blob_path(entry['digest']), 'rb') as f:
+                value = json.loads(gzip.decompress(f.read()).decode('utf-8'))
+        except Exception:
+            self._drop(key)
+            return None
+        self._touched[key] = time.time()
+        self._maybe_flush()
+        return value
+
+    def get(self, key):
+        """返回缓存的 JSON 值；未命中或已过期返回 None。"""
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                metrics.cache_lookup('disk', 'miss')
+                return None
+            expires_at = entry.get('expires_at')
+            if expires_at is not None and expires_at < time.time():
+                metrics.cache_lookup('disk', 'expired')
+                # 没有验证器的过期条目不可能再被使用
+                if not entry.get('validators'):
+                    self._drop(key)
+                return None
+            value = self._read(key, entry)
+            metrics.cache_lookup('disk', 'miss' if value is None else 'hit')
+            return value
+
+    def get_stale(self, key):
+        """
+        忽略有效期读取条目，用于条件请求。
+        返回 (value, validators)；不存在时为 (None, None)。
+        """
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                return None, None
+            value = self._read(key, entry)
+            if value is None:
+                return None, None
+            return value, entry.get('validators')
+
+    def put(self, key, value, ttl=None, validators=None):
+        """
+        写入 JSON 值。
+        ttl: 有效期（秒）；None 表示不可变（仅会被 LRU 淘汰）。
+        validators: 响应的 {'etag', 'last_modified'}，过期后用于条件请求。
+        """
+        payload = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(payload).hexdigest()
+        blob = gzip.compress(payload, compresslevel=6)
+        now = time.time()
+        with self._lock, self._write() as conn:
+            # 在写事务内检查 blob：与 _drop 的删除互斥
+            path = self._blob_path(digest)
+            if not os.path.exists(path):
+                self._write_atomic(path, blob)
+            conn.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                (key, digest, len(blob), (now + float(ttl)) if ttl is not None else None, now,
+                 json.dumps(validators) if validators else None),
+            )
+            self._touched.pop(key, None)
+        self._maybe_flush()
+
+    def _drop(self, key):
+        with self._lock, self._write() as conn:
+            self._drop_locked(conn, key)
+            self._touched.pop(key, None)
+
+    def _drop_locked(self, conn, key):
+        row = conn.execute('SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return
+        conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        if conn.execute('SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (row[0],)).fetchone() is None:
+            try:
+                os.remove(self._blob_path(row[0]))
+            except OSError:
+                pass
+
+    def _evict(self, conn):
+        total = conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM entries GROUP BY digest)'
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 最久未访问的先淘汰；同一 blob 的所有引用都被移除后才真正释放空间
+        for key, digest, size in conn.execute('SELECT key, digest, size FROM entries ORDER BY atime').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._drop_locked(conn, key)
+            if conn.execute('SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (digest,)).fetchone() is None:
+                total -= size
+
+    def _maybe_flush(self):
+        if len(self._touched) >= self.FLUSH_EVERY or time.time() - self._last_flush >= self.FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        """将累积的 atime 更新批量写入索引，并按 max_bytes 做 LRU 淘汰。"""
+        with self._lock:
+            self._last_flush = time.time()
+            touched, self._touched = self._touched, {}
+            try:
+                with self._write() as conn:
+                    conn.executemany(
+                        'UPDATE entries SET atime = MAX(atime, ?) WHERE key = ?',
+                        [(atime, key) for key, atime in touched.items()],
+                    )
+                    self._evict(conn)
+            except Exception:
+                pass
+
+    def clear(self):
+        with self._lock, self._write() as conn:
+            for (key,) in conn.execute('SELECT key FROM entries').fetchall():
+                self._drop_locked(conn, key)
+            self._touched = {}
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """
+    返回进程内共享的 DiskCache；若配置关闭或目录不可写则返回 None（调用方直接走网络）。
+    """
+    global _CACHE
+    if not CACHE_CONFIG.get('enabled', True):
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            try:
+                _CACHE = DiskCache(CACHE_CONFIG['cache_dir'], CACHE_CONFIG.get('max_bytes', 512 * 1024 * 1024))
+                atexit.register(_CACHE.flush)
+            except Exception as e:
+                print(f"缓存目录不可用，已禁用本地缓存: {e}")
+                CACHE_CONFIG['enabled'] = False
+                return None
+        return _CACHE
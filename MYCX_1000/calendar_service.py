@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+import threading
+
+import numpy as np
+
+try:
+    from chinese_calendar import is_workday
+except Exception:
+    is_workday = None
+
+# ==========================================
+# 日期类型日历 (DayTypeCalendar)
+# ==========================================
+# base_distribution 建分布和 SeasonalityHandler 去节律化共用同一套规则：
+#   1. 周五 17:00 后 -> 周末模式；周日 23:00 后 -> 工作日模式
+#   2. 其余时间按 chinese_calendar 的法定工作日/节假日
+#   3. chinese_calendar 不可用或超出其支持年份时，按普通周末判断
+# 节假日判断按 64 天一段预先算成 bool 数组，并用 LRU 保留最近使用的段，
+# 因此逐行调用 is_workday 的开销只在每段第一次出现时支付一次。
+
+WEEKDAY = 0
+WEEKEND = 1
+DAY_TYPE_NAMES = ('weekday', 'weekend')
+
+_EPOCH = date(1970, 1, 1)
+_DAY_MS = 86400 * 1000
+_HOUR_MS = 3600 * 1000
+
+
+class DayTypeCalendar:
+    def __init__(self, span_days=64, max_spans=64):
+        self.span_days = int(span_days)
+        self.max_spans = int(max_spans)
+        self._spans = OrderedDict()  # span index -> bool 数组 (是否为周末/节假日)
+        self._lock = threading.Lock()
+
+    def _span(self, idx):
+        with self._lock:
+            flags = self._spans.get(idx)
+            if flags is not None:
+                self._spans.move_to_end(idx)
+                return flags
+        first = _EPOCH + timedelta(days=idx * self.span_days)
+        flags = np.empty(self.span_days, dtype=bool)
+        for i in range(self.span_days):
+            d = first + timedelta(days=i)
+            weekend = d.weekday() >= 5
+            if is_workday is not None:
+                try:
+                    weekend = not is_workday(d)
+                except Exception:
+                    pass
+            flags[i] = weekend
+        flags.setflags(write=False)
+        with self._lock:
+            self._spans[idx] = flags
+            while len(self._spans) > self.max_spans:
+                self._spans.popitem(last=False)
+        return flags
+
+    def _holiday_flags(self, days):
+        """days: 本地日期（自 1970-01-01 起的天数）数组 -> 是否为周末/节假日。"""
+        spans = days // self.span_days
+        first, last = int(spans.min()), int(spans.max())
+        table = np.concatenate([self._span(i) for i in range(first, last + 1)])
+        return table[days - first * self.span_days]
+
+    def local_parts(self, timestamps_ms, tz_offset=8):
+        """UTC 毫秒时间戳 -> (本地天数, 本地小时, 星期几 Monday=0)"""
+        local_ms = np.asarray(timestamps_ms, dtype=float) + tz_offset * _HOUR_MS
+        day = np.floor(local_ms / _DAY_MS).astype(np.int64)
+        hour = np.floor(local_ms / _HOUR_MS).astype(np.int64) % 24
+        weekday = (day + 3) % 7  # 1970-01-01 是周四
+        return day, hour, weekday
+
+    def day_types(self, timestamps_ms, tz_offset=8):
+        """
+        向量化日期类型：UTC 毫秒时间戳数组 -> int8 数组 (WEEKDAY=0 / WEEKEND=1)。
+        """
+        ts = np.asarray(timestamps_ms)
+        if ts.size == 0:
+            return np.empty(ts.shape, dtype=np.int8)
+        day, hour, weekday = self.local_parts(ts, tz_offset)
+        weekend = self._holiday_flags(day)
+        weekend = np.where((weekday == 4) & (hour >= 17), True, weekend)
+        weekend = np.where((weekday == 6) & (hour >= 23), False, weekend)
+        return weekend.astype(np.int8)
+
+    def day_type(self, dt):
+        """单个本地时间 (datetime 或 date) 的日期类型名称: 'weekday' / 'weekend'"""
+        hour = dt.hour if isinstance(dt, datetime) else 0
+        d = dt.date() if isinstance(dt, datetime) else dt
+        if d.weekday() == 4 and hour >= 17:
+            return 'weekend'
+        if d.weekday() == 6 and hour >= 23:
+            return 'weekday'
+        day = (d - _EPOCH).days
+        flags = self._span(day // self.span_days)
+        return DAY_TYPE_NAMES[int(flags[day % self.span_days])]
+
+
+# 进程内共享实例
+CALENDAR = DayTypeCalendar()
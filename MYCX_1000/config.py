@@ -1,4 +1,5 @@
 # config.py
+import os
 
 # ==========================================
 # 预测器默认配置字典 (Default Configuration)
@@ -29,4 +30,133 @@ DEFAULT_CONFIG = {
     'smooth_thresh1': 0.5,          # 第一阶段轻微衰减阈值 (50% 极速)
     'smooth_thresh2': 0.65,         # 第二阶段强力衰减阈值 (65% 极速)
     'smooth_hard_cap': 0.8,         # 绝对硬顶 (80% 极速，不可逾越之墙)
-}
\ No newline at end of file
+
+    # --- 执行选项 ---
+    'fit_workers': 1,               # 历史活动去节律化+拟合的进程数 (1 = 串行，结果与进程数无关)
+}
+
+# ==========================================
+# 本地缓存配置 (Bestdori 响应缓存)
+# ==========================================
+CACHE_CONFIG = {
+    'enabled': True,
+    'cache_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'http'),
+    'max_bytes': 512 * 1024 * 1024, # 缓存总大小上限，超出后按 LRU 淘汰
+    'live_ttl': 300,                # 进行中活动的有效期 (秒)
+    'pending_ttl': 6 * 3600,        # 尚未在本服开始/元数据不完整的活动 (秒)
+    'index_ttl': 3600,              # all.3.json 活动索引 (秒)
+    'ended_grace_hours': 2.0,       # 活动结束多久后视为不可变 (等待最终结算数据)
+}
+
+# ==========================================
+# 历史活动列式存储 (预处理后的历史曲线)
+# ==========================================
+HISTORY_STORE_CONFIG = {
+    'enabled': True,                # 需要 pyarrow，缺失时自动回退为在线计算
+    'store_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'history'),
+}
+
+# ==========================================
+# 共享 HTTP 会话 (http_client.py)
+# ==========================================
+HTTP_CONFIG = {
+    'pool_maxsize': None,           # None = ASYNC_CLIENT_CONFIG['max_concurrency'] + pool_reserve
+    'pool_reserve': 2,              # 为同步调用方 (目标活动、daemon) 预留的连接数
+    'max_retries': 3,               # 连接错误 / 429 / 5xx 的重试次数
+    'retry_backoff': 0.3,           # 重试退避系数 (秒)
+    'conditional_requests': True,   # 缓存过期后用 ETag / Last-Modified 重新验证
+    'http2': False,                 # 需要 h2 与 urllib3 2.x (实验性)；不可用时自动使用 HTTP/1.1
+    'user_agent': 'mycx-predictor',
+}
+
+# ==========================================
+# 异步 HTTP 客户端 (async_client.py)
+# ==========================================
+ASYNC_CLIENT_CONFIG = {
+    'max_concurrency': 8,           # 全局同时进行的请求数 (不超过 HTTPAdapter 的 pool_maxsize)
+    'per_host_rps': 10.0,           # 每个 host 每秒平均请求数上限
+    'per_host_burst': 16,           # 允许瞬时突发的请求数 (令牌桶容量)
+    'candidate_spares': 2,          # 寻找相似活动时同时预取的备用候选数 (候选无效时顶上，避免串行等待)
+}
+
+# ==========================================
+# HTTP 传输层 (transport.py): live / record / replay
+# ==========================================
+TRANSPORT_CONFIG = {
+    'mode': os.environ.get('MYCX_TRANSPORT', 'live'),
+    'archive': os.environ.get(
+        'MYCX_FIXTURES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'bestdori.zip')
+    ),
+    'latency': float(os.environ.get('MYCX_REPLAY_LATENCY', 0.0)),   # 回放时每个请求的模拟延迟 (秒)
+    'jitter': float(os.environ.get('MYCX_REPLAY_JITTER', 0.0)),     # 延迟的相对抖动 (0.2 = ±20%)
+    'bypass_local_stores': True,    # record / replay 时关闭本地缓存与历史存储，所有请求都经过传输层
+}
+
+# ==========================================
+# 小时分布重建 (distribution_builder.py)
+# ==========================================
+DISTRIBUTION_BUILD_CONFIG = {
+    'checkpoint_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'distribution'),
+    'resume': True,                 # 已有检查点的活动不再重新获取与计算
+    'max_events_in_flight': 8,      # 同时处理的活动数 (请求并发仍受 ASYNC_CLIENT_CONFIG 限制)
+    # 可合并的分布状态 (count / sum / sumsq + t-digest)，用于增量加入新结束的活动
+    # 每个 (server, tier, event_type) 一个: {state_dir}/{server}/{tier}/{event_type 或 all}.json
+    'state_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'distribution_state'),
+    'digest_compression': 100,      # t-digest 质心数量的上限参数，越大中位数越精确
+}
+
+# ==========================================
+# 节律表 (seasonality_store.py)
+# ==========================================
+SEASONALITY_CONFIG = {
+    'table_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'seasonality'),
+    # 单独建表的活动类型；其余类型及样本不足的类型使用同 tier 的 all 表
+    'event_types': ['story', 'challenge', 'live_try', 'versus', 'mission_live', 'festival', 'medley'],
+    'min_events': 5,                # 活动类型表至少需要的有效活动数
+    'per_event_type': True,         # 预测时优先使用与目标活动同类型的表
+}
+
+# 国服 tracker 支持的档位，与 TS 端 src/config.ts 中 tierListOfServer['cn'] 保持一致
+CN_TIERS = [20, 30, 40, 50, 100, 200, 300, 400, 500, 1000, 2000, 3000, 4000, 5000, 10000, 20000, 30000, 50000]
+
+# ==========================================
+# 常驻预测服务 (daemon.py)
+# ==========================================
+DAEMON_CONFIG = {
+    'interval_seconds': 300,        # 刷新间隔，建议不小于 CACHE_CONFIG['live_ttl']
+    'tiers': [1000],                # 需要发布预测线的档位
+    'server_index': 3,              # 国服
+    # TS 后端 Cutoff.readPredict2Data 读取 `MYCX_1000/ycx{tier}-3`
+    'publish_dir': os.path.dirname(os.path.abspath(__file__)),
+    'publish_name': 'ycx{tier}-3',
+    # 运行指标端点 (metrics.start_http_server): /metrics 与 /metrics.json；None 表示不开启
+    'metrics_port': None,
+    'metrics_host': '127.0.0.1',
+}
+
+# ==========================================
+# 历史回测 (backtest.py)
+# ==========================================
+BACKTEST_CONFIG = {
+    'hour_step': 6,                 # 观测时刻网格: 开始后每隔多少小时冻结一次 (不含活动结束时刻)
+    'tiers': [1000],
+    'workers': 4,                   # 并行的进程数 (按活动分配；同一活动的网格在一个进程内复用历史与拟合)
+    'output_dir': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backtest'),
+}
+
+# ==========================================
+# 性能基准 (benchmarks.py)
+# ==========================================
+BENCHMARK_CONFIG = {
+    'baseline_path': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json'),
+    'repeat': 7,                    # 每个用例的计时样本数
+    'min_sample_seconds': 0.05,     # 单个样本的最短时长，过快的用例在一个样本内循环多次
+    'time_tolerance': 1.3,          # 最短耗时超过基线的倍数即视为退化
+    'memory_tolerance': 1.3,        # 峰值内存超过基线的倍数即视为退化
+    # 合成数据规模 (与真实活动相当)
+    'event_days': 9,
+    'interval_minutes': 10,         # tracker 数据点间隔
+    'history_count': 7,             # 历史活动数 (实际为 5~10)
+    'observed_hours': 120,          # 预测时已观测的小时数
+    'grid_points': 1000,            # 预测曲线点数 (与 run_prediction 一致)
+}
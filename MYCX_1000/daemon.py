@@ -0,0 +1,138 @@
+import argparse
+import os
+import signal
+import threading
+import time
+import traceback
+
+import metrics
+from config import CN_TIERS, DAEMON_CONFIG
+from predictor import (
+    DataHandler,
+    fetch_recent_json,
+    get_current_event_for_server,
+    logger,
+)
+
+# ==========================================
+# 常驻预测服务 (PredictionDaemon)
+# ==========================================
+# 与一次性脚本不同，进程常驻期间保留同一个 DataHandler：
+#   - 节律表、各 tier 的历史活动与历史拟合结果
+#   - 目标活动各 tier 的增量刷新状态 (load_target_data(incremental=True))
+# 每个周期通过 run_prediction_batch 只重新执行与目标活动相关的部分，
+# 并原子替换 ycx{tier}-3 输出文件。活动切换时才重新构建 DataHandler。
+# --metrics-port 开启后，可从 /metrics (Prometheus) 或 /metrics.json 读取各阶段耗时、HTTP 与缓存计数。
+
+
+class PredictionDaemon:
+    def __init__(self, tiers=None, interval_seconds=None, publish_dir=None, config_overrides=None):
+        self.tiers = list(tiers or DAEMON_CONFIG['tiers'])
+        self.interval_seconds = float(interval_seconds or DAEMON_CONFIG['interval_seconds'])
+        self.publish_dir = publish_dir or DAEMON_CONFIG['publish_dir']
+        self.config_overrides = config_overrides
+        self.server_index = DAEMON_CONFIG.get('server_index', 3)
+
+        self.event_id = None
+        self.handler = None
+        self.last_refresh = None
+        self._stop = threading.Event()
+
+    def publish_path(self, tier):
+        return self._publish_fmt().format(tier=tier)
+
+    def _publish_fmt(self):
+        return os.path.join(self.publish_dir, DAEMON_CONFIG.get('publish_name', 'ycx{tier}-3'))
+
+    def _current_event(self):
+        recent = fetch_recent_json()
+        return get_current_event_for_server(recent, server_index=self.server_index)
+
+    def refresh_once(self):
+        """执行一次刷新；返回成功发布的 tier 列表。"""
+        try:
+            with metrics.stage('refresh'):
+                published = self._refresh()
+        except Exception:
+            metrics.inc('daemon_refreshes_total', result='error')
+            raise
+        metrics.inc('daemon_refreshes_total', result='ok' if published else 'empty')
+        return published
+
+    def _refresh(self):
+        event_id = self._current_event()
+        if event_id is None:
+            # 获取失败时沿用上一次的活动，避免因 recent.json 偶发失败而丢弃常驻状态
+            event_id = self.event_id
+        if event_id is None:
+            logger.warning("Daemon: cannot determine current event, skip refresh")
+            return []
+
+        if event_id != self.event_id or self.handler is None:
+            logger.info(f"Daemon: target event changed {self.event_id} -> {event_id}, rebuilding state")
+            if self.handler is not None:
+                self.handler.close()
+            try:
+                self.handler = DataHandler(event_id, config_overrides=self.config_overrides)
+            except Exception as e:
+                logger.warning(f"Daemon: failed to init handler for event={event_id}: {e}")
+                self.handler = None
+                return []
+            self.event_id = event_id
+
+        try:
+            # 首次刷新为全量加载，之后各 tier 只追加新数据点；历史活动缺失的 tier 会自动重试寻找
+            results = self.handler.run_prediction_batch(
+                self.tiers, incremental=True, json_path_fmt=self._publish_fmt()
+            )
+        except Exception as e:
+            logger.warning(f"Daemon: refresh failed: {e}")
+            logger.debug(traceback.format_exc())
+            results = {}
+
+        self.last_refresh = time.time()
+        return [tier for tier, out in results.items() if out is not None]
+
+    def run_forever(self):
+        print(f"🐱 常驻预测服务已启动: tiers={self.tiers} interval={self.interval_seconds:.0f}s")
+        logger.info(f"Daemon started: tiers={self.tiers} interval={self.interval_seconds}s publish_dir={self.publish_dir}")
+        while not self._stop.is_set():
+            started = time.time()
+            published = self.refresh_once()
+            print(f"刷新完成: Event {self.event_id} | 已发布 {published} | 用时 {time.time() - started:.1f}s")
+            # 以固定节拍刷新，扣除本次耗时
+            self._stop.wait(max(1.0, self.interval_seconds - (time.time() - started)))
+        logger.info("Daemon stopped")
+
+    def stop(self, *args):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MYCX 常驻预测服务")
+    parser.add_argument('--tiers', type=int, nargs='+', default=None, help="发布的档位，例如 --tiers 1000 2000")
+    parser.add_argument('--all-tiers', action='store_true', help="发布国服全部档位 (config.CN_TIERS)")
+    parser.add_argument('--interval', type=float, default=None, help="刷新间隔 (秒)")
+    parser.add_argument('--publish-dir', default=None, help="ycx{tier}-3 输出目录")
+    parser.add_argument('--once', action='store_true', help="只刷新一次后退出")
+    parser.add_argument('--metrics-port', type=int, default=None, help="在该端口提供 /metrics 与 /metrics.json")
+    args = parser.parse_args()
+
+    metrics_port = args.metrics_port or DAEMON_CONFIG.get('metrics_port')
+    if metrics_port:
+        metrics.start_http_server(metrics_port, DAEMON_CONFIG.get('metrics_host', '127.0.0.1'))
+        logger.info(f"Daemon: metrics endpoint on port {metrics_port}")
+
+    tiers = CN_TIERS if args.all_tiers else args.tiers
+    daemon = PredictionDaemon(tiers=tiers, interval_seconds=args.interval, publish_dir=args.publish_dir)
+    if args.once:
+        daemon.refresh_once()
+        return
+
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from async_client import AsyncBestdoriClient, run_sync
+from base_distribution import (
+    SERVER,
+    calculate_speed_tracker,
+    event_is_final,
+    fetch_events_index,
+    parse_event_meta,
+    parse_tracker,
+    tracker_url,
+)
+from calendar_service import CALENDAR, DAY_TYPE_NAMES
+from config import DISTRIBUTION_BUILD_CONFIG, SEASONALITY_CONFIG
+from seasonality_store import SeasonalityTable, table_path
+from streaming_stats import RunningStats
+
+# ==========================================
+# base_speed_distribution.json 的并行 / 可续跑重建
+# ==========================================
+# 每个活动独立处理：异步客户端并发获取 meta / tracker / eventtop，
+# 向量化地按 (day_type, 小时) 分桶，得到的样本立即写入该活动的检查点 ({event_id}.npz)。
+# 中断后重新运行时，已有检查点的活动直接读取，不再请求与计算。
+# 只有已结束 (event_is_final) 的活动会写检查点；进行中的活动每次重新获取。
+# 确认没有数据的活动 (本服未举办，或已结束但该 tier 没有 tracker 数据) 记为 missing，同样写入检查点与状态；
+# 只有网络错误导致的缺失会在下次运行时重试。
+#
+# 汇总结果保存为可合并的充分统计量 (DistributionState，见 streaming_stats)：
+# 已结束的活动按 ID 顺序折叠进状态文件，之后新结束的活动只需折叠它自己的样本 (update=True)，
+# 不再重跑整个 EVENT_RANGE。进行中的活动只临时并入本次输出，不写入状态。
+# count / mean / std 与完整重建一致 (仅有浮点求和顺序的差别)；median 来自 t-digest，是近似值，
+# 且与折叠顺序有关：较早的活动晚结束、之后才由 update 折叠进来时，median 可能与完整重建略有不同
+# (误差在 t-digest 的精度范围内，见 tests/test_distribution_fold.py)。
+#
+# 检查点与状态都按 (server, tier) 分开；同一次获取的样本同时折叠进 all 与各活动类型的状态，
+# build_tables 再把它们写成 seasonality_store 的节律表。
+
+CHECKPOINT_VERSION = 2
+STATE_VERSION = 1
+
+
+class CheckpointStore:
+    """每个活动一个 npz：status / event_type / scale 与 (day_type, hour, norm) 三个样本数组。"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, event_id):
+        return os.path.join(self.root, f"{int(event_id)}.npz")
+
+    def load(self, event_id):
+        """读取检查点；不存在、损坏或版本不符时返回 None。"""
+        path = self._path(event_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                if int(z['version']) != CHECKPOINT_VERSION:
+                    return None
+                return {
+                    'status': str(z['status']),
+                    'final': True,
+                    'event_type': str(z['event_type']) or None,
+                    'scale': float(z['scale']),
+                    'day_type': z['day_type'],
+                    'hour': z['hour'],
+                    'norm': z['norm'],
+                }
+        except Exception:
+            return None
+
+    def save(self, event_id, result):
+        path = self._path(event_id)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(
+            tmp,
+            version=np.int64(CHECKPOINT_VERSION),
+            status=np.str_(result['status']),
+            event_type=np.str_(result.get('event_type') or ''),
+            scale=np.float64(result['scale'] if result['scale'] is not None else np.nan),
+            day_type=result['day_type'],
+            hour=result['hour'],
+            norm=result['norm'],
+        )
+        os.replace(tmp, path)
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+
+
+class DistributionState:
+    """
+    每个 (day_type, 小时) 一个 RunningStats，以及已折叠的活动 (event_id -> status)。
+    event_type 不为 None 时只统计该类型的活动，其余活动记为 excluded。
+    """
+
+    def __init__(self, compression=None, event_type=None):
+        self.compression = float(compression or DISTRIBUTION_BUILD_CONFIG.get('digest_compression', 100))
+        self.event_type = event_type
+        self.buckets = {name: [RunningStats(self.compression) for _ in range(24)] for name in DAY_TYPE_NAMES}
+        self.events = {}
+
+    def fold(self, event_id, result):
+        """折叠一个活动的样本 (bucket_event 的结果)。"""
+        if self.event_type is not None and result.get('event_type') != self.event_type:
+            self.events[int(event_id)] = 'excluded'
+            return
+        if result['status'] == 'ok' and result['norm'].size:
+            key = result['day_type'].astype(np.int64) * 24 + result['hour'].astype(np.int64)
+            order = np.argsort(key, kind='mergesort')
+            keys, starts = np.unique(key[order], return_index=True)
+            for k, part in zip(keys.tolist(), np.split(result['norm'][order], starts[1:])):
+                self.buckets[DAY_TYPE_NAMES[k // 24]][k % 24].add(part)
+        self.events[int(event_id)] = result['status']
+
+    def merge(self, other):
+        """并入另一个状态 (原地)。"""
+        for name in DAY_TYPE_NAMES:
+            for h in range(24):
+                self.buckets[name][h].merge(other.buckets[name][h])
+        self.events.update(other.events)
+        return self
+
+    def copy(self):
+        return DistributionState.from_json(self.to_json())
+
+    @property
+    def valid_event_count(self):
+        return sum(1 for status in self.events.values() if status == 'ok')
+
+    def valid_events(self):
+        return sorted(eid for eid, status in self.events.items() if status == 'ok')
+
+    def summary(self):
+        """SeasonalityHandler 读取的格式: {day_type: {hour: {mean, median, std, count} 或 None}}"""
+        return {name: {h: self.buckets[name][h].summary() for h in range(24)} for name in DAY_TYPE_NAMES}
+
+    def to_json(self):
+        return {
+            'version': STATE_VERSION,
+            'compression': self.compression,
+            'event_type': self.event_type,
+            'events': {str(eid): status for eid, status in sorted(self.events.items())},
+            'buckets': {name: [stats.to_json() for stats in self.buckets[name]] for name in DAY_TYPE_NAMES},
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        state = cls(data.get('compression'), data.get('event_type'))
+        state.events = {int(eid): status for eid, status in data.get('events', {}).items()}
+        for name in DAY_TYPE_NAMES:
+            state.buckets[name] = [RunningStats.from_json(item) for item in data['buckets'][name]]
+        return state
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.to_json(), f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """读取状态文件；不存在、损坏或版本不符时返回 None。"""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != STATE_VERSION:
+                return None
+            return cls.from_json(data)
+        except Exception:
+            return None
+
+
+def _empty_result(status, scale=None, event_type=None):
+    return {
+        'status': status,
+        'final': True,
+        'event_type': event_type,
+        'scale': scale,
+        'day_type': np.empty(0, dtype=np.int8),
+        'hour': np.empty(0, dtype=np.int8),
+        'norm': np.empty(0, dtype=np.float64),
+    }
+
+
+def bucket_event(meta, scale_factor, df_1000):
+    """
+    单个活动的归一化速度样本，返回 {'status', 'scale', 'day_type', 'hour', 'norm'}。
+    只保留有效时间段 (排除首日24h，尾日48h) 内 0 <= norm_speed <= 1.2 的点，
+    day_type 为 DAY_TYPE_NAMES 的索引，hour 为本地时间 (UTC+8) 的小时。
+    """
+    df = calculate_speed_tracker(df_1000)
+    # 归一化
+    norm = (df["speed"] / scale_factor).values
+    times = df["time"].values
+
+    # 筛选有效时间段
+    valid_start = meta["start_at"] + 24 * 3600 * 1000
+    valid_end = meta["end_at"] - 48 * 3600 * 1000
+    in_window = (times >= valid_start) & (times <= valid_end)
+    times, norm = times[in_window], norm[in_window]
+
+    _, hours, _ = CALENDAR.local_parts(times, tz_offset=8)
+    day_types = CALENDAR.day_types(times, tz_offset=8)
+    # 过滤异常归一化值 (T1000 速度不应超过 T10 极速太多)
+    ok = (norm >= 0) & (norm <= 1.2)
+    return {
+        'status': 'ok',
+        'final': event_is_final(meta),
+        'event_type': meta.get('event_type'),
+        'scale': float(scale_factor),
+        'day_type': np.asarray(day_types)[ok].astype(np.int8),
+        'hour': np.asarray(hours)[ok].astype(np.int8),
+        'norm': np.asarray(norm[ok], dtype=np.float64),
+    }
+
+
+def process_event(event_id, meta, scale_factor, df_1000, store=None, missing=None):
+    """
+    处理一个活动的 (meta, scale, tracker)；返回样本结果，数据缺失时返回 None。
+    已结束的活动写入检查点 (包括因 T10 极速无效而跳过的活动)。
+    missing: 已确认没有数据时为 {'event_type': ...} (见 _confirm_missing)，记为 missing 并写入检查点。
+    """
+    if missing is not None:
+        print(f"➖ Event {event_id}: 本服没有该活动或该档位的数据，记为 missing")
+        result = _empty_result('missing', event_type=missing.get('event_type'))
+    elif not meta or df_1000 is None or df_1000.empty:
+        # 可能只是网络失败，不写检查点，下次重试
+        return None
+    elif not scale_factor or scale_factor < 100:  # 速度太小说明数据有问题
+        print(f"⚠️ Event {event_id}: 无法计算有效的 T10 极速，跳过。")
+        result = _empty_result('skipped', scale_factor, meta.get('event_type')) if scale_factor else None
+    else:
+        result = bucket_event(meta, scale_factor, df_1000)
+        print(f"✅ Event {event_id} | T10极速: {scale_factor:.0f} EP/min | 已归档")
+    if result is not None and store is not None and result['final']:
+        try:
+            store.save(event_id, result)
+        except Exception as e:
+            print(f"写入检查点失败 {event_id}: {e}")
+    return result
+
+
+def _server_frontier(index):
+    """本服最后一个已结束活动的 ID (all.3.json)；索引不可用时为 None"""
+    if not index:
+        return None
+    final_ids = []
+    for eid_s, entry in index.items():
+        try:
+            eid = int(eid_s)
+        except (TypeError, ValueError):
+            continue
+        if isinstance(entry, dict) and event_is_final(parse_event_meta(eid, entry)):
+            final_ids.append(eid)
+    return max(final_ids) if final_ids else None
+
+
+async def _confirm_missing(client, event_id, tier, meta, df_1000, index, frontier):
+    """
+    fetch_event_bundle 没有返回 meta / tracker 时，区分"确实没有数据"与网络错误。
+    确认没有数据时返回 {'event_type': ...}，否则返回 None (下次重试)：
+      - 没有本服 meta：索引中该活动没有本服时间 (或不存在)，且本服已经结束了 ID 更大的活动
+      - 已结束但没有 tracker：重新读取 tracker (通常命中缓存) 成功，且响应中没有数据
+    """
+    if not meta:
+        if frontier is None or int(event_id) >= frontier:
+            return None
+        entry = index.get(str(event_id))
+        if isinstance(entry, dict) and parse_event_meta(event_id, entry) is not None:
+            # 索引显示本服有该活动，meta 缺失只是请求失败
+            return None
+        return {'event_type': entry.get('eventType') if isinstance(entry, dict) else None}
+    if (df_1000 is None or df_1000.empty) and event_is_final(meta):
+        try:
+            raw = await client.get_json(tracker_url(event_id, tier), timeout=10)
+        except Exception:
+            return None
+        df = parse_tracker(raw)
+        if df is None or df.empty:
+            return {'event_type': meta.get('event_type')}
+    return None
+
+
+async def _collect(event_ids, tier, store, resume, max_in_flight):
+    client = AsyncBestdoriClient()
+    limiter = asyncio.Semaphore(max_in_flight)
+    results = {}
+    resumed = 0
+    index_task = None
+
+    def server_index():
+        # 只有出现缺失的活动时才读取 all.3.json，并发的活动共用一次请求
+        nonlocal index_task
+        if index_task is None:
+            async def load():
+                index = await asyncio.to_thread(fetch_events_index) or {}
+                return index, _server_frontier(index)
+            index_task = asyncio.ensure_future(load())
+        return index_task
+
+    async def one(event_id):
+        nonlocal resumed
+        if resume and store is not None:
+            cached = await asyncio.to_thread(store.load, event_id)
+            if cached is not None:
+                results[event_id] = cached
+                resumed += 1
+                return
+        # 限制同时处理的活动数，每完成一个就写出检查点，中断时只损失进行中的几个
+        async with limiter:
+            meta, scale_factor, df_1000 = await client.fetch_event_bundle(event_id, tier)
+            missing = None
+            if not meta or df_1000 is None or df_1000.empty:
+                index, frontier = await server_index()
+                missing = await _confirm_missing(client, event_id, tier, meta, df_1000, index, frontier)
+            result = await asyncio.to_thread(process_event, event_id, meta, scale_factor, df_1000, store, missing)
+        if result is not None:
+            results[event_id] = result
+
+    await asyncio.gather(*(one(eid) for eid in event_ids))
+    return results, resumed
+
+
+def fold_results(states, results):
+    """
+    按活动 ID 顺序把已结束活动的结果折叠进 states 中的每个状态；
+    返回只含进行中活动的临时状态 (与 states 同键，不应写入状态文件)。
+    ID 顺序只保证本次折叠内的顺序；states 中已有的活动不会重新折叠，median 因此与顺序有关。
+    """
+    live = {key: DistributionState(state.compression, state.event_type) for key, state in states.items()}
+    for event_id in sorted(results):
+        result = results[event_id]
+        for key in states:
+            (states[key] if result['final'] else live[key]).fold(event_id, result)
+    return live
+
+
+def state_path(server, tier, event_type=None, root=None):
+    root = root or DISTRIBUTION_BUILD_CONFIG['state_dir']
+    return os.path.join(root, str(server), str(tier), f"{event_type or 'all'}.json")
+
+
+def build_states(event_ids, tier=1000, event_types=(), checkpoint_dir=None, resume=None,
+                 max_in_flight=None, update=False, state_dir=None):
+    """
+    并行获取并折叠 (SERVER, tier) 的样本，返回 {event_type 或 None (全部活动): DistributionState}。
+    返回的状态已临时并入进行中的活动；写入状态文件的只有已结束的活动。
+    resume=False 时清空检查点后从头开始；checkpoint_dir=None 使用 DISTRIBUTION_BUILD_CONFIG。
+    update=True 时读取状态文件，只获取并折叠尚未折叠的活动；任一状态不可用时退回完整重建。
+    """
+    keys = [None] + [t for t in event_types if t]
+    paths = {key: state_path(SERVER, tier, key, state_dir) for key in keys}
+    states = {key: DistributionState.load(paths[key]) for key in keys} if update else {}
+    if update and any(state is None for state in states.values()):
+        print(f"T{tier}: 没有可用的分布状态，改为完整重建")
+        states = {}
+    if not states:
+        states = {key: DistributionState(event_type=key) for key in keys}
+    event_ids = [eid for eid in event_ids if int(eid) not in states[None].events]
+
+    root = checkpoint_dir or DISTRIBUTION_BUILD_CONFIG.get('checkpoint_dir')
+    if resume is None:
+        resume = DISTRIBUTION_BUILD_CONFIG.get('resume', True)
+    max_in_flight = int(max_in_flight or DISTRIBUTION_BUILD_CONFIG.get('max_events_in_flight', 8))
+    store = None
+    if root:
+        try:
+            store = CheckpointStore(os.path.join(root, str(SERVER), str(tier)))
+            if not resume:
+                store.clear()
+        except Exception as e:
+            print(f"检查点目录不可用，本次不保存进度: {e}")
+            store = None
+
+    results, resumed = run_sync(_collect(event_ids, tier, store, resume, max_in_flight))
+    if resumed:
+        print(f"从检查点恢复 {resumed} 个活动")
+    live = fold_results(states, results)
+    for key, state in states.items():
+        try:
+            state.save(paths[key])
+        except Exception as e:
+            print(f"写入分布状态失败 {paths[key]}: {e}")
+    if live[None].events:
+        print(f"进行中的活动 {sorted(live[None].events)} 只计入本次输出")
+        states = {key: state.copy().merge(live[key]) for key, state in states.items()}
+    return states
+
+
+def build_distribution(event_ids, tier=1000, **kwargs):
+    """全部活动的小时分布，返回 (final_distribution, 有效活动数)；参数见 build_states。"""
+    state = build_states(event_ids, tier=tier, **kwargs)[None]
+    return state.summary(), state.valid_event_count
+
+
+def build_tables(event_ids, tiers=(1000,), event_types=None, table_dir=None, **kwargs):
+    """
+    为每个 tier 生成 all 表以及样本足够的活动类型表 (SEASONALITY_CONFIG)，写入 table_dir。
+    返回 {(tier, event_type 或 None): DistributionState}；其余参数见 build_states。
+    """
+    if event_types is None:
+        event_types = SEASONALITY_CONFIG.get('event_types', ())
+    min_events = int(SEASONALITY_CONFIG.get('min_events', 5))
+    built = {}
+    for tier in tiers:
+        states = build_states(event_ids, tier=tier, event_types=event_types, **kwargs)
+        for key, state in states.items():
+            built[(tier, key)] = state
+            if key is not None and state.valid_event_count < min_events:
+                continue
+            if key is None and not state.valid_event_count:
+                continue
+            table = SeasonalityTable.from_summary(
+                state.summary(), state.valid_events(), server=SERVER, tier=tier, event_type=key
+            )
+            path = table_path(SERVER, tier, key, table_dir)
+            table.save(path)
+            print(f"节律表 T{tier}/{key or 'all'}: {state.valid_event_count} 个活动 -> {path}")
+    return built
@@ -0,0 +1,256 @@
+import codecs
+import heapq
+import json
+import re
+from array import array
+
+import numpy as np
+
+import metrics
+
+# ==========================================
+# eventtop 流式解析 (EventtopPoints)
+# ==========================================
+# eventtop/data 的响应形如 {"points": [{"time", "uid", "value"}, ...], "users": [...]}，
+# 长活动中 points 很大，而 T10 极速只需要其中一部分：
+#   - 历史活动的 Scale 只看前 500 个点 (与原 DataFrame.head(500) 一致)
+#   - 调试模式下的目标活动只看 debug_limit_ts 之前的点
+# 这里边下载边解码 points 数组，满足条件后立即停止读取，
+# 结果存入 array('q') 而不是 DataFrame / dict 列表，再交给 TopSpeedTracker 增量计算极速。
+
+_POINTS_KEY = re.compile(r'"points"\s*:\s*\[')
+# Bestdori 的点通常就是这个字段顺序；不匹配时回退到通用的 JSON 解码
+_POINT = re.compile(
+    r'\{\s*"time"\s*:\s*(-?\d+)\s*,\s*"uid"\s*:\s*(-?\d+)\s*,\s*"value"\s*:\s*(-?\d+)\s*\}'
+)
+_CHUNK_SIZE = 64 * 1024
+
+
+class EventtopPoints:
+    """按到达顺序保存 (time, uid, value) 的紧凑缓冲区。"""
+
+    def __init__(self):
+        self.time = array('q')
+        self.uid = array('q')
+        self.value = array('q')
+        # 是否读完了整个 points 数组 (提前停止时为 False)
+        self.complete = False
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, t, uid, value):
+        self.time.append(int(t))
+        self.uid.append(int(uid))
+        self.value.append(int(value))
+
+    def arrays(self):
+        """(time, uid, value) 三个 int64 numpy 数组 (共享缓冲区，不拷贝)"""
+        return (
+            np.frombuffer(self.time, dtype=np.int64),
+            np.frombuffer(self.uid, dtype=np.int64),
+            np.frombuffer(self.value, dtype=np.int64),
+        )
+
+    def to_json(self):
+        return {
+            'time': self.time.tolist(),
+            'uid': self.uid.tolist(),
+            'value': self.value.tolist(),
+            'complete': self.complete,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        buf = cls()
+        buf.time.extend(data['time'])
+        buf.uid.extend(data['uid'])
+        buf.value.extend(data['value'])
+        buf.complete = bool(data.get('complete'))
+        return buf
+
+
+def iter_points(chunks):
+    """
+    从字节块序列中逐个解码 points 数组的元素，产出 (time, uid, value)。
+    只依赖标准库：常见格式直接用正则匹配，否则用 json.JSONDecoder.raw_decode 解码一个完整对象；
+    数据不足时等待下一块。points 数组结束后停止，不再读取其余字段。
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    in_array = False
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+        if not in_array:
+            m = _POINTS_KEY.search(buf)
+            if m is None:
+                # 保留末尾一小段，避免 key 被切在两块之间
+                buf = buf[-32:]
+                continue
+            pos = m.end()
+            in_array = True
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                break
+            if buf[pos] == ']':
+                return
+            m = _POINT.match(buf, pos)
+            if m is not None:
+                pos = m.end()
+                yield int(m.group(1)), int(m.group(2)), int(m.group(3))
+                continue
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # 对象不完整，等待更多数据
+                break
+            pos = end
+            if isinstance(obj, dict) and obj.get('time') is not None:
+                yield obj['time'], obj.get('uid', 0), obj.get('value', 0)
+
+
+def read_points(chunks, limit=None, until_ts=None):
+    """
+    将 points 读入 EventtopPoints。
+    limit: 最多读取的点数 (按响应顺序)
+    until_ts: 只保留 time <= until_ts 的点；points 按时间升序到达时，
+              遇到第一个超出的点即停止 (一旦发现乱序则改为读完整个数组)
+    """
+    buf = EventtopPoints()
+    ordered = True
+    last_time = None
+    for t, uid, value in iter_points(chunks):
+        if last_time is not None and t < last_time:
+            ordered = False
+        last_time = t
+        if until_ts is not None and t > until_ts:
+            if ordered:
+                return buf
+            continue
+        buf.append(t, uid, value)
+        if limit is not None and len(buf) >= limit:
+            return buf
+    buf.complete = True
+    return buf
+
+
+def stream_points(session, url, timeout=10, limit=None, until_ts=None):
+    """流式 GET eventtop 并解析 points；提前停止时关闭连接，不再下载剩余内容。"""
+    r = session.get(url, timeout=timeout, stream=True)
+    received = 0
+
+    def chunks():
+        nonlocal received
+        for chunk in r.iter_content(chunk_size=_CHUNK_SIZE):
+            received += len(chunk)
+            yield chunk
+
+    try:
+        r.raise_for_status()
+        return read_points(chunks(), limit=limit, until_ts=until_ts)
+    finally:
+        r.close()
+        # 与 http_client 的 response hook 一致，按实际读取的解码后字节计
+        metrics.inc('http_response_bytes_total', received)
+
+
+class TopSpeedTracker:
+    """
+    T10 极速的增量估计器：各 uid 相邻两点的 EP/分钟，去除 <= 0 与 >= 1e6 的值后，
+    保留最大的 k 个速度 (最小堆)，scale 为其均值。
+    只保存每个 uid 的最后一个点，因此常驻刷新时只需处理新到的点。
+    结果与原 pandas 实现 (sort_values(['uid', 'time']) + groupby.diff + nlargest(3)) 一致。
+    """
+
+    def __init__(self, k=3):
+        self.k = int(k)
+        self._last = {}         # uid -> (time, value)
+        self._heap = []         # 最大的 k 个有效速度
+        self.watermark = None   # 已处理的最大 time
+        self._at_watermark = set()  # time == watermark 时已处理过的 uid
+
+    def update(self, points, until_ts=None):
+        """
+        处理 time 晚于 watermark (且不晚于 until_ts) 的点；points 为 EventtopPoints。
+        time 等于 watermark 的点按 uid 去重：之前没有处理过的 uid 仍会计入
+        (同一时刻的点可能在之后的刷新中才到达)。
+        返回本次处理的点数。
+        """
+        if points is None or len(points) == 0:
+            return 0
+        time, uid, value = points.arrays()
+        mask = np.ones(len(time), dtype=bool)
+        if self.watermark is not None:
+            at_watermark = time == self.watermark
+            if self._at_watermark and at_watermark.any():
+                seen = np.fromiter(self._at_watermark, dtype=uid.dtype, count=len(self._at_watermark))
+                at_watermark &= ~np.isin(uid, seen)
+            mask &= (time > self.watermark) | at_watermark
+        if until_ts is not None:
+            mask &= time <= until_ts
+        if not mask.any():
+            return 0
+        time, uid, value = time[mask], uid[mask], value[mask]
+
+        order = np.lexsort((time, uid))
+        time, uid, value = time[order], uid[order], value[order]
+        # 每个点的前一个点：同一 uid 的上一行，或该 uid 在之前批次中的最后一个点
+        prev_time = np.zeros(len(time))
+        prev_value = np.zeros(len(time))
+        prev_time[1:] = time[:-1]
+        prev_value[1:] = value[:-1]
+        first = np.ones(len(time), dtype=bool)
+        first[1:] = uid[1:] != uid[:-1]
+        has_prev = ~first
+        for i in np.flatnonzero(first):
+            last = self._last.get(int(uid[i]))
+            if last is not None:
+                prev_time[i], prev_value[i] = last
+                has_prev[i] = True
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = (value.astype(float) - prev_value) / ((time.astype(float) - prev_time) / 1000 / 60)
+        speed = speed[has_prev]
+        valid = speed[(speed > 0) & (speed < 1000000)]
+        if valid.size:
+            for v in np.sort(valid)[::-1][:self.k]:
+                if len(self._heap) < self.k:
+                    heapq.heappush(self._heap, float(v))
+                elif v > self._heap[0]:
+                    heapq.heapreplace(self._heap, float(v))
+                else:
+                    break
+
+        # 各 uid 的最后一个点 (每组的最后一行)
+        last_rows = np.ones(len(time), dtype=bool)
+        last_rows[:-1] = uid[1:] != uid[:-1]
+        for i in np.flatnonzero(last_rows):
+            self._last[int(uid[i])] = (float(time[i]), float(value[i]))
+        top_time = int(time.max())
+        top_uids = {int(u) for u in uid[time == top_time]}
+        if self.watermark is not None and top_time == self.watermark:
+            self._at_watermark |= top_uids
+        else:
+            self._at_watermark = top_uids
+        self.watermark = top_time
+        return int(len(time))
+
+    def scale(self):
+        """当前 T10 极速 (最大 k 个有效速度的均值)；尚无有效速度时返回 None。"""
+        if not self._heap:
+            return None
+        return float(np.mean(sorted(self._heap, reverse=True)))
+
+
+def max_speed(points):
+    """一次性计算 points 的 T10 极速，见 TopSpeedTracker。"""
+    tracker = TopSpeedTracker()
+    tracker.update(points)
+    return tracker.scale()
@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+
+from config import HISTORY_STORE_CONFIG
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except Exception:
+    pa = None
+    pa_ipc = None
+
+# ==========================================
+# 历史活动列式存储 (HistoryStore)
+# ==========================================
+# 每个 (server, tier, event_id) 一个 Arrow IPC 文件，保存已经处理好的曲线：
+#   time / ep / speed / norm_speed / hours_elapsed
+# 以及 schema metadata 中的 scale、start_at、total_hours、event_type。
+# 读取走 memory map，不再重复下载 tracker 并重跑 calculate_speed_tracker。
+
+STORE_VERSION = 1
+COLUMNS = ['time', 'ep', 'speed', 'norm_speed', 'hours_elapsed']
+
+
+class HistoryStore:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, event_id, tier, server):
+        return os.path.join(self.root, str(server), str(tier), f"{int(event_id)}.arrow")
+
+    def load(self, event_id, tier, server):
+        """
+        读取已存储的历史活动；不存在或版本不符返回 None。
+        返回结构与 DataHandler._process_single_candidate 的结果一致。
+        """
+        path = self._path(event_id, tier, server)
+        if not os.path.exists(path):
+            return None
+        try:
+            with pa.memory_map(path, 'r') as source:
+                table = pa_ipc.open_file(source).read_all()
+            meta = json.loads(table.schema.metadata[b'mycx'].decode('utf-8'))
+            if meta.get('version') != STORE_VERSION:
+                return None
+            # split_blocks 让无空值的数值列直接引用映射内存，避免整体拷贝
+            df = table.to_pandas(split_blocks=True)
+        except Exception:
+            return None
+        return {
+            'event_id': int(event_id),
+            'scale': meta['scale'],
+            'data': df,
+            'total_hours': meta['total_hours'],
+            'start_at': meta['start_at'],
+            'event_type': meta.get('event_type'),
+            'early_intensity': 0,
+        }
+
+    def save(self, entry, tier, server):
+        """写入处理好的历史活动（仅应对已结束的活动调用）。"""
+        df = entry['data']
+        cols = [c for c in COLUMNS if c in df.columns]
+        table = pa.Table.from_pandas(df[cols].reset_index(drop=True), preserve_index=False)
+        meta = {
+            'version': STORE_VERSION,
+            'scale': float(entry['scale']),
+            'start_at': int(entry['start_at']),
+            'total_hours': float(entry['total_hours']),
+            'event_type': entry.get('event_type'),
+        }
+        table = table.replace_schema_metadata({b'mycx': json.dumps(meta).encode('utf-8')})
+        path = self._path(entry['event_id'], tier, server)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with pa.OSFile(tmp, 'wb') as sink:
+            with pa_ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_history_store():
+    """返回共享的 HistoryStore；pyarrow 不可用或配置关闭时返回 None。"""
+    global _STORE
+    if pa is None or not HISTORY_STORE_CONFIG.get('enabled', True):
+        return None
+    with _STORE_LOCK:
+        if _STORE is None:
+            try:
+                _STORE = HistoryStore(HISTORY_STORE_CONFIG['store_dir'])
+            except Exception as e:
+                print(f"历史存储目录不可用，已禁用: {e}")
+                HISTORY_STORE_CONFIG['enabled'] = False
+                return None
+        return _STORE
+
@@ -0,0 +1,166 @@
+import atexit
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from config import ASYNC_CLIENT_CONFIG, HTTP_CONFIG
+from transport import configure_session
+
+try:
+    import brotli  # noqa: F401  (urllib3 用它解码 br)
+    _HAS_BROTLI = True
+except Exception:
+    try:
+        import brotlicffi  # noqa: F401
+        _HAS_BROTLI = True
+    except Exception:
+        _HAS_BROTLI = False
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 共享 HTTP 会话 (get_session)
+# ==========================================
+# predictor / base_distribution / async_client 共用同一个 requests Session 与连接池：
+#   - keep-alive 连接池，大小跟随异步扫描的并发数 (ASYNC_CLIENT_CONFIG['max_concurrency'])
+#   - Accept-Encoding: gzip/deflate，安装了 brotli 时加上 br
+#   - HTTP/2 需要 urllib3 2.x 的实验性支持与 h2，默认关闭 (HTTP_CONFIG['http2'])
+#   - 录制 / 回放传输层 (transport.configure_session)
+#   - 每个响应记入 metrics (请求数、响应字节数、到响应头的延迟)
+# 条件请求 (ETag / If-Modified-Since) 见 base_distribution._cached_get_json。
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def pool_size():
+    """连接池大小：异步扫描的并发数 + 同步调用方预留的连接"""
+    configured = HTTP_CONFIG.get('pool_maxsize')
+    if configured:
+        return int(configured)
+    return int(ASYNC_CLIENT_CONFIG['max_concurrency']) + int(HTTP_CONFIG.get('pool_reserve', 2))
+
+
+def accept_encoding():
+    return 'gzip, deflate, br' if _HAS_BROTLI else 'gzip, deflate'
+
+
+def _enable_http2():
+    try:
+        import h2  # noqa: F401
+        import urllib3.http2
+        urllib3.http2.inject_into_urllib3()
+        return True
+    except Exception as e:
+        logger.info(f"HTTP/2 unavailable, using HTTP/1.1 keep-alive: {e}")
+        return False
+
+
+def response_validators(response):
+    """响应中可用于条件请求的验证器；没有时返回 None"""
+    validators = {}
+    etag = response.headers.get('ETag')
+    if etag:
+        validators['etag'] = etag
+    last_modified = response.headers.get('Last-Modified')
+    if last_modified:
+        validators['last_modified'] = last_modified
+    return validators or None
+
+
+def conditional_get(session, url, timeout, stale=None, validators=None):
+    """
+    GET 并解析 JSON。提供了过期的缓存内容及其验证器时发送 If-None-Match / If-Modified-Since，
+    服务器返回 304 时直接沿用缓存内容。返回 (data, validators)。
+    """
+    headers = None
+    if stale is not None and validators and HTTP_CONFIG.get('conditional_requests', True):
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    r = session.get(url, timeout=timeout, headers=headers) if headers else session.get(url, timeout=timeout)
+    if r.status_code == 304 and headers:
+        return stale, response_validators(r) or validators
+    r.raise_for_status()
+    return r.json(), response_validators(r)
+
+
+def _record_response(response, *args, **kwargs):
+    """
+    response hook: 记录请求数 / 字节数 / 延迟。
+    字节数统一按解码 (解压) 后的正文计；流式响应此时尚未读取正文，由读取方自行计数 (见 eventtop_stream.stream_points)。
+    """
+    metrics.inc('http_requests_total', status=response.status_code)
+    elapsed = getattr(response, 'elapsed', None)
+    if elapsed is not None:
+        metrics.observe('http_request_seconds', elapsed.total_seconds())
+    if not kwargs.get('stream'):
+        metrics.inc('http_response_bytes_total', len(response.content or b''))
+    return response
+
+
+def adapter_kwargs():
+    """
+    HTTPAdapter 的连接池与重试策略；build_session 与录制模式的 RecordingAdapter 共用，
+    使录制时与 live 的行为一致 (429/5xx 先重试，而不是写入归档)。
+    """
+    retries = Retry(
+        total=int(HTTP_CONFIG.get('max_retries', 3)),
+        backoff_factor=float(HTTP_CONFIG.get('retry_backoff', 0.3)),
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=('GET',),
+        respect_retry_after_header=True,
+        raise_on_status=False,      # 重试用尽后返回最后的响应，由调用方 raise_for_status
+    )
+    return {'pool_connections': 4, 'pool_maxsize': pool_size(), 'max_retries': retries, 'pool_block': False}
+
+
+def build_session():
+    """按 HTTP_CONFIG 构造新的 Session (一般应使用共享的 get_session)。"""
+    session = requests.Session()
+    session.headers.update({
+        'Accept': 'application/json',
+        'Accept-Encoding': accept_encoding(),
+        'User-Agent': HTTP_CONFIG.get('user_agent', 'mycx-predictor'),
+    })
+    kwargs = adapter_kwargs()
+    try:
+        adapter = HTTPAdapter(**kwargs)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+    except Exception:
+        pass
+    # 录制 / 回放模式 (config.TRANSPORT_CONFIG)
+    configure_session(session, adapter_kwargs=kwargs)
+    session.hooks['response'].append(_record_response)
+    return session
+
+
+def get_session():
+    """进程内共享的 Session。"""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            if HTTP_CONFIG.get('http2'):
+                _enable_http2()
+            _SESSION = build_session()
+            atexit.register(close_session)
+        return _SESSION
+
+
+def close_session():
+    """关闭共享 Session 的连接池 (进程退出时自动调用)。"""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is not None:
+            try:
+                _SESSION.close()
+            except Exception:
+                pass
+            _SESSION = None
@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==========================================
+# 运行指标 (计数器 / 分阶段耗时)
+# ==========================================
+# 进程内共享的指标注册表，供 daemon 的 /metrics 端点与 Streamlit 面板读取：
+#   counter  单调递增的计数 (HTTP 请求数、响应字节数、缓存命中/未命中、拟合次数)
+#   summary  观测值的 count / sum / max (HTTP 延迟、拟合迭代次数)
+#   stage    分阶段的墙钟时间与 CPU 时间 (stage() 上下文管理器)，记为 summary
+# 指标名与标签的写法与 Prometheus 相同；prometheus_text() 输出 text exposition 格式，snapshot() 输出 JSON，
+# start_http_server() 在后台线程提供 /metrics 与 /metrics.json (daemon.py --metrics-port)。
+#
+# 阶段名 (stage 标签):
+#   fetch / candidate_scan / history_fits / predict / sweep / plot / write_json   DataHandler 的对应方法
+#   target / history / ratio / params / curve / scale / backtest / smoothing / forecast / export
+#                                                    prediction_stages 的各阶段 (仅在未命中 StageMemo 时计时；
+#                                                    target / history 即去节律化；对比窗口不经过 StageMemo，不单独计时)
+#   refresh                                          daemon 的一次刷新 (PredictionDaemon.refresh_once)
+# 进程池中的历史拟合 (DEFAULT_CONFIG['fit_workers'] > 1) 在子进程中执行，不计入本进程的指标。
+
+PREFIX = 'mycx_'
+
+_LOCK = threading.Lock()
+_COUNTERS = {}      # (name, labels) -> value
+_SUMMARIES = {}     # (name, labels) -> [count, sum, max]
+_HELP = {
+    'http_requests_total': ('counter', "HTTP responses received, by status code"),
+    'http_response_bytes_total': ('counter', "HTTP response body bytes after decoding (decompressed)"),
+    'http_request_seconds': ('summary', "HTTP time to response headers"),
+    'cache_requests_total': ('counter', "Cache lookups, by cache and result"),
+    'fits_total': ('counter', "Model fits, by result"),
+    'fit_iterations': ('summary', "Function evaluations per model fit"),
+    'stage_wall_seconds': ('summary', "Wall-clock time per pipeline stage"),
+    'stage_cpu_seconds': ('summary', "CPU time (calling thread) per pipeline stage"),
+    'daemon_refreshes_total': ('counter', "Daemon refresh cycles, by result"),
+}
+_STARTED_AT = time.time()
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """计数器加 value"""
+    key = _key(name, labels)
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """记录一个观测值 (summary)"""
+    key = _key(name, labels)
+    with _LOCK:
+        entry = _SUMMARIES.get(key)
+        if entry is None:
+            _SUMMARIES[key] = [1, value, value]
+        else:
+            entry[0] += 1
+            entry[1] += value
+            if value > entry[2]:
+                entry[2] = value
+
+
+@contextmanager
+def stage(name):
+    """记录一个阶段的墙钟时间与 CPU 时间 (当前线程)；阶段内抛出的异常照常向外传递"""
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        observe('stage_wall_seconds', time.perf_counter() - wall, stage=name)
+        observe('stage_cpu_seconds', time.thread_time() - cpu, stage=name)
+
+
+def cache_lookup(cache, result):
+    """缓存查询结果: hit / miss / expired"""
+    inc('cache_requests_total', cache=cache, result=result)
+
+
+def reset():
+    global _STARTED_AT
+    with _LOCK:
+        _COUNTERS.clear()
+        _SUMMARIES.clear()
+        _STARTED_AT = time.time()
+
+
+def snapshot():
+    """
+    JSON 友好的快照：
+    {'started_at', 'counters': [{name, labels, value}], 'summaries': [{name, labels, count, sum, max}],
+     'cache_hit_ratio': {cache: 命中率}}
+    """
+    with _LOCK:
+        counters = [
+            {'name': name, 'labels': dict(labels), 'value': value}
+            for (name, labels), value in sorted(_COUNTERS.items())
+        ]
+        summaries = [
+            {'name': name, 'labels': dict(labels), 'count': c, 'sum': s, 'max': m}
+            for (name, labels), (c, s, m) in sorted(_SUMMARIES.items())
+        ]
+    lookups = {}
+    for item in counters:
+        if item['name'] == 'cache_requests_total':
+            per_cache = lookups.setdefault(item['labels'].get('cache'), {})
+            per_cache[item['labels'].get('result')] = item['value']
+    hit_ratio = {
+        cache: results.get('hit', 0) / total
+        for cache, results in lookups.items()
+        for total in [sum(results.values())] if total
+    }
+    return {
+        'started_at': _STARTED_AT,
+        'counters': counters,
+        'summaries': summaries,
+        'cache_hit_ratio': hit_ratio,
+    }
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + body + '}'
+
+
+def prometheus_text():
+    """Prometheus text exposition format (version 0.0.4)"""
+    with _LOCK:
+        counters = sorted(_COUNTERS.items())
+        summaries = sorted(_SUMMARIES.items())
+    lines = []
+
+    def describe(name, default_type):
+        kind, help_text = _HELP.get(name, (default_type, name))
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    # 同名的样本必须连续输出
+    last = None
+    for (name, labels), value in counters:
+        if name != last:
+            describe(name, 'counter')
+            last = name
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+
+    by_name = {}
+    for (name, labels), entry in summaries:
+        by_name.setdefault(name, []).append((labels, entry))
+    for name, items in by_name.items():
+        describe(name, 'summary')
+        for labels, (count, total, _) in items:
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {count}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {total}")
+        # 最大值不属于 summary 类型，单独作为 gauge 输出
+        lines.append(f"# TYPE {PREFIX}{name}_max gauge")
+        for labels, (_, _, peak) in items:
+            lines.append(f"{PREFIX}{name}_max{_format_labels(labels)} {peak}")
+
+    lines.append(f"# TYPE {PREFIX}process_start_time_seconds gauge")
+    lines.append(f"{PREFIX}process_start_time_seconds {_STARTED_AT}")
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            body = prometheus_text().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/metrics.json':
+            body = json.dumps(snapshot(), ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取请求很频繁，不写访问日志
+        pass
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """在后台线程提供 /metrics (Prometheus) 与 /metrics.json (snapshot)；返回 server，调用 shutdown() 停止"""
+    server = ThreadingHTTPServer((host, int(port)), _MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,693 @@
+import hashlib
+import itertools
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+logger = logging.getLogger('predictor.stages')
+
+# ==========================================
+# 预测流水线的各个阶段 (DataHandler.run_prediction)
+# ==========================================
+# 每个阶段是输入 -> 输出的纯函数，输出为 NamedTuple。StageMemo 按阶段保存最近一次 (输入键, 输出)，
+# 输入键由本阶段用到的参数与上游阶段的键组成，因此只改变后段参数 (例如 smooth_hard_cap) 时
+# 只有顶部平滑与导出会重新计算，去节律化、拟合与比率都直接复用。
+#
+#   window -> target ─┐
+#          -> history ┴> ratio -> params -> curve -> scale -> backtest -> smoothing -> forecast -> export
+
+# 历史活动都没有可用参数时的默认值: [Base, A, B, B_end, T_panic]
+DEFAULT_PARAMS = (0.05, 0.001, 0.0, 0.5, 24.0)
+# 顶部平滑两个阶段的系数
+SMOOTH_ALPHA = 3.0   # mild stage coefficient
+SMOOTH_BETA = 22.0   # strong stage coefficient (large -> heavy compression)
+
+
+def input_key(*parts):
+    """阶段输入的摘要；数组 / DataFrame 按内容计算，其余按 repr。"""
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            for col in part.columns:
+                h.update(str(col).encode('utf-8'))
+                h.update(np.ascontiguousarray(part[col].values).tobytes())
+        elif isinstance(part, (np.ndarray, pd.Series)):
+            arr = np.ascontiguousarray(np.asarray(part))
+            h.update(str(arr.dtype).encode('utf-8'))
+            h.update(arr.tobytes())
+        else:
+            h.update(repr(part).encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+class StageMemo:
+    """每个阶段保留最近一次 (输入键, 输出)；键相同时跳过计算。"""
+
+    def __init__(self):
+        self._entries = {}
+        self.keys = {}          # 阶段名 -> 本次运行的输入键，供下游阶段组成自己的键
+        self.executed = []      # 本次运行中实际执行的阶段
+
+    def run(self, name, parts, fn):
+        key = input_key(name, *parts)
+        self.keys[name] = key
+        hit = self._entries.get(name)
+        if hit is not None and hit[0] == key:
+            metrics.cache_lookup('stage_memo', 'hit')
+            return hit[1]
+        metrics.cache_lookup('stage_memo', 'miss')
+        with metrics.stage(name):
+            out = fn()
+        self._entries[name] = (key, out)
+        self.executed.append(name)
+        return out
+
+    def begin(self):
+        self.keys = {}
+        self.executed = []
+
+    def clear(self):
+        self._entries.clear()
+        self.begin()
+
+
+# ---- 1. 对比窗口 ----
+
+class Window(NamedTuple):
+    t_start: float
+    t_end: float
+    end_source: float
+
+
+def comparison_window(target_data, debug_hours, t_start_cmp=6.0, t_end_cap=72.0):
+    """
+    起点：配置中指定 (默认6小时，用于跳过开局暴冲)
+    终点：已观测的最新进度 (debug_hours 或 target_data 的最大 hours_elapsed)，上限 t_end_cap
+    """
+    try:
+        observed_hours = float(target_data['hours_elapsed'].max()) if target_data is not None and len(target_data) > 0 else 0.0
+    except Exception:
+        observed_hours = 0.0
+    end_source = debug_hours if (debug_hours is not None) else observed_hours
+    return Window(float(t_start_cmp), min(end_source, float(t_end_cap)), end_source)
+
+
+def window_intensity(df_in, window):
+    """指定区间内 skeleton_speed 的稳健均值；区间内没有数据时返回 None"""
+    # 严格卡死时间段
+    mask = (df_in['hours_elapsed'] >= window.t_start) & \
+           (df_in['hours_elapsed'] <= window.t_end) & \
+           (np.isfinite(df_in['skeleton_speed']))
+
+    data_slice = df_in.loc[mask, 'skeleton_speed']
+
+    if len(data_slice) == 0: return None # 如果该区间没数据（比如历史活动数据缺失），返回 None
+
+    # 简单的 Sigma Clipping 去除极端异常值
+    mean_val = data_slice.mean()
+    std_val = data_slice.std()
+    if std_val > 0.001:
+        clean_slice = data_slice[np.abs(data_slice - mean_val) < 2.0 * std_val]
+        if len(clean_slice) > 0:
+            return clean_slice.mean()
+    return mean_val
+
+
+# ---- 2. 当前活动强度 ----
+
+class TargetIntensity(NamedTuple):
+    frame: pd.DataFrame         # 去节律化后的目标数据 (season_factor / skeleton_speed)
+    intensity: float            # 对比区间内的 skeleton_speed 稳健均值
+    obs_norm_mean: float        # 对比区间内的 norm_speed 均值
+    observed_hours: float
+
+
+def target_intensity(target_data, seasonality, window):
+    target_df = seasonality.remove_seasonality(target_data)
+    logger.debug(f"target_df rows={len(target_df)}; sample hours_elapsed head: {target_df['hours_elapsed'].head(5).tolist()}")
+    if 'season_factor' in target_df.columns:
+        logger.debug(f"season_factor sample (head): {target_df['season_factor'].head(5).tolist()}")
+    curr_intensity = window_intensity(target_df, window)
+
+    if curr_intensity is None:
+        print("当前活动在对比区间内无有效数据，无法计算 Ratio，默认 1.0")
+        curr_intensity = 0.1 # 避免除零
+
+    print(f"当前活动区间强度: {curr_intensity:.4f}")
+
+    mask_cmp = (target_df['hours_elapsed'] >= window.t_start) & (target_df['hours_elapsed'] <= window.t_end)
+    obs_norm_mean = target_df.loc[mask_cmp, 'norm_speed'].mean()
+    observed_hours = float(target_df['hours_elapsed'].max()) if 'hours_elapsed' in target_df.columns else 0.0
+    return TargetIntensity(target_df, curr_intensity, obs_norm_mean, observed_hours)
+
+
+# ---- 3. 历史活动强度与拟合参数 ----
+
+class HistoryIntensity(NamedTuple):
+    params: list                # 有效历史活动的拟合参数 [Base, A, B, B_end, T_panic]
+    intensities: list           # 对应的区间强度
+    norms: list                 # 各历史活动同窗 norm_speed 均值
+
+
+def history_intensity(prepared, window):
+    """prepared: [(event_id, 去节律化后的 DataFrame, 拟合参数)]"""
+    hist_params = []
+    hist_intensities = []
+    hist_norms = []
+    for event_id, df_clean, popt in prepared:
+        # 计算同一时间窗口的强度
+        h_int = window_intensity(df_clean, window)
+        if h_int is not None and popt is not None:
+            hist_intensities.append(h_int)
+            hist_params.append(popt)
+            # popt: [Base, A, B, B_end, T_panic]
+            logger.info(f"  - Hist {event_id}: 区间强度={h_int:.6f} | A={popt[1]:.8e} B={popt[2]:.8e} | params={popt}")
+        else:
+            logger.info(f"  - Hist {event_id}: 在该时间段无数据，跳过对比")
+
+        # 汇总历史 norm_speed 同窗均值
+        maskh = (df_clean['hours_elapsed'] >= window.t_start) & (df_clean['hours_elapsed'] <= window.t_end)
+        if maskh.any():
+            hist_norms.append(df_clean.loc[maskh, 'norm_speed'].mean())
+    logger.info(f"DIAG hist_norms={hist_norms}")
+    return HistoryIntensity(hist_params, hist_intensities, hist_norms)
+
+
+# ---- 4. 强度修正比率 ----
+
+class RatioResult(NamedTuple):
+    ratio: float                # 最终使用的比率 (已裁剪)
+    skeleton_ratio: float
+    norm_ratio: Optional[float]
+    chosen: float
+    avg_hist_intensity: float
+
+
+def blend_ratio(target, history, t_end_cap=72.0, ratio_min=0.25, ratio_max=4.0):
+    """
+    使用双重度量并保守处理异常值
+     - skeleton_ratio: 基于去节律化后的 skeleton_speed（更接近模型形状）
+     - norm_ratio: 基于原始 norm_speed 的观测比（更贴近真实观测）
+    """
+    obs_norm_mean = target.obs_norm_mean
+    logger.info(f"DIAG obs_norm_mean={obs_norm_mean:.6f}, obs_skel_mean={target.intensity:.6f}")
+    hist_norms = history.norms
+    if hist_norms:
+        logger.info(f"DIAG norm_ratio = {obs_norm_mean / np.mean(hist_norms):.6f}")
+
+    if not history.intensities:
+        print("没有有效的历史对比数据，Ratio 重置为 1.0")
+        return RatioResult(1.0, float('nan'), None, 1.0, 1.0)
+
+    avg_hist_intensity = np.mean(history.intensities)
+    skeleton_ratio = target.intensity / avg_hist_intensity if avg_hist_intensity > 0 else np.nan
+
+    # 计算历史 norm_speed 的均值（若可得），用于 norm_ratio
+    norm_ratio = None
+    if hist_norms:
+        mean_hist_norm = np.mean(hist_norms)
+        if mean_hist_norm and mean_hist_norm > 0:
+            norm_ratio = obs_norm_mean / mean_hist_norm
+
+    # 选择性地混合两种 ratio：当两者都可用时按时间权重混合（从 skeleton 主导 -> 到 normal 主导）
+    skeleton_val = float(skeleton_ratio) if np.isfinite(skeleton_ratio) else None
+    norm_val = float(norm_ratio) if (norm_ratio is not None and np.isfinite(norm_ratio)) else None
+
+    # compute observed progress s (use configured target window length if available)
+    target_total_hours = float(t_end_cap)
+    s = 0.0
+    if target_total_hours and target_total_hours > 0:
+        s = np.clip(target.observed_hours / float(target_total_hours), 0.0, 1.0)
+
+    if skeleton_val is not None and norm_val is not None:
+        w_norm = 0.2 + 0.6 * np.cos(s * np.pi - np.pi)
+        w_norm = float(np.clip(w_norm, 0.0, 1.0))
+        chosen_ratio = skeleton_val * (1.0 - w_norm) + norm_val * w_norm
+        logger.info(f"Blend ratios using time-weight: s={s:.3f} w_norm={w_norm:.3f} skeleton={skeleton_val:.6f} norm={norm_val:.6f} -> chosen={chosen_ratio:.6f}")
+    elif skeleton_val is not None:
+        # fallback to whichever is available, else 1.0
+        chosen_ratio = skeleton_val
+    elif norm_val is not None:
+        chosen_ratio = norm_val
+    else:
+        chosen_ratio = 1.0
+
+    # Clip ratio 以防极端放大/缩小（阈值来自配置）
+    clipped_ratio = float(np.clip(chosen_ratio, float(ratio_min), float(ratio_max)))
+
+    # 记录诊断信息
+    logger.info(
+        "Ratio diagnostics: skeleton_ratio=%s norm_ratio=%s chosen=%s clipped=%s avg_hist_int=%s",
+        (f"{skeleton_ratio:.6f}" if np.isfinite(skeleton_ratio) else "nan"),
+        (f"{norm_ratio:.6f}" if norm_ratio is not None else "n/a"),
+        f"{chosen_ratio:.6f}", f"{clipped_ratio:.6f}", f"{avg_hist_intensity:.6f}"
+    )
+    if clipped_ratio != chosen_ratio:
+        logger.warning(f"Ratio clipped from {chosen_ratio:.6f} to {clipped_ratio:.6f} (bounds {ratio_min}-{ratio_max})")
+
+    print(f"强度修正比率 (skeleton/norm/chosen/clipped): {skeleton_ratio:.6f} / {(norm_ratio if norm_ratio is not None else float('nan')):.6f} -> {chosen_ratio:.6f} -> {clipped_ratio:.6f}")
+    return RatioResult(clipped_ratio, skeleton_ratio, norm_ratio, chosen_ratio, avg_hist_intensity)
+
+
+# ---- 5. 预测参数 ----
+
+class PredParams(NamedTuple):
+    avg: np.ndarray             # 历史参数均值
+    pred: np.ndarray            # 按比率修正后的参数
+
+
+def predict_params(history, ratio):
+    if history.params:
+        avg_params = np.mean(history.params, axis=0)
+    else:
+        # Default: [Base, A, B, B_end, T_panic]
+        avg_params = np.array(DEFAULT_PARAMS)
+
+    pred_params = avg_params.copy()
+
+    # Apply Ratio to parameters: scale Base, linear A and quadratic B moderately,
+    # and magnify B_end slightly as before. T_panic remains unchanged.
+    # Param order: [Base, A, B, B_end, T_panic]
+    pred_params[0] *= ratio        # Base
+    pred_params[1] *= ratio        # A (linear)
+    pred_params[2] *= ratio        # B (quadratic)
+    pred_params[3] *= (ratio ** 1.1)  # B_end
+
+    try:
+        # 标准化终端输出格式：更高精度且统一展示所有参数
+        print(
+            f"预测参数: Base={pred_params[0]:.6f}, "
+            f"A={pred_params[1]:.8e}, B={pred_params[2]:.8e}, "
+            f"B_end={pred_params[3]:.6f}, T_panic={int(pred_params[4])}"
+        )
+        logger.info(
+            f"Final pred_params: Base={pred_params[0]:.6f}, A={pred_params[1]:.8e}, "
+            f"B={pred_params[2]:.8e}, B_end={pred_params[3]:.6f}, T_panic={int(pred_params[4])}"
+        )
+        logger.debug(f"avg_params: {avg_params}; hist_intensities: {history.intensities}")
+    except:
+        pass
+    return PredParams(avg_params, pred_params)
+
+
+# ---- 6. 预测曲线 ----
+
+class Curve(NamedTuple):
+    t: np.ndarray               # 距开始的小时数 (1000 点)
+    skeleton: np.ndarray        # 去节律化的骨架速度
+    speed: np.ndarray           # 加上节律与冲刺修正后的归一化速度
+    total_hours: float
+
+
+def generate_curve(pred_params, start_at, end_at, seasonality, modeler):
+    target_total_hours = (end_at - start_at) / 3600000
+    future_t = np.linspace(0, target_total_hours, 1000)
+    skeleton_pred = modeler.shape_function(future_t, *pred_params, target_total_hours)
+    speed_pred, _ = seasonality.apply_seasonality(
+        future_t, skeleton_pred, start_at,
+        total_hours=target_total_hours, t_panic=pred_params[4]
+    )
+    return Curve(future_t, skeleton_pred, speed_pred, target_total_hours)
+
+
+# ---- 观测数据 (由 DataHandler 准备，供输出缩放与积分使用) ----
+
+class Observed(NamedTuple):
+    hours: np.ndarray           # target_data 的 hours_elapsed
+    scores: np.ndarray          # target_data 的分数 (ep / value)
+    current_max_score: float
+    current_max_time: float
+    history: pd.DataFrame       # 截止时刻之前的分数所用的目标数据，默认即 target_data
+
+
+def observe(target_data, full_target_data=None):
+    # full_target_data 不应包含冻结时刻 (debug_hours / 回测) 之后的数据
+    if 'ep' in target_data.columns:
+        score_series = target_data['ep']
+    elif 'value' in target_data.columns:
+        score_series = target_data['value']
+    else:
+        score_series = pd.Series(np.zeros(len(target_data)), index=target_data.index)
+    return Observed(
+        target_data['hours_elapsed'].values,
+        score_series.values,
+        score_series.max(),
+        target_data['hours_elapsed'].max(),
+        full_target_data if full_target_data is not None else target_data,
+    )
+
+
+def _score_column(df):
+    return 'ep' if 'ep' in df.columns else ('value' if 'value' in df.columns else None)
+
+
+# ---- 7. 输出缩放 ----
+
+class OutputScale(NamedTuple):
+    factor: float
+    ok: bool                    # False 表示计算失败 (factor 为 1.0，且不再做 24h 回测)
+
+
+def _step_minutes(t):
+    return (float(t[1] - t[0]) if len(t) > 1 else 0.0) * 60.0
+
+
+def _cutoff_window(t, observed, start_at, tz_offset):
+    """首日 18:00 (cutoff) 与当前进度在 t 上的下标，以及 cutoff 之后的观测增量"""
+    # cutoff hours (first day 18:00)
+    start_dt = datetime.fromtimestamp(start_at / 1000, tz=timezone(timedelta(hours=tz_offset)))
+    cutoff_dt = start_dt.replace(hour=18, minute=0, second=0, microsecond=0)
+    cutoff_ts = int(cutoff_dt.timestamp() * 1000)
+    cutoff_hours = (cutoff_ts - start_at) / (1000.0 * 3600.0)
+    if cutoff_hours < 0.0:
+        cutoff_hours = 0.0
+
+    # map to indices
+    idx_cutoff = int(np.searchsorted(t, cutoff_hours, side='left'))
+    idx_now = int(np.searchsorted(t, observed.current_max_time, side='right') - 1)
+    idx_cutoff = max(0, min(idx_cutoff, len(t) - 1))
+    idx_now = max(0, min(idx_now, len(t) - 1))
+
+    # observed cumulative before cutoff
+    # Use hours_elapsed to avoid timezone/timestamp misalignment; if no exact
+    # pre-cutoff row exists, fall back to the nearest earlier point (interpolation).
+    hist_df = observed.history
+    hist_col = _score_column(hist_df)
+    observed_before_cutoff = 0.0
+    if hist_col is not None and 'hours_elapsed' in hist_df.columns:
+        hrs = hist_df['hours_elapsed'].values
+        scores = hist_df[hist_col].values
+        # prefer rows strictly before cutoff_hours
+        before_mask = hrs < cutoff_hours
+        if np.any(before_mask):
+            # take latest available score before cutoff
+            observed_before_cutoff = float(scores[np.where(before_mask)[0][-1]])
+        else:
+            # no earlier row; attempt to use the earliest available score (usually 0)
+            observed_before_cutoff = float(scores[0]) if len(scores) > 0 else 0.0
+        logger.debug(f"Observed before cutoff via hours_elapsed: cutoff_hours={cutoff_hours:.3f} observed_before_cutoff={observed_before_cutoff}")
+    else:
+        # fallback to timestamp-based method if hours_elapsed missing
+        if hist_col is not None and 'time' in hist_df.columns:
+            before_mask = hist_df['time'] < cutoff_ts
+            if before_mask.any():
+                observed_before_cutoff = float(hist_df.loc[before_mask, hist_col].iloc[-1])
+
+    return idx_cutoff, idx_now, float(observed.current_max_score) - observed_before_cutoff
+
+
+def output_scale(curve, observed, target_scale, start_at, tz_offset, scale_min=0.5, scale_max=2.0):
+    """
+    Final output scaling: align model's cutoff->now mass to observed cutoff->now mass.
+    This computes model cumulative since first-day 18:00 and compares to observed
+    cumulative in the same interval, then scales future increments accordingly.
+    (If insufficient data or zero model mass, scale factor defaults to 1.0.)
+    """
+    try:
+        cum_all = np.cumsum(curve.speed * target_scale * _step_minutes(curve.t))
+        idx_cutoff, idx_now, observed_since_cutoff = _cutoff_window(curve.t, observed, start_at, tz_offset)
+        model_since_cutoff = float(cum_all[idx_now] - (cum_all[idx_cutoff-1] if idx_cutoff > 0 else 0.0))
+
+        if model_since_cutoff > 0 and observed_since_cutoff >= 0:
+            raw_scale = observed_since_cutoff / model_since_cutoff
+        else:
+            raw_scale = 1.0
+
+        scale_factor = float(np.clip(raw_scale, float(scale_min), float(scale_max)))
+        if scale_factor != raw_scale:
+            logger.warning(f"Output scaling clipped {raw_scale:.6f} -> {scale_factor:.6f}")
+        logger.info(f"Output scaling diagnostics: observed_since_cutoff={observed_since_cutoff:.1f} model_since_cutoff={model_since_cutoff:.1f} raw={raw_scale:.6f} applied={scale_factor:.6f}")
+        return OutputScale(scale_factor, True)
+    except Exception as e:
+        logger.warning(f"Failed to compute output scaling: {e}")
+        return OutputScale(1.0, False)
+
+
+# ---- 8. 24h 回测修正 ----
+
+def _backtest_window(t, observed):
+    """
+    当前进度超过 50 小时时 [t-24, now] 在 t 上的下标与该区间的观测增量 (无法取得时为 None)；
+    不需要回测时返回 None。
+    """
+    now_hours = float(observed.current_max_time)
+    if now_hours <= 50.0:
+        return None
+    t0 = max(0.0, now_hours - 24.0)
+    # 在 future_t 上定位索引
+    idx_t0 = int(np.searchsorted(t, t0, side='left'))
+    idx_now = int(np.searchsorted(t, now_hours, side='right') - 1)
+    idx_t0 = max(0, min(idx_t0, len(t) - 1))
+    idx_now = max(0, min(idx_now, len(t) - 1))
+    if idx_now <= idx_t0:
+        return None
+
+    # 取真实历史累计：找到 t0 之前最近的历史得分点
+    hist_df = observed.history
+    hist_col = _score_column(hist_df)
+    observed_24 = None
+    if hist_col is not None:
+        hrs = hist_df['hours_elapsed'].values
+        scores = hist_df[hist_col].values
+        pos = int(np.searchsorted(hrs, t0, side='left'))
+        if pos > 0:
+            observed_before_t0 = float(scores[pos-1])
+        else:
+            observed_before_t0 = float(scores[0]) if len(scores) > 0 else 0.0
+        observed_24 = float(observed.current_max_score) - observed_before_t0
+    return idx_t0, idx_now, observed_24
+
+
+def backtest_correction(curve, observed, scale, target_scale, corr_min=0.6, corr_max=1.6):
+    """
+    回测修正 (t vs t-24)：如果当前观测时间超过 50 小时，则用 t-24 的窗口回测：
+    1) 将模型在 [t-24, t] 的预测累计量与真实累计量比较
+    2) 得到一个额外的修正因子，乘到 scale.factor 上
+    返回最终的缩放系数。
+    """
+    if not scale.ok:
+        return 1.0
+    scale_factor = scale.factor
+    try:
+        window = _backtest_window(curve.t, observed)
+        if window is None:
+            return scale_factor
+        idx_t0, idx_now, observed_24 = window
+
+        # 计算模型在 [t0, now] 的预测累计（使用当前 scale_factor）
+        pred_segment = curve.speed[idx_t0:idx_now]
+        model_24 = float(np.sum(pred_segment) * target_scale * scale_factor * _step_minutes(curve.t))
+
+        if (model_24 > 0) and (observed_24 is not None) and (observed_24 >= 0):
+            raw_corr = observed_24 / model_24
+            corr = float(np.clip(raw_corr, float(corr_min), float(corr_max)))
+            if corr != raw_corr:
+                logger.warning(f"24h correction clipped {raw_corr:.6f} -> {corr:.6f}")
+            applied_scale_factor = float(scale_factor * corr)
+            logger.info(f"24h backtest diagnostics: observed_24={observed_24:.1f} model_24={model_24:.1f} raw_corr={raw_corr:.6f} applied_corr={corr:.6f} final_scale={applied_scale_factor:.6f}")
+            return applied_scale_factor
+        logger.info("24h backtest skipped due to insufficient data or zero model mass")
+        return scale_factor
+    except Exception as e:
+        logger.warning(f"24h backtest failed: {e}")
+        return scale_factor
+
+
+# ---- 9. 顶部平滑 ----
+
+def smooth_top(norm, thresh1=0.5, thresh2=0.65, hard_cap=0.8):
+    """
+    Top-speed smoothing: when normalized speed (after scale) > thresh1,
+    apply a smooth attenuation so growth flattens approaching the top line.
+    阈值可以是与 norm 可广播的数组 ((n, 1)，见 sweep_configs)。
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Stage 1: mild attenuation between THRESH1 and THRESH2
+        excess1 = (norm - thresh1) / (thresh2 - thresh1)
+        stage1 = thresh1 + (norm - thresh1) * (1.0 / (1.0 + SMOOTH_ALPHA * excess1))
+        # Stage 2: strong attenuation above THRESH2 (quadratic penalization)
+        excess2 = (norm - thresh2) / (1.0 - thresh2)
+        stage2 = thresh2 + (norm - thresh2) * (1.0 / (1.0 + SMOOTH_BETA * (excess2 ** 2)))
+    norm_adj = np.where(norm > thresh2, stage2, np.where(norm > thresh1, stage1, norm))
+
+    # Enforce hard cap
+    return np.minimum(norm_adj, hard_cap)
+
+
+class Smoothed(NamedTuple):
+    t: np.ndarray               # 未来部分的时间 (>= 当前进度)
+    real_speed: np.ndarray      # 未来部分的实际速度 (EP/分钟)
+    norm_full: np.ndarray       # 完整曲线平滑后的归一化速度 (绘图用)
+
+
+def top_smoothing(curve, observed, final_scale, target_scale, thresh1=0.5, thresh2=0.65, hard_cap=0.8):
+    future_mask = curve.t >= observed.current_max_time
+    future_t_clip = curve.t[future_mask]
+    speed_pred_clip = curve.speed[future_mask]
+
+    real_speed_ep_min = None
+    if len(future_t_clip) > 0:
+        # This operates in normalized units (relative to target_scale) AFTER final_scale.
+        try:
+            norm_after_scale = speed_pred_clip * float(final_scale)
+            norm_adj = smooth_top(norm_after_scale, float(thresh1), float(thresh2), float(hard_cap))
+            if np.any(norm_adj != norm_after_scale):
+                logger.info(f"Top-smoothing applied (stage1>{thresh1}, stage2>{thresh2}, cap={hard_cap})")
+            # convert back to real speed per minute
+            real_speed_ep_min = norm_adj * target_scale
+        except Exception as e:
+            logger.warning(f"Top-smoothing failed: {e}")
+            real_speed_ep_min = speed_pred_clip * target_scale * final_scale
+
+    # Ensure plotted predicted speed matches the final adjusted curve used
+    # in cumulative computations (final scaling + top-smoothing + cap across the full vector).
+    try:
+        norm_adj_full = smooth_top(curve.speed * float(final_scale), float(thresh1), float(thresh2), float(hard_cap))
+    except Exception:
+        norm_adj_full = curve.speed.copy()
+    return Smoothed(future_t_clip, real_speed_ep_min, norm_adj_full)
+
+
+# ---- 10. 分数积分 ----
+
+class Forecast(NamedTuple):
+    t_hours: np.ndarray         # 已观测 + 预测部分的时间 (小时)
+    score: np.ndarray
+
+
+def integrate_scores(smoothed, observed):
+    future_t_clip = smoothed.t
+    if len(future_t_clip) > 0:
+        dt_hours = (future_t_clip[1] - future_t_clip[0]) if len(future_t_clip) > 1 else 0
+        dt_min = dt_hours * 60
+        score_increment = np.cumsum(smoothed.real_speed * dt_min)
+        score_pred = observed.current_max_score + score_increment
+        return Forecast(
+            np.concatenate([observed.hours, future_t_clip]),
+            np.concatenate([observed.scores, score_pred]),
+        )
+    return Forecast(observed.hours, observed.scores)
+
+
+# ---- 11. 导出 ----
+
+def export_cutoffs(forecast, start_at):
+    """预测分数线 JSON (与 Bestdori tracker 格式一致)"""
+    return {
+        "result": True,
+        "cutoffs": [
+            {
+                "time": int(start_at + t * 3600 * 1000),
+                "ep": int(ep)
+            }
+            for t, ep in zip(forecast.t_hours, forecast.score)
+        ]
+    }
+
+
+# ==========================================
+# What-if 扫描 (一次评估多组配置)
+# ==========================================
+# SWEEP_KNOBS 只影响比率裁剪之后的阶段：去节律化、历史拟合与比率混合只算一次，
+# 其余各阶段把 n 组配置当作 (n, 1) 的参数列，对 (n, 1000) 的曲线一次完成计算。
+# 每一组的结果与用该配置调用 run_prediction 相同。
+
+SWEEP_KNOBS = (
+    'ratio_min', 'ratio_max', 'scale_min', 'scale_max', 'corr_min', 'corr_max',
+    'smooth_thresh1', 'smooth_thresh2', 'smooth_hard_cap', 'panic_ease_power', 'panic_scaler',
+)
+
+
+def config_grid(grid):
+    """{knob: [values]} 的笛卡尔积 -> [{knob: value}]"""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+class SweepResult(NamedTuple):
+    configs: list               # 每组完整的 SWEEP_KNOBS 取值
+    ratio: np.ndarray           # (n,) 裁剪后的强度比率
+    scale: np.ndarray           # (n,) 输出缩放系数
+    final_scale: np.ndarray     # (n,) 含 24h 回测修正
+    t_hours: np.ndarray         # 分数线的时间 (小时)
+    scores: np.ndarray          # (n, len(t_hours)) 分数线
+
+
+def sweep_configs(configs, ratio, history, observed, target_scale, start_at, end_at, seasonality, modeler):
+    """configs: [{knob: value}]，每组必须包含全部 SWEEP_KNOBS"""
+    n = len(configs)
+    knob = {k: np.array([float(c[k]) for c in configs]).reshape(n, 1) for k in SWEEP_KNOBS}
+
+    # 4. 比率：混合结果与配置无关，只有裁剪边界不同
+    if history.intensities:
+        r = np.clip(ratio.chosen, knob['ratio_min'], knob['ratio_max'])
+    else:
+        r = np.ones((n, 1))
+
+    # 5. 参数 (n, 5)
+    avg_params = np.mean(history.params, axis=0) if history.params else np.array(DEFAULT_PARAMS)
+    pred = np.repeat(avg_params[None, :], n, axis=0)
+    pred[:, 0:3] *= r               # Base, A, B
+    pred[:, 3:4] *= r ** 1.1        # B_end
+
+    # 6. 曲线 (n, 1000)；T_panic 不受比率影响，各组相同
+    t_panic = avg_params[4]
+    total_hours = (end_at - start_at) / 3600000
+    t = np.linspace(0, total_hours, 1000)
+    skeleton = modeler.shape_function(t, pred[:, 0:1], pred[:, 1:2], pred[:, 2:3], pred[:, 3:4], t_panic, total_hours)
+    speed, _ = seasonality.apply_seasonality(
+        t, skeleton, start_at, total_hours=total_hours, t_panic=t_panic,
+        panic_ease_power=knob['panic_ease_power'], panic_scaler=knob['panic_scaler'],
+    )
+    speed = np.broadcast_to(speed, (n, len(t)))
+    step = _step_minutes(t)
+
+    # 7. 输出缩放
+    scale_ok = True
+    try:
+        cum_all = np.cumsum(speed * target_scale * step, axis=1)
+        idx_cutoff, idx_now, observed_since_cutoff = _cutoff_window(t, observed, start_at, seasonality.tz_offset)
+        model_since_cutoff = cum_all[:, idx_now] - (cum_all[:, idx_cutoff-1] if idx_cutoff > 0 else 0.0)
+        valid = (model_since_cutoff > 0) & (observed_since_cutoff >= 0)
+        raw_scale = np.where(valid, observed_since_cutoff / np.where(valid, model_since_cutoff, 1.0), 1.0)
+        scale = np.clip(raw_scale, knob['scale_min'][:, 0], knob['scale_max'][:, 0])
+    except Exception as e:
+        logger.warning(f"Sweep: failed to compute output scaling: {e}")
+        scale = np.ones(n)
+        scale_ok = False
+
+    # 8. 24h 回测修正
+    final_scale = scale.copy()
+    if scale_ok:
+        try:
+            window = _backtest_window(t, observed)
+            if window is not None and window[2] is not None and window[2] >= 0:
+                idx_t0, idx_now, observed_24 = window
+                model_24 = np.sum(speed[:, idx_t0:idx_now], axis=1) * target_scale * scale * step
+                valid = model_24 > 0
+                corr = np.clip(observed_24 / np.where(valid, model_24, 1.0), knob['corr_min'][:, 0], knob['corr_max'][:, 0])
+                final_scale = np.where(valid, scale * corr, scale)
+        except Exception as e:
+            logger.warning(f"Sweep: 24h backtest failed: {e}")
+
+    # 9. 顶部平滑与 10. 积分 (只有未来部分)
+    future_mask = t >= observed.current_max_time
+    future_t_clip = t[future_mask]
+    observed_scores = np.broadcast_to(observed.scores, (n, len(observed.scores)))
+    if len(future_t_clip) > 0:
+        norm_after_scale = speed[:, future_mask] * final_scale[:, None]
+        norm_adj = smooth_top(norm_after_scale, knob['smooth_thresh1'], knob['smooth_thresh2'], knob['smooth_hard_cap'])
+        score_pred = observed.current_max_score + np.cumsum(norm_adj * target_scale * _step_minutes(future_t_clip), axis=1)
+        t_hours = np.concatenate([observed.hours, future_t_clip])
+        scores = np.concatenate([observed_scores, score_pred], axis=1)
+    else:
+        t_hours = observed.hours
+        scores = np.array(observed_scores)
+
+    return SweepResult(list(configs), r[:, 0], scale, final_scale, t_hours, scores)
@@ -1,12 +1,14 @@
-import requests
+import asyncio
 import pandas as pd
 import numpy as np
 import json
 import os
 import time
+import hashlib
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_agg import FigureCanvasAgg
 import matplotlib.dates as mdates
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
 from scipy.optimize import curve_fit
@@ -16,31 +18,33 @@ from logging import handlers
 # 引入基础工具
 from base_distribution import (
     fetch_event_meta, 
-    fetch_tier_1000_data,
+    fetch_tracker_data,
+    tracker_signature,
+    parse_tracker,
     calculate_speed_tracker,
-    get_day_type, 
-    fetch_top10_max_speed,
+    fetch_eventtop_buffer,
+    fetch_events_index,
+    parse_event_meta,
+    event_is_final,
     BASE_URL, 
     SERVER
 )
 
-try:
-    from chinese_calendar import is_workday
-except Exception:
-    is_workday = None
-
-from config import DEFAULT_CONFIG
-
-# Create a module-level requests Session to enable connection reuse and
-# avoid creating many short-lived sockets (prevents FD exhaustion/time_wait)
-HTTP_SESSION = requests.Session()
-try:
-    adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=3)
-    HTTP_SESSION.mount('http://', adapter)
-    HTTP_SESSION.mount('https://', adapter)
-except Exception:
-    # if adapter creation fails for any reason, keep using default session
-    pass
+from async_client import AsyncBestdoriClient, run_sync
+from cache import get_cache
+from calendar_service import CALENDAR, DAY_TYPE_NAMES
+from config import ASYNC_CLIENT_CONFIG, DEFAULT_CONFIG, SEASONALITY_CONFIG
+from eventtop_stream import TopSpeedTracker
+from history_store import get_history_store
+from seasonality_store import load_table as load_seasonality_table
+from http_client import get_session
+import metrics
+import prediction_stages as stages
+from prediction_stages import StageMemo, input_key
+
+# Shared requests Session (one connection pool for predictor and base_distribution),
+# see http_client.get_session
+HTTP_SESSION = get_session()
 
 # Setup logger for detailed run diagnostics (file-only; do not print logs to terminal)
 LOG_PATH = os.path.join(os.path.dirname(__file__), 'predictor.log')
@@ -196,16 +200,39 @@ def get_current_event_for_server(recent_json=None, server_index=3, now_ts_ms=Non
     return None
 
 
+@metrics.stage('write_json')
+def write_json_atomic(path, obj):
+    """
+    Write JSON via a temp file + os.replace so readers (e.g. the TS backend's
+    Cutoff.readPredict2Data) never observe a half-written file.
+    """
+    out_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = os.path.join(out_dir, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
 # ==========================================
 # 1. 昼夜节律处理器 (SeasonalityHandler)
 # ==========================================
 class SeasonalityHandler:
-    def __init__(self, json_path='base_speed_distribution.json', tz_offset=8, panic_ease_power=1.0, weekend_multiplier=1.0, panic_scaler=1.1):
-        self.data = self._load_json(json_path)
-
-        if weekend_multiplier != 1.0:
+    """
+    按小时的节律因子。表由 seasonality_store.load_table 按 (server, tier, event_type) 读取并在进程内共享，
+    找不到时回退到 json_path (国服 T1000 的 base_speed_distribution.json)。
+    """
+    def __init__(self, json_path='base_speed_distribution.json', tz_offset=8, panic_ease_power=1.0, weekend_multiplier=1.0, panic_scaler=1.1,
+                 server=SERVER, tier=1000, event_type=None):
+        self.table = load_seasonality_table(server, tier, event_type, fallback_json=json_path)
+        if self.table is None:
+            print(f"警告：找不到 {json_path}，将不使用节律修正。")
+        # [day_type(0=weekday, 1=weekend), hour] 的均值；无数据为 nan。共享表只读，这里拷贝后再修改
+        self.mean_table = self.table.mean.copy() if self.table is not None else None
+
+        if weekend_multiplier != 1.0 and self.mean_table is not None:
             print(f"正在应用周末增强系数: x{weekend_multiplier} 喵！")
-            self._apply_multiplier('weekend', weekend_multiplier)
+            self.mean_table[1] *= weekend_multiplier
         
         # 修正逻辑：分别计算平日和周末的均值，再进行 5:2 加权合成
         self.wd_mean, self.we_mean, self.global_mean = self._calculate_weighted_means()
@@ -215,45 +242,35 @@ class SeasonalityHandler:
         self.tz_offset = tz_offset
         self.panic_ease_power = float(panic_ease_power)
         self.panic_scaler = float(panic_scaler)
+
+        # 预编译因子表: [day_type(0=weekday, 1=weekend), hour] -> mean / global_mean
+        self.factor_table = self._build_factor_table()
+        # 节律表版本：表内容（已含周末增强系数）+ 时区，用于历史拟合结果的缓存键
+        self.version = hashlib.sha1(
+            self.factor_table.tobytes() + str(self.tz_offset).encode('utf-8')
+        ).hexdigest()[:16]
         
-        print(f"昼夜节律数据已加载:")
+        source = f"T{self.table.tier}/{self.table.event_type or 'all'}" if self.table is not None else "无"
+        print(f"昼夜节律数据已加载: {source}")
         # print(f"  - 平日基准均值 (Weekday): {self.wd_mean:.6f}")
         # print(f"  - 周末基准均值 (Weekend): {self.we_mean:.6f}")
         # print(f"  - 全局加权均值 (Weighted Global): {self.global_mean:.6f} (panic_ease={self.panic_ease_power})")
 
-    def _load_json(self, path):
-        if not os.path.exists(path):
-            print(f"警告：找不到 {path}，将不使用节律修正。")
-            return {}
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-        
-    def _apply_multiplier(self, dtype, multiplier):
-        """直接修改 self.data 字典中的均值数据"""
-        if dtype not in self.data: return
-        for hour_key in self.data[dtype]:
-            if 'mean' in self.data[dtype][hour_key]:
-                self.data[dtype][hour_key]['mean'] *= multiplier
-
     def _calculate_weighted_means(self):
         """
         分别计算平日和周末的日均速度，并按 5:2 权重合成全局均值。
         这样可以防止因周末/平日数据量不均导致的基准偏差。
         """
-        if not self.data: return 1.0, 1.0, 1.0
+        if self.mean_table is None: return 1.0, 1.0, 1.0
         
-        def get_day_type_mean(dtype):
-            values = []
-            # 遍历 0-23 小时
-            for h in range(24):
-                item = self.data.get(dtype, {}).get(str(h))
-                if item and item.get('mean', 0) > 0:
-                    values.append(item['mean'])
+        def get_day_type_mean(row):
+            # 0-23 小时中均值为正的小时
+            values = self.mean_table[row][self.mean_table[row] > 0]
             # 如果该类型没有数据，返回 1.0 避免除零，否则返回该类型一天的平均速度
-            return np.mean(values) if values else 1.0
+            return np.mean(values) if values.size else 1.0
 
-        wd_mean = get_day_type_mean('weekday')
-        we_mean = get_day_type_mean('weekend')
+        wd_mean = get_day_type_mean(0)
+        we_mean = get_day_type_mean(1)
         
         # 核心修正：加权平均 (平日5天，周末2天)
         # 这样算出来的 global_mean 才是这一周真实的“期望速度”
@@ -261,104 +278,104 @@ class SeasonalityHandler:
         
         return wd_mean, we_mean, weighted_global
 
+    def _build_factor_table(self):
+        table = np.ones((2, 24), dtype=float)
+        if self.mean_table is None:
+            return table
+        valid = self.mean_table > 0
+        table[valid] = self.mean_table[valid] / self.global_mean
+        return table
+
+    def get_factors(self, timestamps_ms):
+        """
+        向量化的 get_factor：输入 UTC 毫秒时间戳数组，返回每个时间点的节律因子。
+        规则与 get_factor 相同（周五 17:00 后视为周末，周日 23:00 后视为工作日，其余按法定工作日）。
+        """
+        ts = np.asarray(timestamps_ms, dtype=float)
+        if self.mean_table is None or ts.size == 0:
+            return np.ones(ts.shape, dtype=float)
+        _, hour, _ = CALENDAR.local_parts(ts, self.tz_offset)
+        day_type = CALENDAR.day_types(ts, self.tz_offset)
+        return self.factor_table[day_type, hour]
+
     def get_factor(self, dt):
-        if not self.data: return 1.0
+        if self.mean_table is None: return 1.0
         if isinstance(dt, (int, float)): 
             dt_obj = datetime.fromtimestamp(dt / 1000) + timedelta(hours=self.tz_offset)
         else:
             dt_obj = dt
             
-        # Special rules: Friday after 17:00 treated as weekend (players behave like weekend)
-        # and Sunday after 23:00 treated as weekday (late-night rollback to weekday pattern)
-        if isinstance(dt_obj, datetime):
-            if dt_obj.weekday() == 4 and dt_obj.hour >= 17:
-                dtype = 'weekend'
-            elif dt_obj.weekday() == 6 and dt_obj.hour >= 23:
-                dtype = 'weekday'
-            else:
-                # 2. 使用 chinese_calendar（若可用）判断法定节假日/工作日
-                if is_workday is not None:
-                    try:
-                        if is_workday(dt_obj.date()):
-                            dtype = 'weekday'
-                        else:
-                            dtype = 'weekend'
-                    except:
-                        dtype = get_day_type(dt_obj)
-                else:
-                    # 3. Fallback: 普通周末判断
-                    dtype = get_day_type(dt_obj)
-        else:
-            # If dt_obj is not datetime for some reason, fallback
-            if is_workday is not None:
-                try:
-                    if is_workday(dt_obj): dtype = 'weekday'
-                    else: dtype = 'weekend'
-                except:
-                    dtype = get_day_type(dt_obj)
-            else:
-                dtype = get_day_type(dt_obj)
+        # 周五 17:00 后视为周末、周日 23:00 后视为工作日、法定节假日等规则统一由 CALENDAR 处理
+        dtype = CALENDAR.day_type(dt_obj)
             
-        hour = str(dt_obj.hour)
-        stats = self.data.get(dtype, {}).get(hour)
-        
-        # 这里的逻辑保持不变：用当前小时的均值除以【全局加权均值】
+        # 这里的逻辑保持不变：用当前小时的均值除以【全局加权均值】(factor_table)
         # 这样如果 dtype 是 weekend，分子通常较大，Factor > 1.0，正确反映周末加速
-        if stats and stats['mean'] > 0:
-            return stats['mean'] / self.global_mean
-        return 1.0 
+        return float(self.factor_table[DAY_TYPE_NAMES.index(dtype), dt_obj.hour]) 
+
+    def deseasonalize_arrays(self, time_ms, hours_elapsed, norm_speed):
+        """remove_seasonality 的数组版本，返回 (season_factor, skeleton_speed)。"""
+        factor = self.get_factors(time_ms)
+
+        # --- Early-hour suppression ---
+        if hours_elapsed is not None:
+            factor = np.where((np.asarray(hours_elapsed) < 12.0) & (factor < 1.0), 1.0, factor)
+
+        return factor, np.asarray(norm_speed, dtype=float) / factor
 
     def remove_seasonality(self, df):
         df = df.copy()
         # `base_speed_distribution.json` uses local hours. Convert timestamp to local
         # datetime by applying the detected tz_offset.
         df['dt_local'] = pd.to_datetime(df['time'], unit='ms') + pd.Timedelta(hours=self.tz_offset)
-        df['season_factor'] = df['dt_local'].apply(self.get_factor)
-
-        # --- Early-hour suppression ---
-        if 'hours_elapsed' in df.columns:
-            mask_early = (df['hours_elapsed'] < 12.0) & (df['season_factor'] < 1.0)
-            if mask_early.any():
-                df.loc[mask_early, 'season_factor'] = 1.0
-
-        df['skeleton_speed'] = df['norm_speed'] / df['season_factor']
+        hours = df['hours_elapsed'].values if 'hours_elapsed' in df.columns else None
+        df['season_factor'], df['skeleton_speed'] = self.deseasonalize_arrays(
+            df['time'].values, hours, df['norm_speed'].values
+        )
         return df
 
-    def apply_seasonality(self, t_hours, y_skeleton, start_ts, total_hours=None, t_panic=24.0):
-        y_final = []
-        factors = []
-
-        for i, h in enumerate(t_hours):
-            current_ts = start_ts + (h * 3600 * 1000)
-            dt_utc = datetime.fromtimestamp(current_ts / 1000, timezone.utc)
-            dt_local = dt_utc + timedelta(hours=self.tz_offset)
-
-            # 1) 原始节律因子
-            raw_factor = self.get_factor(dt_local)
-
-            # 2) 恐慌/肾上腺素修正
-            final_factor = raw_factor
-            if (total_hours is not None) and (t_panic is not None) and t_panic > 0:
-                time_left = total_hours - h
-                if time_left < t_panic:
-                    progress = 1.0 - (max(0.0, time_left) / float(t_panic))
-                    eased = float(np.power(progress, self.panic_ease_power)) if progress > 0 else 0.0
-                    target_factor = max(raw_factor, self.panic_scaler)
-                    final_factor = raw_factor * (1.0 - eased) + target_factor * eased
-
-            factors.append(final_factor)
-            y_final.append(y_skeleton[i] * final_factor)
-
-        return np.array(y_final), np.array(factors)
+    def apply_seasonality(self, t_hours, y_skeleton, start_ts, total_hours=None, t_panic=24.0,
+                          panic_ease_power=None, panic_scaler=None):
+        """
+        panic_ease_power / panic_scaler 默认取自本实例；传入 (n, 1) 数组时 y_skeleton 为 (n, len(t_hours))，
+        一次得到 n 组恐慌期参数下的曲线 (what-if 扫描)。
+        """
+        t_hours = np.asarray(t_hours, dtype=float)
+        if panic_ease_power is None:
+            panic_ease_power = self.panic_ease_power
+        if panic_scaler is None:
+            panic_scaler = self.panic_scaler
+
+        # 1) 原始节律因子
+        raw_factor = self.get_factors(start_ts + t_hours * 3600 * 1000)
+
+        # 2) 恐慌/肾上腺素修正
+        final_factor = raw_factor
+        if (total_hours is not None) and (t_panic is not None) and t_panic > 0:
+            time_left = total_hours - t_hours
+            in_panic = time_left < t_panic
+            if np.any(in_panic):
+                progress = 1.0 - (np.maximum(0.0, time_left) / float(t_panic))
+                eased = np.where(progress > 0, np.power(np.maximum(progress, 0.0), panic_ease_power), 0.0)
+                target_factor = np.maximum(raw_factor, panic_scaler)
+                blended = raw_factor * (1.0 - eased) + target_factor * eased
+                final_factor = np.where(in_panic, blended, raw_factor)
+
+        return np.asarray(y_skeleton, dtype=float) * final_factor, final_factor
 
 # ==========================================
 # 2. 正弦下凹模型 (SineConcaveModeler) - NEW! 🆕
 # ==========================================
 class CosineModeler:
+    # shape_function / fit 的行为变化时递增，使已缓存的历史拟合结果失效
+    VERSION = 4
+    # 单次拟合的函数评估上限 (与原实现的 maxfev 相同)；解析 Jacobian 下正常拟合只需约 10 次评估
+    MAX_NFEV = 40000
+
     def __init__(self):
         pass
 
     def shape_function(self, t, Base, A, B, B_end, T_panic, T_total):
+        # Base / A / B / B_end 可以是 (n, 1) 数组 (T_panic 必须为标量)，此时一次返回 n 条曲线
         # 1. 基础层 + 二次增长层 (Base + A * t + B * t^2)
         #    通过二次项可以更灵活地拟合中段的曲线行为（凹/凸），替代之前的线性项
         y = Base + (A * t) + (B * (t ** 2))
@@ -368,7 +385,7 @@ class CosineModeler:
         # 生成 rise（余弦上升），但在加入到 y 前进行灰度过渡处理：
         # 在 slope 阶段的最后4h（t_start_panic-4..t_start_panic）和
         # 余弦上升的前半段（panic 前半）之间做一个平滑混合。
-        rise = np.zeros_like(t, dtype=float)
+        rise = np.zeros(np.broadcast(t, B_end).shape, dtype=float)
         mask_end = t > t_start_panic
         if np.any(mask_end):
             norm_t = (t[mask_end] - t_start_panic) / T_panic
@@ -380,7 +397,7 @@ class CosineModeler:
             base = np.sin(norm_t * (np.pi / 2.0))
             focus = np.power(np.clip((norm_t - 0.5) / 0.5, 0.0, 1.0), focus_power)
             rise_vals = B_end * (np.power(base, p) * focus)
-            rise[mask_end] = rise_vals
+            rise[..., mask_end] = rise_vals
 
         # 计算混合权重：从 (t_start_panic - 4) 开始，到 (t_start_panic + T_panic/2) 完成
         blend_start = t_start_panic - 4.0
@@ -393,26 +410,248 @@ class CosineModeler:
 
         return np.maximum(y, 0)  # 物理约束：速度不能为负
 
-    def fit(self, t_data, y_data, total_hours):
-        # 参数: [Base, A, B, B_end, T_panic]
-        # 初始猜测：小幅线性项和非常小的二次项
-        p0 = [0.05, 0.001, 0.00001, 0.5, 24.0]
+    # 参数: [Base, A, B, B_end, T_panic]
+    DEFAULT_P0 = (0.05, 0.001, 0.00001, 0.5, 24.0)
 
+    def _bounds(self, total_hours):
         max_panic = min(72, total_hours / 2)
 
         # 边界设置：允许 A 正负（轻微上/下斜），B 保持小幅以避免发散
-        bounds = (
-            [0.0,  -0.01,  -0.001,  0.0,    6.0],      # Lower
-            [1.0,   0.01,   0.001,  10.0,   max_panic]   # Upper
+        return (
+            np.array([0.0,  -0.01,  -0.001,  0.0,    6.0]),       # Lower
+            np.array([1.0,   0.01,   0.001,  10.0,   max_panic])    # Upper
         )
 
+    def _make_model(self, t, total_hours):
+        """
+        为一次拟合构造 (模型函数, 解析 Jacobian)。
+        中间量写入预分配的工作数组，避免每次评估都重新分配 rise / blend / mask 等临时数组。
+        与 shape_function 的公式逐项对应（rise 使用 p=2.5, focus_power=3.0）。
+        """
+        t = np.ascontiguousarray(t, dtype=float)
+        n = len(t)
+        t2 = t * t
+        ws = {name: np.empty(n) for name in ('norm', 'base', 'focus', 'g', 'blend', 'y', 'tmp')}
+        half_pi = np.pi / 2.0
+        p = 2.5
+        state = {'params': None}
+
+        def evaluate(base_, a, b, bend, tp):
+            t_start_panic = total_hours - tp
+            # norm_t: panic 窗口内进度；窗口外为 0 (rise 为 0)
+            np.subtract(t, t_start_panic, out=ws['norm'])
+            ws['norm'] /= tp
+            np.clip(ws['norm'], 0.0, 1.0, out=ws['norm'])
+            np.multiply(ws['norm'], half_pi, out=ws['base'])
+            np.sin(ws['base'], out=ws['base'])
+            # focus = clip(2n-1, 0, 1)^3
+            np.multiply(ws['norm'], 2.0, out=ws['focus'])
+            ws['focus'] -= 1.0
+            np.clip(ws['focus'], 0.0, 1.0, out=ws['focus'])
+            # g = base^p * focus^3 （rise = B_end * g）
+            np.power(ws['base'], p, out=ws['g'])
+            np.power(ws['focus'], 3.0, out=ws['tmp'])
+            ws['g'] *= ws['tmp']
+            # blend 从 (t_start_panic - 4) 线性过渡到 (t_start_panic + T_panic/2)
+            blend_len = max(1e-6, tp / 2.0 + 4.0)
+            np.subtract(t, t_start_panic - 4.0, out=ws['blend'])
+            ws['blend'] /= blend_len
+            np.clip(ws['blend'], 0.0, 1.0, out=ws['blend'])
+            # y = Base + A t + B t^2 + B_end * g * blend
+            np.multiply(ws['g'], ws['blend'], out=ws['y'])
+            ws['y'] *= bend
+            ws['y'] += base_
+            ws['y'] += a * t
+            ws['y'] += b * t2
+            state['params'] = (base_, a, b, bend, tp)
+
+        def model(_t, base_, a, b, bend, tp):
+            evaluate(base_, a, b, bend, tp)
+            return np.maximum(ws['y'], 0.0)
+
+        def jac(_t, base_, a, b, bend, tp):
+            if state['params'] != (base_, a, b, bend, tp):
+                evaluate(base_, a, b, bend, tp)
+            J = np.empty((n, 5))
+            J[:, 0] = 1.0
+            J[:, 1] = t
+            J[:, 2] = t2
+            np.multiply(ws['g'], ws['blend'], out=J[:, 3])
+
+            # d/dT_panic: rise 与 blend 都依赖 T_panic
+            norm = ws['norm']
+            inside = (norm > 0.0) & (norm < 1.0) & (ws['focus'] > 0.0)
+            dg_dT = np.zeros(n)
+            if np.any(inside):
+                base_in = ws['base'][inside]
+                u = ws['focus'][inside]
+                dg_dn = (p * np.power(base_in, p - 1.0) * np.cos(norm[inside] * half_pi) * half_pi * (u ** 3)
+                         + np.power(base_in, p) * 6.0 * (u ** 2))
+                dn_dT = (total_hours - t[inside]) / (tp * tp)
+                dg_dT[inside] = dg_dn * dn_dT
+            blend_len = tp / 2.0 + 4.0
+            blend = ws['blend']
+            in_blend = (blend > 0.0) & (blend < 1.0)
+            dblend_dT = np.zeros(n)
+            num = t[in_blend] - (total_hours - tp - 4.0)
+            dblend_dT[in_blend] = (blend_len - 0.5 * num) / (blend_len * blend_len)
+            J[:, 4] = bend * (dg_dT * blend + ws['g'] * dblend_dT)
+
+            # np.maximum(y, 0) 截断处梯度为 0
+            J[ws['y'] <= 0.0, :] = 0.0
+            return J
+
+        return model, jac
+
+    def fit(self, t_data, y_data, total_hours):
+        """
+        从 DEFAULT_P0 开始拟合 [Base, A, B, B_end, T_panic]。
+        结果会以 (数据, 节律表, ...) 为键缓存，因此初值不能依赖运行历史 (例如其他 tier 先前的拟合结果)。
+        拟合失败时返回 None，由调用方决定是否退回 DEFAULT_P0 (失败的结果不应写入缓存)。
+        """
+        lower, upper = self._bounds(total_hours)
+        model, jac = self._make_model(t_data, total_hours)
         try:
-            func = lambda t, base, a, b, bend, tp: self.shape_function(t, base, a, b, bend, tp, total_hours)
-            popt, _ = curve_fit(func, t_data, y_data, p0=p0, bounds=bounds, maxfev=40000)
+            popt, _, info, _, _ = curve_fit(model, t_data, y_data, p0=np.array(self.DEFAULT_P0), bounds=(lower, upper),
+                                            jac=jac, maxfev=self.MAX_NFEV, full_output=True)
+            metrics.inc('fits_total', result='ok')
+            metrics.observe('fit_iterations', info.get('nfev', 0))
             return popt
         except Exception as e:
-            print(f"拟合失败，使用默认参数: {e}")
-            return np.array(p0)
+            metrics.inc('fits_total', result='failed')
+            print(f"拟合失败: {e}")
+            return None
+
+# 历史拟合参数的进程内缓存 (key 见 DataHandler._fit_cache_key)，
+# 在同一进程内跨 DataHandler 共享，例如 Streamlit 调整与历史无关的参数后重新运行。
+# 按 LRU 保留最多 FIT_MEMO_ENTRIES 条，常驻服务中不会随活动切换无限增长
+_FIT_MEMO = OrderedDict()
+FIT_MEMO_ENTRIES = 512
+# 拟合失败的历史活动 (使用默认参数、不缓存) 在同一 DataHandler 内多久之后重新拟合
+FIT_RETRY_SECONDS = 300
+
+
+def _memo_fit(key, popt):
+    _FIT_MEMO[key] = popt
+    _FIT_MEMO.move_to_end(key)
+    while len(_FIT_MEMO) > FIT_MEMO_ENTRIES:
+        _FIT_MEMO.popitem(last=False)
+
+# _candidate_info 中尚未查询过的候选
+_UNKNOWN = object()
+# run_prediction_batch 中尚未计算的共享 T10 scale
+_PENDING = object()
+
+
+class _TargetFrame:
+    """
+    目标活动的速度序列，按列存放在按容量倍增的 numpy 数组中 (常驻增量刷新用)。
+    append 只写入新行 (均摊 O(新数据点))；frame() 返回共享这些数组的 DataFrame，不复制已有数据。
+    norm_speed 不随 T10 scale 变化逐行重算：新行按当前 scale 写入，scale 变化时在下一次 frame() 中重新整体计算。
+    已返回的 DataFrame 不会被之后的 append / scale 变化修改。
+    """
+    COLUMNS = ('time', 'ep', 'ep_diff', 'time_diff', 'speed', 'hours_elapsed')
+
+    def __init__(self, df, capacity=1024):
+        self.n = 0
+        self._cols = {c: np.empty(max(capacity, len(df)), dtype=df[c].dtype) for c in self.COLUMNS}
+        self._norm = np.empty(len(self._cols['time']))
+        self._norm_scale = None
+        self.append(df, None)
+
+    def append(self, df, scale):
+        m = len(df)
+        need = self.n + m
+        if need > len(self._cols['time']):
+            size = max(need, 2 * len(self._cols['time']))
+            for c, arr in self._cols.items():
+                grown = np.empty(size, dtype=arr.dtype)
+                grown[:self.n] = arr[:self.n]
+                self._cols[c] = grown
+            norm = np.empty(size)
+            norm[:self.n] = self._norm[:self.n]
+            self._norm = norm
+        for c, arr in self._cols.items():
+            arr[self.n:need] = df[c].values
+        if scale and scale == self._norm_scale:
+            self._norm[self.n:need] = df['speed'].values / scale
+        else:
+            self._norm_scale = None
+        self.n = need
+
+    def frame(self, scale):
+        n = self.n
+        if not scale:
+            norm = np.full(n, np.nan)
+        elif scale != self._norm_scale:
+            # 写入新数组：已返回的 DataFrame 仍指向旧的 norm_speed
+            norm = np.empty(len(self._norm))
+            np.divide(self._cols['speed'][:n], scale, out=norm[:n])
+            self._norm, self._norm_scale = norm, scale
+            norm = norm[:n]
+        else:
+            norm = self._norm[:n]
+        columns = {c: arr[:n] for c, arr in self._cols.items()}
+        columns['norm_speed'] = norm
+        return pd.DataFrame(columns, copy=False)
+
+    def count_until(self, limit_ts):
+        """time <= limit_ts 的行数 (time 递增)"""
+        return int(np.searchsorted(self._cols['time'][:self.n], limit_ts, side='right'))
+
+
+def _frame_columns(df, columns):
+    """df 中存在的那些列 (用于计算阶段输入键)；df 为 None 时返回空表"""
+    if df is None:
+        return pd.DataFrame()
+    return df[[c for c in columns if c in df.columns]]
+
+
+# 历史活动处理用的进程池 (按 worker 数复用，常驻服务中不必每次重建)
+_HISTORY_POOL = None
+_HISTORY_POOL_WORKERS = 0
+
+
+def _history_fit_cutoff_ts(start_at, tz_offset):
+    """历史拟合丢弃第一天 18:00 之前的数据，返回截断时间戳。"""
+    start_dt = datetime.fromtimestamp(start_at / 1000, timezone.utc) + timedelta(hours=tz_offset)
+    cutoff_dt = start_dt.replace(hour=18, minute=0, second=0, microsecond=0)
+    return int(cutoff_dt.timestamp() * 1000)
+
+
+def _prepare_history_task(task):
+    """
+    单个历史活动的去节律化、18:00 截断与拟合。
+    可在进程池中执行：输入输出只包含 numpy 数组与标量，不传递 DataFrame。
+    返回 (season_factor, skeleton_speed, popt, 拟合行数)；已有缓存参数时跳过拟合。
+    popt 为 None 表示没有拟合结果：拟合行数不足 5 行，或拟合失败。
+    """
+    seasonality = task['seasonality']
+    time_ms = task['time']
+    hours = task['hours_elapsed']
+    season_factor, skeleton = seasonality.deseasonalize_arrays(time_ms, hours, task['norm_speed'])
+
+    # 若 cutoff 在 start 之前（即活动在当天 18:00 之后开始），则不会丢弃任何数据
+    mask = np.isfinite(skeleton)
+    if task['start_at'] is not None:
+        mask &= time_ms >= _history_fit_cutoff_ts(task['start_at'], seasonality.tz_offset)
+    n_fit = int(mask.sum())
+
+    popt = task['popt']
+    if popt is None and n_fit >= 5:
+        popt = CosineModeler().fit(hours[mask], skeleton[mask], task['total_hours'])
+    return season_factor, skeleton, popt, n_fit
+
+
+def _get_history_pool(workers):
+    global _HISTORY_POOL, _HISTORY_POOL_WORKERS
+    from concurrent.futures import ProcessPoolExecutor
+    if _HISTORY_POOL is None or _HISTORY_POOL_WORKERS != workers:
+        if _HISTORY_POOL is not None:
+            _HISTORY_POOL.shutdown(wait=False)
+        _HISTORY_POOL = ProcessPoolExecutor(max_workers=workers)
+        _HISTORY_POOL_WORKERS = workers
+    return _HISTORY_POOL
 
 # ==========================================
 # 3. 数据处理器 (DataHandler)
@@ -453,23 +692,40 @@ class DataHandler:
         # Output directory for saved plots (default: ./output)
         self.output_dir = output_dir if output_dir is not None else os.path.join('.', 'output')
 
-        # Use configured weekend multiplier and panic ease power when creating seasonality handler
-        self.seasonality = SeasonalityHandler(
-            tz_offset=detected_offset,
-            panic_ease_power=float(self.config.get('panic_ease_power', 1.0)),
-            weekend_multiplier=float(self.config.get('weekend_multiplier', 1.0)),
-            panic_scaler=float(self.config.get('panic_scaler', 1.1))
-        )
+        # 节律处理器按 tier 在首次使用时创建 (见 seasonality 属性)
+        self._tz_offset = detected_offset
+        self._seasonality_by_tier = {}
+        self._active_tier = 1000
         self.modeler = CosineModeler() # 👈 使用下凹正弦上升模型
         
         self.history_events = []
+        # tier -> 历史活动列表；self.history_events 指向当前 tier 的列表
+        self._history_by_tier = {}
+        # (event_id, tier) -> (去节律化后的 DataFrame, 拟合参数)
+        self._history_prepared = {}
+        # (event_id, tier) -> 拟合失败的时间；失败的结果不缓存，FIT_RETRY_SECONDS 后重新拟合
+        self._failed_fits = {}
+        # 与 tier 无关、可在多个 tier 之间共享的中间结果
+        self._candidates = None         # 候选活动计划 [(event_id, all.3.json 条目)]，见 _plan_candidates
+        self._candidate_info = {}       # event_id -> (meta, T10 scale) 或 None
+        self._shared_target_scale = None
+        self._target_speed = None       # 目标活动 T10 极速的增量估计 (TopSpeedTracker)
+        # 预先读取的目标活动 eventtop points (EventtopPoints)；设置后不再请求，按 debug_limit_ts 截取 (回测用)
+        self.target_eventtop = None
+        self.last_output = None
+        # tier -> 上次预测的 {'fingerprint', 'output', 'json_path'}，输入不变时直接沿用
+        self._last_runs = {}
+        # tier -> StageMemo，预测流水线各阶段上次的输入键与输出
+        self._stage_memos = {}
         self.target_data = None
         self.target_scale = 1.0
         self.debug_limit_ts = None
-        # use the shared HTTP session for all network I/O in this handler
-        self.session = HTTP_SESSION
-        # flag: we do not own the module-level session (so close() won't shut it down)
-        self._owns_session = False
+        # 未指定 debug_hours 时，进度在每次 load_target_data 中自动跟随最新数据
+        self._auto_progress = not debug_hours
+        # 增量刷新状态 (按 tier): start_ts / 最后一条原始数据点 / 已处理的完整帧
+        self._target_states = {}
+        # the process-wide HTTP session (http_client.get_session); never closed per handler
+        self.session = get_session()
         
         if debug_hours:
             self.debug_limit_ts = self.meta['start_at'] + (debug_hours * 3600 * 1000)
@@ -477,15 +733,14 @@ class DataHandler:
             logger.info(f"Debug mode: time frozen at +{debug_hours}h (limit_ts={self.debug_limit_ts})")
 
     def close(self):
-        """Close any owned session. Module-level session is not owned by instances."""
-        try:
-            if getattr(self, '_owns_session', False) and hasattr(self, 'session') and self.session is not None:
-                try:
-                    self.session.close()
-                except Exception:
-                    pass
-        except Exception:
-            pass
+        """
+        Release per-handler state (history frames, incremental target state).
+        The HTTP session is shared process-wide and closed by http_client at exit.
+        """
+        for attr in ('_history_by_tier', '_history_prepared', '_failed_fits', '_target_states', '_last_runs', '_stage_memos'):
+            state = getattr(self, attr, None)
+            if isinstance(state, dict):
+                state.clear()
 
     def __del__(self):
         try:
@@ -494,18 +749,19 @@ class DataHandler:
             pass
 
     def _get_target_current_scale(self):
-        url = f"{BASE_URL}eventtop/data?server={SERVER}&event={self.target_event_id}&mid=0&interval=3600000"
         try:
-            data = self.session.get(url, timeout=10).json()
-            if not data or "points" not in data: return None
-            df = pd.DataFrame(data["points"])
-            if self.debug_limit_ts: df = df[df["time"] <= self.debug_limit_ts].copy()
-            if df.empty: return None
-            df = df.sort_values(["uid", "time"])
-            df["speed"] = df.groupby("uid")["value"].diff() / (df.groupby("uid")["time"].diff() / 60000)
-            valid = df[(df["speed"] > 0) & (df["speed"] < 1000000)]["speed"]
-            if valid.empty: return None
-            return np.mean(valid.nlargest(3).values)
+            limit_ts = self.debug_limit_ts or None
+            tracker = self._target_speed
+            # 截止时间提前 (例如手动调小 debug_hours) 时，已处理的点可能超出范围，需要重建
+            if tracker is None or (limit_ts is not None and tracker.watermark is not None and limit_ts < tracker.watermark):
+                tracker = self._target_speed = TopSpeedTracker()
+            # 调试模式下只流式读取 debug_limit_ts 之前的点；常驻刷新时只有新到的点会被处理
+            points = self.target_eventtop
+            if points is None:
+                points = fetch_eventtop_buffer(self.target_event_id, until_ts=limit_ts)
+            added = tracker.update(points, until_ts=limit_ts)
+            logger.debug(f"Target T10 tracker: +{added} points, watermark={tracker.watermark}")
+            return tracker.scale()
         except: return None
 
     def _detect_timezone_offset(self, start_ts):
@@ -539,11 +795,75 @@ class DataHandler:
         except Exception:
             return 8
 
-    def load_target_data(self,tiers):
+    @metrics.stage('fetch')
+    def load_target_data(self, tiers=1000, incremental=False):
+        """
+        获取目标活动分数线并计算速度。
+
+        incremental=True 且此前已加载过同一 tier 时，只对上次之后的新数据点计算
+        speed / hours_elapsed 并追加到已有结果上（常驻刷新用）。
+        进行中的活动每次都发送条件请求；tracker 内容与上次相同 (304 或签名一致) 时
+        不再解析，也不重新获取 T10 scale，沿用上次的结果。
+        """
         print(f"获取目标活动 {self.target_event_id}  数据...")
-        df = fetch_tier_1000_data(self.target_event_id,tiers)
-        if df is None or df.empty: raise ValueError("T1000 数据为空")
-        
+        tracker_data = fetch_tracker_data(self.target_event_id, tiers, revalidate=not event_is_final(self.meta))
+        signature = tracker_signature(tracker_data)
+        if not signature or not signature[0]: raise ValueError("T1000 数据为空")
+
+        if self._auto_progress:
+            # 自动进度模式下，上一次检测到的进度不应限制本次刷新
+            self.debug_limit_ts = None
+            self.debug_hours = None
+
+        state = self._target_states.get(tiers)
+        unchanged = incremental and state is not None and state.get('signature') == signature
+        if unchanged:
+            logger.info(f"Target tracker unchanged for tier={tiers}: {signature}")
+            print(f"T{tiers} 数据未变化 (最后时间 {signature[1]})")
+            self.target_scale = state['scale']
+        else:
+            df = parse_tracker(tracker_data)
+            if df is None or df.empty: raise ValueError("T1000 数据为空")
+            if not incremental or state is None:
+                state = self._init_target_state(df, tiers)
+            else:
+                self._append_target_points(state, df)
+            state['signature'] = signature
+
+            # 批量预测时 T10 scale 与 tier 无关，只在第一个有新数据的 tier 计算一次
+            if self._shared_target_scale is _PENDING:
+                self._shared_target_scale = self._get_target_current_scale()
+            self.target_scale = self._shared_target_scale or self._get_target_current_scale()
+        if not self.target_scale: self.target_scale = 20000
+        print(f"目标 T10 极速 (Scale): {self.target_scale:.0f}")
+
+        state['scale'] = self.target_scale
+        full_df = state['frame'].frame(self.target_scale)
+        self.full_target_data = full_df
+
+        # calculate_speed_tracker 只向前差分，因此对完整结果按时间截断与先截断再计算等价
+        if self.debug_limit_ts:
+            df = full_df.iloc[:state['frame'].count_until(self.debug_limit_ts)]
+        else:
+            df = full_df
+        self.target_data = df
+
+        if self.debug_hours is None:
+            try:
+                if len(df) > 0:
+                    last_time = int(df['time'].max())
+                    last_hours = float(df['hours_elapsed'].max())
+                    self.debug_limit_ts = last_time
+                    self.debug_hours = float(last_hours)
+                    logger.info(f"Auto-detected progress: debug_hours={self.debug_hours:.2f}h debug_limit_ts={self.debug_limit_ts}")
+                    print(f"进度自动检测: 已观测 {self.debug_hours:.2f} 小时")
+            except Exception:
+                pass
+
+        return df
+
+    def _init_target_state(self, df, tiers):
+        """首次加载：修正开始时间并对完整序列计算速度。"""
         # 自动修正 start_ts 以跳过维护期
         # 1. 找到第一个 value > 0 的数据点（或者直接取第一个点，视数据源而定，通常 T1000 数据开始就是有分数的）
         # 2. 将 start_ts 修正为该数据点时间的前一个整点
@@ -586,179 +906,379 @@ class DataHandler:
         else:
             start_ts = original_start_ts
 
-        # 保留未受 debug_hours 限制的完整原始数据，用于绘图真实历史值
-        raw_full_df = df.copy()
-        
-        # If a debug limit timestamp was set in __init__, trim the fetched data to that point.
-        if self.debug_limit_ts:
-            df = df[df["time"] <= self.debug_limit_ts].copy()
-            
-        self.target_scale = self._get_target_current_scale()
-        if not self.target_scale: self.target_scale = 20000
-        print(f"目标 T10 极速 (Scale): {self.target_scale:.0f}")
+        last_row = df.iloc[-1]
+        frame = calculate_speed_tracker(df)
+        # 使用（可能修正过的）start_ts 计算 hours_elapsed；norm_speed 在得到 target_scale 后由 _TargetFrame 计算
+        frame["hours_elapsed"] = (frame["time"] - start_ts) / (1000 * 3600)
+
+        state = {
+            'tier': tiers,
+            'start_ts': start_ts,
+            'last_time': int(last_row['time']),
+            'last_ep': last_row['ep'],
+            'frame': _TargetFrame(frame),
+            'scale': None,
+        }
+        self._target_states[tiers] = state
+        return state
+
+    def _append_target_points(self, state, df):
+        """增量刷新：只处理 last_time 之后的新数据点。"""
+        new_points = df[df['time'] > state['last_time']]
+        if new_points.empty:
+            logger.info(f"Incremental refresh: no new points after {state['last_time']}")
+            return
+        new_points = new_points.sort_values('time')
+
+        # 以上一条原始数据点作为差分锚点（锚点自身 speed 为 NaN，会被 calculate_speed_tracker 丢弃）
+        anchor = pd.DataFrame({'time': [state['last_time']], 'ep': [state['last_ep']]})
+        chunk = calculate_speed_tracker(pd.concat([anchor, new_points[['time', 'ep']]], ignore_index=True))
+        chunk["hours_elapsed"] = (chunk["time"] - state['start_ts']) / (1000 * 3600)
+
+        state['frame'].append(chunk, state['scale'])
+        state['last_time'] = int(new_points['time'].iloc[-1])
+        state['last_ep'] = new_points['ep'].iloc[-1]
+        logger.info(f"Incremental refresh: appended {len(chunk)} rows (raw new points={len(new_points)})")
+
+    def _build_history_entry(self, curr, tiers, meta, scale, df_hist, store=None):
+        """由已获取的 meta / T10 scale / tracker 数据构造历史活动数据包；数据无效时返回 None。"""
+        if df_hist is None or df_hist.empty:
+            return None
 
-        df = calculate_speed_tracker(df)
-        df["norm_speed"] = df["speed"] / self.target_scale
-        
-        # 使用（可能修正过的）start_ts 计算 hours_elapsed
-        df["hours_elapsed"] = (df["time"] - start_ts) / (1000 * 3600)
-        
-        self.target_data = df
-        
-        if self.debug_hours is None:
+        # 4. 数据处理与归一化
+        df_hist = calculate_speed_tracker(df_hist)
+        df_hist['norm_speed'] = df_hist['speed'] / scale
+
+        # 5. 时间计算 (使用 meta 中的时间，确保准确性)
+        h_start = meta.get('start_at')
+        h_end = meta.get('aggregate_at') or meta.get('end_at')
+
+        if h_start is None or h_end is None:
+            return None
+
+        df_hist['hours_elapsed'] = (df_hist['time'] - h_start) / (1000 * 3600)
+        total_hours = (h_end - h_start) / 3600000
+
+        # 返回成功的数据包
+        result = {
+            'event_id': curr,
+            'scale': scale,
+            'data': df_hist,
+            'total_hours': total_hours,
+            'start_at': h_start,
+            'event_type': meta.get('event_type'),
+            'tier': tiers,
+            'early_intensity': 0
+        }
+
+        # 已结束的活动数据不会再变化，写入列式存储供下次直接读取
+        if store is not None and event_is_final(meta):
             try:
-                if len(df) > 0:
-                    last_time = int(df['time'].max())
-                    last_hours = float(df['hours_elapsed'].max())
-                    self.debug_limit_ts = last_time
-                    self.debug_hours = float(last_hours)
-                    logger.info(f"Auto-detected progress: debug_hours={self.debug_hours:.2f}h debug_limit_ts={self.debug_limit_ts}")
-                    print(f"进度自动检测: 已观测 {self.debug_hours:.2f} 小时")
-            except Exception:
-                pass
-        
-        try:
-            full_df = raw_full_df.copy()
-            full_df = calculate_speed_tracker(full_df)
-            full_df["norm_speed"] = full_df["speed"] / self.target_scale
-            full_df["hours_elapsed"] = (full_df["time"] - start_ts) / (1000 * 3600)
-            self.full_target_data = full_df
-        except Exception:
-            self.full_target_data = df.copy()
-            
-        return df
+                store.save(result, tiers, SERVER)
+            except Exception as e:
+                logger.warning(f"Failed to store history event {curr}: {e}")
+        return result
 
-    def _process_single_candidate(self, curr,tiers):
+    async def _process_single_candidate(self, client, curr, tiers, index_entry=None):
         """
-        处理单个活动 ID 的辅助函数，用于线程池调用。
+        处理单个活动 ID：T10 极速与 tracker 请求同时发出；
+        index_entry 为 all.3.json 中的条目，提供时直接作为元数据，否则同时请求 meta。
         如果符合条件并成功获取数据，返回处理好的数据字典；否则返回 None。
         """
         try:
-            # 1. 获取 Meta 并检查类型
-            meta = fetch_event_meta(curr)
-            if not meta or meta.get('event_type') != self.event_type:
-                return None
-
-            # 2. 获取 T10 极速 (Scale)
-            scale = fetch_top10_max_speed(curr)
-            if not scale or scale <= 0:
-                return None
-
-            # 3. 获取 T1000 历史数据
-            df_hist = fetch_tier_1000_data(curr,tiers)
-            if df_hist is None or df_hist.empty:
-                return None
-
-            # 4. 数据处理与归一化
-            df_hist = calculate_speed_tracker(df_hist)
-            df_hist['norm_speed'] = df_hist['speed'] / scale
-
-            # 5. 时间计算 (使用 meta 中的时间，确保准确性)
-            h_start = meta.get('start_at')
-            h_end = meta.get('aggregate_at') or meta.get('end_at')
+            # 0. 优先读取本地列式存储中已处理好的历史曲线
+            store = get_history_store()
+            if store is not None:
+                stored = store.load(curr, tiers, SERVER)
+                if stored is not None:
+                    if stored.get('event_type') != self.event_type:
+                        return None
+                    stored_end = stored['start_at'] + stored['total_hours'] * 3600000
+                    if not self._ended_before_target(stored_end):
+                        return None
+                    stored['tier'] = tiers
+                    return stored
 
-            if h_start is None or h_end is None:
+            # 1-3. Meta (检查类型)、T10 极速 (Scale) 与 T1000 历史数据
+            # (meta, scale) 与 tier 无关，多 tier 之间共享，已知时只请求 tracker
+            info = self._candidate_info.get(curr, _UNKNOWN)
+            if info is None:
                 return None
+            meta, scale, df_hist = await client.fetch_event_bundle(
+                curr, tiers, need_info=info is _UNKNOWN, metadata=index_entry
+            )
+            if info is _UNKNOWN:
+                info = None
+                if (meta and meta.get('event_type') == self.event_type and scale and scale > 0
+                        and self._ended_before_target(meta.get('end_at'))):
+                    info = (meta, scale)
+                self._candidate_info[curr] = info
+                if info is None:
+                    return None
+            meta, scale = info
 
-            df_hist['hours_elapsed'] = (df_hist['time'] - h_start) / (1000 * 3600)
-            total_hours = (h_end - h_start) / 3600000
-
-            # 返回成功的数据包
-            return {
-                'event_id': curr,
-                'scale': scale,
-                'data': df_hist,
-                'total_hours': total_hours,
-                'start_at': h_start,
-                'early_intensity': 0
-            }
+            return await asyncio.to_thread(self._build_history_entry, curr, tiers, meta, scale, df_hist, store)
 
         except Exception as e:
-            # 线程中的异常最好捕获打印，防止炸掉整个线程池
-            # print(f"Error processing event {curr}: {e}")
+            # 单个候选活动失败不影响其他候选
+            logger.debug(f"Error processing event {curr}: {e}")
             return None
 
-    def find_similar_events(self, count=None,tiers=1000):
-        print(f"寻找同类 [{self.event_type}] 活动...")
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        # 优化路径：试图使用 bestdori 提供的全量索引以快速定位同类型活动 做标记
-        # 减少逐一 fetch meta 的开销。若索引不可用或解析失败，回退到线性扫描。
-        candidates = []
+    def _ended_before_target(self, end_at):
+        """历史活动只能使用目标活动开始前已经结束的活动 (回测时保证不使用"未来"的数据)"""
+        return end_at is not None and end_at <= self.meta['start_at']
+
+    def _plan_candidates(self):
+        """
+        候选活动计划 [(event_id, 索引条目或 None)]，按优先级排序；与 tier 无关，计算一次后复用。
+        只使用 all.3.json 索引中的信息，不发出任何逐活动请求：
+          - 类型与目标活动相同
+          - 本服有开始/结束时间，且在目标活动开始前已经结束
+          - 时长与目标活动相近 (按天取整相差不超过 1 天) 的优先，其余靠后
+          - 同一档内按本服开始时间由新到旧
+        索引条目同时作为该活动的元数据，处理候选时不再请求 events/{id}.json。
+        """
+        if self._candidates is not None:
+            return self._candidates
+        target_start = self.meta['start_at']
+        target_days = round((self.meta['end_at'] - target_start) / 86400000)
+        ranked = []
         try:
-            idx_url = "https://bestdori.com/api/events/all.3.json"
-            r = self.session.get(idx_url, timeout=8)
-            if r.ok:
-                all_idx = r.json()
-                for eid_s, meta in all_idx.items():
+            all_idx = fetch_events_index()
+            if all_idx:
+                for eid_s, entry in all_idx.items():
                     try:
                         eid = int(eid_s)
                     except Exception:
                         continue
                     # only consider events that are strictly older than the target
-                    if eid >= self.target_event_id:
+                    if eid >= self.target_event_id or not isinstance(entry, dict):
+                        continue
+                    et = entry.get('eventType') or entry.get('event_type')
+                    if not (et and isinstance(et, str) and et.lower() == str(self.event_type).lower()):
                         continue
-                    # eventType field in index may be 'eventType'
-                    et = None
-                    if isinstance(meta, dict):
-                        et = meta.get('eventType') or meta.get('event_type')
-                    if et and isinstance(et, str) and et.lower() == str(self.event_type).lower():
-                        candidates.append(eid)
-                # newest first
-                candidates.sort(reverse=True)
+                    meta = parse_event_meta(eid, entry)
+                    if meta is None or not self._ended_before_target(meta['end_at']):
+                        # 本服尚未开放，或与目标活动时间重叠
+                        continue
+                    days = round((meta['end_at'] - meta['start_at']) / 86400000)
+                    off_bucket = 0 if abs(days - target_days) <= 1 else 1
+                    ranked.append(((off_bucket, -meta['start_at'], -eid), eid, entry))
         except Exception as e:
-            logger.debug(f"Failed to fetch fast index {idx_url}: {e}")
-            candidates = []
+            logger.debug(f"Failed to fetch fast index all.3.json: {e}")
+            ranked = []
+
+        if ranked:
+            ranked.sort(key=lambda r: r[0])
+            plan = [(eid, entry) for _, eid, entry in ranked]
+        else:
+            # 索引不可用：回退为目标活动之前的 50 个 ID，需要逐个请求 meta 判断类型
+            plan = [(eid, None) for eid in range(self.target_event_id - 1, self.target_event_id - 51, -1)]
+        logger.info(f"Candidate plan: {len(plan)} events (index={'yes' if ranked else 'no'})")
+
+        self._candidates = plan
+        return plan
+
+    @property
+    def seasonality(self):
+        """当前 tier 的节律处理器 (SeasonalityHandler)，首次使用时按 (server, tier, event_type) 加载节律表。"""
+        tier = self._active_tier
+        handler = self._seasonality_by_tier.get(tier)
+        if handler is None:
+            # Use configured weekend multiplier and panic ease power when creating seasonality handler
+            handler = SeasonalityHandler(
+                tz_offset=self._tz_offset,
+                panic_ease_power=float(self.config.get('panic_ease_power', 1.0)),
+                weekend_multiplier=float(self.config.get('weekend_multiplier', 1.0)),
+                panic_scaler=float(self.config.get('panic_scaler', 1.1)),
+                server=SERVER,
+                tier=tier,
+                event_type=self.event_type if SEASONALITY_CONFIG.get('per_event_type', True) else None,
+            )
+            self._seasonality_by_tier[tier] = handler
+        return handler
+
+    def _activate_tier(self, tiers):
+        """切换当前 tier：self.history_events 指向该 tier 的历史活动列表，节律表随之切换。"""
+        self._active_tier = tiers
+        if tiers not in self._history_by_tier:
+            # 第一个 tier 沿用已有列表，兼容直接给 history_events 赋值的调用方
+            self._history_by_tier[tiers] = self.history_events if not self._history_by_tier else []
+        self.history_events = self._history_by_tier[tiers]
+        return self.history_events
+
+    @metrics.stage('candidate_scan')
+    def find_similar_events(self, count=None,tiers=1000):
+        print(f"寻找同类 [{self.event_type}] 活动...")
+        self._activate_tier(tiers)
+        plan = self._plan_candidates()
 
         # determine desired similar count from config if not provided
         if count is None:
             count = int(self.config.get('similar_count', 5))
 
-        #print(f'{count}')
-        found = 0
-        # 建议 max_workers 设置为 4~8，太高容易被服务器拒绝服务
-        max_workers = 5 
-        
-        # 如果 candidates 列表为空（索引失败），则生成一个回退的 ID 列表
-        if not candidates:
-            # 比如从 target_event_id - 1 往前推 50 个
-            candidates = list(range(self.target_event_id - 1, self.target_event_id - 51, -1))
+        try:
+            results = run_sync(self._scan_candidates(plan, count, tiers))
+        except KeyboardInterrupt:
+            print("手动停止了扫描")
+            raise
+        for result in results:
+            self.history_events.append(result)
+            print(f"匹配成功: Event {result['event_id']} | Scale: {result['scale']:.0f}")
+
+    async def _scan_candidates(self, plan, count, tiers):
+        """
+        按计划顺序取前 count 个有效活动。
+        同时只处理前 count + candidate_spares 个候选；某个候选无效时才从计划中补上下一个，
+        已够数时取消多余的备用候选。结果与请求完成顺序无关。
+        """
+        client = AsyncBestdoriClient()
+        window = int(count) + max(0, int(ASYNC_CLIENT_CONFIG.get('candidate_spares', 2)))
+        remaining = iter(plan)
+        pending = deque()
+        found = []
+
+        def refill():
+            # 已找到的与处理中的候选合计保持 window 个：只有无效的候选才会腾出位置
+            while len(found) + len(pending) < window:
+                item = next(remaining, None)
+                if item is None:
+                    break
+                eid, entry = item
+                pending.append((eid, asyncio.ensure_future(self._process_single_candidate(client, eid, tiers, entry))))
 
-        # print(f"开始并发扫描，待选列表长度: {len(candidates)}，目标数量: {count} 喵...")
+        refill()
+        try:
+            while pending and len(found) < count:
+                eid, task = pending.popleft()
+                try:
+                    result = await task
+                except Exception as exc:
+                    print(f"Event {eid} generated an exception: {exc}")
+                    result = None
+                if result:
+                    found.append(result)
+                else:
+                    refill()
+        finally:
+            for _, task in pending:
+                task.cancel()
+            await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+        logger.debug(f"Candidate scan stats: {client.stats}")
+        return found
+
+    def _prepare_history_event(self, h):
+        """单个历史活动的 (去节律化后的 DataFrame, 拟合参数)。"""
+        self._prepare_history_events([h])
+        return self._history_prepared[(h['event_id'], h.get('tier'))]
+
+    @metrics.stage('history_fits')
+    def _prepare_history_events(self, events):
+        """
+        历史活动的去节律化结果与拟合参数只取决于历史数据本身和节律表，
+        在同一个 DataHandler 内只计算一次（常驻刷新时不会重复拟合）。
+        尚未处理的活动按配置 fit_workers 分发到进程池；结果按输入顺序合并，与 worker 数无关。
+        """
+        now = time.time()
+        pending = [
+            h for h in events
+            if (h['event_id'], h.get('tier')) not in self._history_prepared
+            or now - self._failed_fits.get((h['event_id'], h.get('tier')), now) >= FIT_RETRY_SECONDS
+        ]
+        if not pending:
+            return
+
+        tasks = []
+        fit_keys = []
+        for h in pending:
+            df = h['data']
+            fit_key = self._fit_cache_key(h)
+            fit_keys.append(fit_key)
+            tasks.append({
+                'seasonality': self.seasonality,
+                'time': df['time'].values,
+                'hours_elapsed': df['hours_elapsed'].values,
+                'norm_speed': df['norm_speed'].values,
+                'start_at': h.get('start_at'),
+                'total_hours': h['total_hours'],
+                'popt': self._lookup_fit(fit_key),
+            })
+
+        workers = int(self.config.get('fit_workers', 1) or 1)
+        need_fit = sum(1 for t in tasks if t['popt'] is None)
+        if workers > 1 and need_fit > 1:
+            try:
+                results = list(_get_history_pool(workers).map(_prepare_history_task, tasks))
+            except Exception as e:
+                logger.warning(f"History process pool failed, falling back to serial: {e}")
+                results = [_prepare_history_task(t) for t in tasks]
+        else:
+            results = [_prepare_history_task(t) for t in tasks]
+
+        for h, task, fit_key, (season_factor, skeleton, popt, n_fit) in zip(pending, tasks, fit_keys, results):
+            event_key = (h['event_id'], h.get('tier'))
+            self._failed_fits.pop(event_key, None)
+            if popt is None and n_fit < 5:
+                logger.info(f"Hist {h['event_id']} too few rows after cutoff ({n_fit}), skipping fit")
+            elif popt is None:
+                # 拟合失败：本次使用默认参数，但不写入缓存，FIT_RETRY_SECONDS 后重新拟合
+                popt = np.array(CosineModeler.DEFAULT_P0, dtype=float)
+                self._failed_fits[event_key] = now
+                logger.warning(f"Hist {h['event_id']} fit failed (rows={n_fit}), using default params without caching")
+            else:
+                popt = np.asarray(popt, dtype=float)
+                if task['popt'] is None:
+                    self._store_fit(fit_key, popt)
+                logger.debug(f"Hist {h['event_id']} fit rows={n_fit} used (cutoff applied)")
+            df_clean = h['data'].copy()
+            df_clean['season_factor'] = season_factor
+            df_clean['skeleton_speed'] = skeleton
+            self._history_prepared[(h['event_id'], h.get('tier'))] = (df_clean, popt)
+
+    def _fit_cache_key(self, h):
+        """
+        历史活动 curve_fit 结果的缓存键：(event_id, tier, 历史数据指纹, 节律表版本, 周末增强系数, 模型版本)。
+        拟合序列由历史数据与节律表唯一决定，因此对输入数据做指纹即可。
+        """
+        df = h['data']
+        digest = hashlib.sha1()
+        for col in ('time', 'hours_elapsed', 'norm_speed'):
+            digest.update(np.ascontiguousarray(df[col].values, dtype=float).tobytes())
+        digest.update(repr((h.get('start_at'), float(h['total_hours']))).encode('utf-8'))
+        return (
+            f"fit/v{CosineModeler.VERSION}/{h['event_id']}/{h.get('tier')}/{self.seasonality.version}"
+            f"/wm={float(self.config.get('weekend_multiplier', 1.0))}/{digest.hexdigest()}"
+        )
 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            # future_to_eid 是一个字典，用于追踪哪个 future 对应哪个 event_id
-            future_to_eid = {
-                executor.submit(self._process_single_candidate, eid,tiers): eid
-                for eid in candidates
-            }
+    def _lookup_fit(self, key):
+        """从进程内 / 磁盘缓存读取拟合参数，未命中返回 None。"""
+        popt = _FIT_MEMO.get(key)
+        if popt is not None:
+            _FIT_MEMO.move_to_end(key)
+            metrics.cache_lookup('fit', 'hit')
+            return popt.copy()
+        cache = get_cache()
+        if cache is not None:
+            stored = cache.get(key)
+            if stored is not None:
+                popt = np.array(stored, dtype=float)
+                _memo_fit(key, popt)
+                metrics.cache_lookup('fit', 'hit')
+                return popt.copy()
+        metrics.cache_lookup('fit', 'miss')
+        return None
 
+    def _store_fit(self, key, popt):
+        _memo_fit(key, popt.copy())
+        cache = get_cache()
+        if cache is not None:
             try:
-                # as_completed 会在某个线程完成时立即 yield
-                for future in as_completed(future_to_eid):
-                    eid = future_to_eid[future]
-                    try:
-                        result = future.result()
-                        if result:
-                            self.history_events.append(result)
-                            found += 1
-                            print(f"匹配成功: Event {result['event_id']} | Scale: {result['scale']:.0f}")
-
-                            # 如果已经找到了足够的数量，就不需要再等待剩下的了
-                            if found >= count:
-                                # print("已收集足够数据，停止扫描")
-                                # 取消剩余未执行的任务（正在执行的无法强制中断，但不会处理结果了）
-                                for f in future_to_eid:
-                                    f.cancel()
-                                break
-                    except Exception as exc:
-                        print(f"Event {eid} generated an exception: {exc}")
-            except KeyboardInterrupt:
-                print("手动停止了扫描")
-                executor.shutdown(wait=False)
-                raise
-
-    def run_prediction(self, return_type=None,tiers=1000):
+                cache.put(key, popt.tolist())
+            except Exception as e:
+                logger.warning(f"Failed to persist fit {key}: {e}")
+
+    @metrics.stage('predict')
+    def run_prediction(self, return_type=None,tiers=1000, json_path=None):
         """
         Run the prediction pipeline.
 
@@ -767,458 +1287,76 @@ class DataHandler:
                        'path' -> save plot to file and return the output_path string.
                        'fig'  -> return the matplotlib Figure object (no file save).
                        'bytes'-> return PNG image bytes (no file save).
+        - json_path: where to write the predicted cutoffs JSON (default: ./ycx{tiers}-3.json).
+                     The file is replaced atomically; the dict is also kept in self.last_output.
 
         Returns:
         - Depending on return_type, may return None, output_path (str), matplotlib.figure.Figure, or bytes.
-        """
-        print("\n开始预测计算 (模式: 严格时间对齐 Time-Aligned)...")
-        
-        # 1. 确定对比窗口 (Comparison Window)
-        # 起点：配置中指定 (默认6小时，用于跳过开局暴冲)
-        # 终点：使用已观测的最新进度（若 caller 未传入 debug_hours 则已在 load_target_data 自动检测），
-        # 上限由配置项 t_end_cap 控制（默认72小时）
-        t_start_cmp = float(self.config.get('t_start_cmp', 6.0))
-        # If debug_hours is not set, use the latest observed hours from target_data
-        try:
-            observed_hours = float(self.target_data['hours_elapsed'].max()) if hasattr(self, 'target_data') and len(self.target_data) > 0 else 0.0
-        except Exception:
-            observed_hours = 0.0
-        end_source = self.debug_hours if (self.debug_hours is not None) else observed_hours
-        t_end_cmp = min(end_source, float(self.config.get('t_end_cap', 72.0)))
-
-        print(f"锁定对比区间: [ {t_start_cmp}h ~ {t_end_cmp}h ] (end_source={end_source})")
-        
-        # 内部函数：计算指定区间的稳健均值
-        def get_window_intensity(df_in):
-            # 严格卡死时间段
-            mask = (df_in['hours_elapsed'] >= t_start_cmp) & \
-                   (df_in['hours_elapsed'] <= t_end_cmp) & \
-                   (np.isfinite(df_in['skeleton_speed']))
-            
-            data_slice = df_in.loc[mask, 'skeleton_speed']
-            
-            if len(data_slice) == 0: return None # 如果该区间没数据（比如历史活动数据缺失），返回 None
-            
-            # 简单的 Sigma Clipping 去除极端异常值
-            mean_val = data_slice.mean()
-            std_val = data_slice.std()
-            if std_val > 0.001:
-                clean_slice = data_slice[np.abs(data_slice - mean_val) < 2.0 * std_val]
-                if len(clean_slice) > 0:
-                    return clean_slice.mean()
-            return mean_val
 
-        # 2. 计算【当前活动】在该区间的强度
-        target_df = self.seasonality.remove_seasonality(self.target_data)
-        logger.debug(f"target_df rows={len(target_df)}; sample hours_elapsed head: {target_df['hours_elapsed'].head(5).tolist()}")
-        if 'season_factor' in target_df.columns:
-            logger.debug(f"season_factor sample (head): {target_df['season_factor'].head(5).tolist()}")
-        curr_intensity = get_window_intensity(target_df)
-        
-        if curr_intensity is None:
-            print("当前活动在对比区间内无有效数据，无法计算 Ratio，默认 1.0")
-            curr_intensity = 0.1 # 避免除零
-            
-        print(f"当前活动区间强度: {curr_intensity:.4f}")
-
-        # 3. 计算【历史活动】在【同一区间】的强度 & 拟合参数
-        hist_params = []
-        hist_intensities = []
-        
-        for h in self.history_events:
-            df = h['data']
-            df_clean = self.seasonality.remove_seasonality(df)
-            
-            # A. 拟合全量参数 (用于获取形状 Slope, Panic 等)
-            #    丢弃第一天 18:00 之前的数据用于拟合（若存在）
-            popt = None
-            try:
-                h_start_ts = h.get('start_at')
-                df_for_fit = df_clean.copy()
-                if h_start_ts is not None:
-                    start_dt = datetime.fromtimestamp(h_start_ts / 1000, timezone.utc) + timedelta(hours=self.seasonality.tz_offset)
-                    cutoff_dt = start_dt.replace(hour=18, minute=0, second=0, microsecond=0)
-                    cutoff_ts = int(cutoff_dt.timestamp() * 1000)
-                    # 若 cutoff 在 start 之前（即活动在当天 18:00 之后开始），则不会丢弃任何数据
-                    df_for_fit = df_clean.loc[df_clean['time'] >= cutoff_ts].copy()
-
-                valid_mask = np.isfinite(df_for_fit['skeleton_speed'])
-                if valid_mask.sum() >= 5:
-                    popt = self.modeler.fit(
-                        df_for_fit.loc[valid_mask, 'hours_elapsed'].values,
-                        df_for_fit.loc[valid_mask, 'skeleton_speed'].values,
-                        h['total_hours']
-                    )
-                    logger.debug(f"Hist {h['event_id']} fit rows={valid_mask.sum()} used (cutoff applied)")
-                else:
-                    logger.info(f"Hist {h['event_id']} too few rows after cutoff ({valid_mask.sum()}), skipping fit")
-            except Exception as e:
-                logger.warning(f"Hist {h['event_id']} fit failed: {e}")
-            
-            # B. 计算同一时间窗口的强度
-            h_int = get_window_intensity(df_clean)
-            
-            if h_int is not None and popt is not None:
-                hist_intensities.append(h_int)
-                hist_params.append(popt)
-                # popt: [Base, A, B, B_end, T_panic]
-                logger.info(f"  - Hist {h['event_id']}: 区间强度={h_int:.6f} | A={popt[1]:.8e} B={popt[2]:.8e} | params={popt}")
-            else:
-                logger.info(f"  - Hist {h['event_id']}: 在该时间段无数据，跳过对比")
+        With return_type=None, if the inputs (target data, T10 scale, progress, history events,
+        config) are identical to the previous run for this tier, the previous output is reused.
+        """
+        # 节律表跟随本次预测的 tier
+        self._active_tier = tiers
+        fingerprint = self._prediction_fingerprint(tiers)
+        if json_path is None:
+            json_path = f"ycx{tiers}-3.json"
+        previous = self._last_runs.get(tiers)
+        if return_type is None and previous is not None and previous['fingerprint'] == fingerprint:
+            self.last_output = previous['output']
+            if previous['json_path'] != json_path or not os.path.exists(json_path):
+                try:
+                    write_json_atomic(json_path, self.last_output)
+                    previous['json_path'] = json_path
+                except Exception as e:
+                    print(f"写入 JSON 失败: {e}")
+                    logger.warning(f"Failed to write JSON output: {e}")
+            print(f"输入未变化，沿用上次的预测结果: {json_path}")
+            logger.info(f"Prediction inputs unchanged for tier={tiers}; reused previous output")
+            return None
 
-        # 诊断：比较 norm_speed ratio vs skeleton ratio
-        mask_cmp = (target_df['hours_elapsed'] >= t_start_cmp) & (target_df['hours_elapsed'] <= t_end_cmp)
-        obs_norm_mean = target_df.loc[mask_cmp, 'norm_speed'].mean()
-        logger.info(f"DIAG obs_norm_mean={obs_norm_mean:.6f}, obs_skel_mean={curr_intensity:.6f}")
+        print("\n开始预测计算 (模式: 严格时间对齐 Time-Aligned)...")
+        self.last_output = None
         
-        # 汇总历史 norm_speed 同窗均值
-        hist_norms = []
-        for h in self.history_events:
-            dfh = self.seasonality.remove_seasonality(h['data'])
-            maskh = (dfh['hours_elapsed'] >= t_start_cmp) & (dfh['hours_elapsed'] <= t_end_cmp)
-            if maskh.any():
-                hist_norms.append(dfh.loc[maskh, 'norm_speed'].mean())
-        logger.info(f"DIAG hist_norms={hist_norms}")
-        if hist_norms:
-            logger.info(f"DIAG norm_ratio = {obs_norm_mean / np.mean(hist_norms):.6f}")
-
-        # 4. 计算 Ratio — 使用双重度量并保守处理异常值
-        #  - skeleton_ratio: 基于去节律化后的 skeleton_speed（更接近模型形状）
-        #  - norm_ratio: 基于原始 norm_speed 的观测比（更贴近真实观测）
-        if hist_intensities:
-            avg_hist_intensity = np.mean(hist_intensities)
-            skeleton_ratio = curr_intensity / avg_hist_intensity if avg_hist_intensity > 0 else np.nan
-
-            # 计算历史 norm_speed 的均值（若可得），用于 norm_ratio
-            norm_ratio = None
-            mean_hist_norm = None
-            if hist_norms:
-                mean_hist_norm = np.mean(hist_norms)
-                if mean_hist_norm and mean_hist_norm > 0:
-                    norm_ratio = obs_norm_mean / mean_hist_norm
-
-            # 选择性地混合两种 ratio：当两者都可用时按时间权重混合（从 skeleton 主导 -> 到 normal 主导）
-            skeleton_val = float(skeleton_ratio) if np.isfinite(skeleton_ratio) else None
-            norm_val = float(norm_ratio) if (norm_ratio is not None and np.isfinite(norm_ratio)) else None
-
-            # compute observed progress s (use configured target window length if available)
-            target_total_hours = float(self.config.get('t_end_cap', 72.0))
-            observed_hours = float(target_df['hours_elapsed'].max()) if 'hours_elapsed' in target_df.columns else 0.0
-            s = 0.0
-            if target_total_hours and target_total_hours > 0:
-                s = np.clip(observed_hours / float(target_total_hours), 0.0, 1.0)
-            if (s is None): s = 0.0
-
-            if skeleton_val is not None and norm_val is not None:
-                w_norm = 0.2 + 0.6 * np.cos(s * np.pi - np.pi)
-                w_norm = float(np.clip(w_norm, 0.0, 1.0))
-                chosen_ratio = skeleton_val * (1.0 - w_norm) + norm_val * w_norm
-                logger.info(f"Blend ratios using time-weight: s={s:.3f} w_norm={w_norm:.3f} skeleton={skeleton_val:.6f} norm={norm_val:.6f} -> chosen={chosen_ratio:.6f}")
-            else:
-                # fallback to whichever is available, else 1.0
-                if skeleton_val is not None:
-                    chosen_ratio = skeleton_val
-                elif norm_val is not None:
-                    chosen_ratio = norm_val
-                else:
-                    chosen_ratio = 1.0
-
-            # Clip ratio 以防极端放大/缩小（阈值来自配置）
-            R_MIN = float(self.config.get('ratio_min', 0.25))
-            R_MAX = float(self.config.get('ratio_max', 4.0))
-            clipped_ratio = float(np.clip(chosen_ratio, R_MIN, R_MAX))
-
-            # 记录诊断信息
-            logger.info(
-                "Ratio diagnostics: skeleton_ratio=%s norm_ratio=%s chosen=%s clipped=%s avg_hist_int=%s",
-                (f"{skeleton_ratio:.6f}" if np.isfinite(skeleton_ratio) else "nan"),
-                (f"{norm_ratio:.6f}" if norm_ratio is not None else "n/a"),
-                f"{chosen_ratio:.6f}", f"{clipped_ratio:.6f}", f"{avg_hist_intensity:.6f}"
-            )
-            if clipped_ratio != chosen_ratio:
-                logger.warning(f"Ratio clipped from {chosen_ratio:.6f} to {clipped_ratio:.6f} (bounds {R_MIN}-{R_MAX})")
-
-            ratio = clipped_ratio
-            print(f"强度修正比率 (skeleton/norm/chosen/clipped): {skeleton_ratio:.6f} / {(norm_ratio if norm_ratio is not None else float('nan')):.6f} -> {chosen_ratio:.6f} -> {ratio:.6f}")
-        else:
-            print("没有有效的历史对比数据，Ratio 重置为 1.0")
-            ratio = 1.0
-            avg_hist_intensity = 1.0 # dummy
+        memo, target_key, target, history, ratio = self._upstream_stages(tiers)
+        cfg = self.config
+        seasonality = self.seasonality
+        start_at = self.meta['start_at']
 
         # 5.  参数修正与预测
-        if hist_params:
-            avg_params = np.mean(hist_params, axis=0)
-        else:
-            # Default: [Base, A, B, B_end, T_panic]
-            avg_params = np.array([0.05, 0.001, 0.0, 0.5, 24.0])
-
-        pred_params = avg_params.copy()
-
-        # Apply Ratio to parameters: scale Base, linear A and quadratic B moderately,
-        # and magnify B_end slightly as before. T_panic remains unchanged.
-        # Param order: [Base, A, B, B_end, T_panic]
-        pred_params[0] *= ratio        # Base
-        pred_params[1] *= ratio        # A (linear)
-        pred_params[2] *= ratio        # B (quadratic)
-        pred_params[3] *= (ratio ** 1.1)  # B_end
-
-        target_total_hours = (self.meta['end_at'] - self.meta['start_at']) / 3600000
-        
-        try:
-            # 标准化终端输出格式：更高精度且统一展示所有参数
-            print(
-                f"预测参数: Base={pred_params[0]:.6f}, "
-                f"A={pred_params[1]:.8e}, B={pred_params[2]:.8e}, "
-                f"B_end={pred_params[3]:.6f}, T_panic={int(pred_params[4])}"
-            )
-            logger.info(
-                f"Final pred_params: Base={pred_params[0]:.6f}, A={pred_params[1]:.8e}, "
-                f"B={pred_params[2]:.8e}, B_end={pred_params[3]:.6f}, T_panic={int(pred_params[4])}"
-            )
-            logger.debug(f"avg_params: {avg_params}; hist_intensities: {hist_intensities}")
-            logger.debug(f"target_scale={self.target_scale}, target_total_hours={target_total_hours}, debug_hours={self.debug_hours}")
-        except:
-            pass
-
-        # 生成曲线 (后续绘图逻辑不变)
-        future_t = np.linspace(0, target_total_hours, 1000) 
-        skeleton_pred = self.modeler.shape_function(future_t, *pred_params, target_total_hours)
-        speed_pred, _ = self.seasonality.apply_seasonality(
-            future_t, skeleton_pred, self.meta['start_at'],
-            total_hours=target_total_hours, t_panic=pred_params[4]
-        )
-
-        # 积分逻辑前置：准备观测当前分数和时间（用于后续 scaling 诊断）
-        if 'ep' in self.target_data.columns:
-            score_series = self.target_data['ep']
-        elif 'value' in self.target_data.columns:
-            score_series = self.target_data['value']
-        else:
-            score_series = pd.Series(np.zeros(len(self.target_data)), index=self.target_data.index)
-
-        current_max_score = score_series.max()
-        current_max_time = self.target_data['hours_elapsed'].max()
-
-        # ---- Final output scaling: align model's cutoff->now mass to observed cutoff->now mass
-        # This computes model cumulative since first-day 18:00 and compares to observed
-        # cumulative in the same interval, then scales future increments accordingly.
-        # (If insufficient data or zero model mass, scale factor defaults to 1.0.)
-        try:
-            # prepare arrays
-            real_speed_ep_min_all = speed_pred * self.target_scale
-            if len(future_t) > 1:
-                dt_hours_all = float(future_t[1] - future_t[0])
-            else:
-                dt_hours_all = 0.0
-            dt_min_all = dt_hours_all * 60.0
-            cum_all = np.cumsum(real_speed_ep_min_all * dt_min_all)
-
-            # cutoff hours (first day 18:00)
-            start_ts = self.meta['start_at']
-            start_dt = datetime.fromtimestamp(start_ts / 1000, tz=timezone(timedelta(hours=self.seasonality.tz_offset)))
-            cutoff_dt = start_dt.replace(hour=18, minute=0, second=0, microsecond=0)
-            cutoff_ts = int(cutoff_dt.timestamp() * 1000)
-            cutoff_hours = (cutoff_ts - start_ts) / (1000.0 * 3600.0)
-            if cutoff_hours < 0.0:
-                cutoff_hours = 0.0
-
-            # map to indices
-            idx_cutoff = int(np.searchsorted(future_t, cutoff_hours, side='left'))
-            idx_now = int(np.searchsorted(future_t, current_max_time, side='right') - 1)
-            idx_cutoff = max(0, min(idx_cutoff, len(cum_all) - 1))
-            idx_now = max(0, min(idx_now, len(cum_all) - 1))
-
-            model_since_cutoff = float(cum_all[idx_now] - (cum_all[idx_cutoff-1] if idx_cutoff > 0 else 0.0))
-
-            # observed cumulative before cutoff
-            # Use hours_elapsed to avoid timezone/timestamp misalignment; if no exact
-            # pre-cutoff row exists, fall back to the nearest earlier point (interpolation).
-            hist_df = getattr(self, 'full_target_data', self.target_data)
-            hist_col = 'ep' if 'ep' in hist_df.columns else ('value' if 'value' in hist_df.columns else None)
-            observed_before_cutoff = 0.0
-            if hist_col is not None and 'hours_elapsed' in hist_df.columns:
-                hrs = hist_df['hours_elapsed'].values
-                scores = hist_df[hist_col].values
-                # prefer rows strictly before cutoff_hours
-                before_mask = hrs < cutoff_hours
-                if np.any(before_mask):
-                    # take latest available score before cutoff
-                    observed_before_cutoff = float(scores[np.where(before_mask)[0][-1]])
-                else:
-                    # no earlier row; attempt to use the earliest available score (usually 0)
-                    observed_before_cutoff = float(scores[0]) if len(scores) > 0 else 0.0
-                logger.debug(f"Observed before cutoff via hours_elapsed: cutoff_hours={cutoff_hours:.3f} observed_before_cutoff={observed_before_cutoff}")
-            else:
-                # fallback to timestamp-based method if hours_elapsed missing
-                if hist_col is not None and 'time' in hist_df.columns:
-                    before_mask = hist_df['time'] < cutoff_ts
-                    if before_mask.any():
-                        observed_before_cutoff = float(hist_df.loc[before_mask, hist_col].iloc[-1])
-
-            observed_since_cutoff = float(current_max_score) - observed_before_cutoff
-
-            if model_since_cutoff > 0 and observed_since_cutoff >= 0:
-                raw_scale = observed_since_cutoff / model_since_cutoff
-            else:
-                raw_scale = 1.0
-
-            SCALE_MIN = float(self.config.get('scale_min', 0.5))
-            SCALE_MAX = float(self.config.get('scale_max', 2.0))
-            scale_factor = float(np.clip(raw_scale, SCALE_MIN, SCALE_MAX))
-            if scale_factor != raw_scale:
-                logger.warning(f"Output scaling clipped {raw_scale:.6f} -> {scale_factor:.6f}")
-            logger.info(f"Output scaling diagnostics: observed_since_cutoff={observed_since_cutoff:.1f} model_since_cutoff={model_since_cutoff:.1f} raw={raw_scale:.6f} applied={scale_factor:.6f}")
-
-            # --- 回测修正 (t vs t-24) ---
-            # 如果当前观测时间超过 50 小时，则用 t-24 的窗口回测：
-            # 1) 将模型在 [t-24, t] 的预测累计量与真实累计量比较
-            # 2) 得到一个额外的修正因子 applied_correction，并乘到最终 scale_factor 上
-            try:
-                applied_scale_factor = scale_factor
-                now_hours = float(current_max_time)
-                if now_hours > 50.0:
-                    t0 = max(0.0, now_hours - 24.0)
-                    # 在 future_t 上定位索引
-                    idx_t0 = int(np.searchsorted(future_t, t0, side='left'))
-                    idx_now = int(np.searchsorted(future_t, now_hours, side='right') - 1)
-                    idx_t0 = max(0, min(idx_t0, len(future_t) - 1))
-                    idx_now = max(0, min(idx_now, len(future_t) - 1))
-
-                    # 计算模型在 [t0, now] 的预测累计（使用当前 scale_factor）
-                    if idx_now > idx_t0:
-                        dt_hours_all = float(future_t[1] - future_t[0]) if len(future_t) > 1 else 0.0
-                        dt_min_all = dt_hours_all * 60.0
-                        pred_segment = speed_pred[idx_t0:idx_now]
-                        model_24 = float(np.sum(pred_segment) * self.target_scale * scale_factor * dt_min_all)
-
-                        # 取真实历史累计：找到 t0 之前最近的历史得分点
-                        hist_df = getattr(self, 'full_target_data', self.target_data)
-                        hist_col = 'ep' if 'ep' in hist_df.columns else ('value' if 'value' in hist_df.columns else None)
-                        observed_before_t0 = None
-                        if hist_col is not None:
-                            hrs = hist_df['hours_elapsed'].values
-                            scores = hist_df[hist_col].values
-                            pos = int(np.searchsorted(hrs, t0, side='left'))
-                            if pos > 0:
-                                observed_before_t0 = float(scores[pos-1])
-                            else:
-                                observed_before_t0 = float(scores[0]) if len(scores) > 0 else 0.0
-
-                        if observed_before_t0 is not None:
-                            observed_24 = float(current_max_score) - observed_before_t0
-                        else:
-                            observed_24 = None
-
-                        if (model_24 > 0) and (observed_24 is not None) and (observed_24 >= 0):
-                            raw_corr = observed_24 / model_24 if model_24 > 0 else 1.0
-                            CORR_MIN = float(self.config.get('corr_min', 0.6))
-                            CORR_MAX = float(self.config.get('corr_max', 1.6))
-                            corr = float(np.clip(raw_corr, CORR_MIN, CORR_MAX))
-                            if corr != raw_corr:
-                                logger.warning(f"24h correction clipped {raw_corr:.6f} -> {corr:.6f}")
-                            applied_scale_factor = float(scale_factor * corr)
-                            logger.info(f"24h backtest diagnostics: observed_24={observed_24:.1f} model_24={model_24:.1f} raw_corr={raw_corr:.6f} applied_corr={corr:.6f} final_scale={applied_scale_factor:.6f}")
-                        else:
-                            logger.info("24h backtest skipped due to insufficient data or zero model mass")
-
-                else:
-                    applied_scale_factor = scale_factor
-            except Exception as e:
-                logger.warning(f"24h backtest failed: {e}")
-                applied_scale_factor = scale_factor
-        except Exception as e:
-            logger.warning(f"Failed to compute output scaling: {e}")
-            scale_factor = 1.0
-            applied_scale_factor = 1.0
-        
-        # 积分逻辑（使用前面已准备好的 score_series/current_max_* 变量）
-        future_mask = future_t >= current_max_time
-        future_t_clip = future_t[future_mask]
-        speed_pred_clip = speed_pred[future_mask]
-        
-        if len(future_t_clip) > 0:
-            # Apply both the primary scale_factor and the optional 24h backtest correction
-            final_scale = locals().get('applied_scale_factor', scale_factor)
-
-            # --- Top-speed smoothing: when normalized speed (after scale) > 0.5,
-            # apply a smooth attenuation so growth flattens approaching the top line.
-            # This operates in normalized units (relative to target_scale) AFTER final_scale.
-            try:
-                norm_after_scale = speed_pred_clip * float(final_scale)
-                # Two-stage attenuation with configured thresholds
-                THRESH1 = float(self.config.get('smooth_thresh1', 0.5))
-                THRESH2 = float(self.config.get('smooth_thresh2', 0.65))
-                HARD_CAP = float(self.config.get('smooth_hard_cap', 0.8))
-                ALPHA = 3.0   # mild stage coefficient
-                BETA = 22.0   # strong stage coefficient (large -> heavy compression)
-
-                norm_adj = norm_after_scale.copy()
-
-                # Stage 1: mild attenuation between THRESH1 and THRESH2
-                mask_stage1 = (norm_after_scale > THRESH1) & (norm_after_scale <= THRESH2)
-                if np.any(mask_stage1):
-                    excess1 = (norm_after_scale[mask_stage1] - THRESH1) / (THRESH2 - THRESH1)
-                    attenuation1 = 1.0 / (1.0 + ALPHA * excess1)
-                    norm_adj[mask_stage1] = THRESH1 + (norm_after_scale[mask_stage1] - THRESH1) * attenuation1
-
-                # Stage 2: strong attenuation above THRESH2 (quadratic penalization)
-                mask_stage2 = norm_after_scale > THRESH2
-                if np.any(mask_stage2):
-                    excess2 = (norm_after_scale[mask_stage2] - THRESH2) / (1.0 - THRESH2)
-                    attenuation2 = 1.0 / (1.0 + BETA * (excess2 ** 2))
-                    norm_adj[mask_stage2] = THRESH2 + (norm_after_scale[mask_stage2] - THRESH2) * attenuation2
-
-                # Enforce hard cap
-                norm_adj = np.minimum(norm_adj, HARD_CAP)
-
-                if np.any(norm_adj != norm_after_scale):
-                    logger.info(f"Top-smoothing applied (stage1>{THRESH1}, stage2>{THRESH2}, cap={HARD_CAP})")
-
-                # convert back to real speed per minute
-                real_speed_ep_min = norm_adj * self.target_scale
-            except Exception as e:
-                logger.warning(f"Top-smoothing failed: {e}")
-                real_speed_ep_min = speed_pred_clip * self.target_scale * final_scale
-            dt_hours = (future_t_clip[1] - future_t_clip[0]) if len(future_t_clip) > 1 else 0
-            dt_min = dt_hours * 60
-            score_increment = np.cumsum(real_speed_ep_min * dt_min)
-            score_pred = current_max_score + score_increment
-            full_t_score = np.concatenate([self.target_data['hours_elapsed'].values, future_t_clip])
-            full_score = np.concatenate([score_series.values, score_pred])
-        else:
-            full_t_score = self.target_data['hours_elapsed'].values
-            full_score = score_series.values
-
-        # --- Ensure plotted predicted speed matches the final adjusted curve used
-        # in cumulative computations (apply final scaling + top-smoothing + cap
-        # across the full prediction vector for plotting consistency).
-        try:
-            final_scale_for_plot = float(locals().get('applied_scale_factor', locals().get('scale_factor', 1.0)))
-            adj_norm_full = speed_pred * final_scale_for_plot
-
-            # reuse same smoothing parameters as applied earlier (from config)
-            THRESH1 = float(self.config.get('smooth_thresh1', 0.5))
-            THRESH2 = float(self.config.get('smooth_thresh2', 0.65))
-            HARD_CAP = float(self.config.get('smooth_hard_cap', 0.8))
-            ALPHA = 3.0
-            BETA = 22.0
-
-            norm_adj_full = adj_norm_full.copy()
-            mask_stage1 = (adj_norm_full > THRESH1) & (adj_norm_full <= THRESH2)
-            if np.any(mask_stage1):
-                excess1 = (adj_norm_full[mask_stage1] - THRESH1) / (THRESH2 - THRESH1)
-                attenuation1 = 1.0 / (1.0 + ALPHA * excess1)
-                norm_adj_full[mask_stage1] = THRESH1 + (adj_norm_full[mask_stage1] - THRESH1) * attenuation1
-
-            mask_stage2 = adj_norm_full > THRESH2
-            if np.any(mask_stage2):
-                excess2 = (adj_norm_full[mask_stage2] - THRESH2) / (1.0 - THRESH2)
-                attenuation2 = 1.0 / (1.0 + BETA * (excess2 ** 2))
-                norm_adj_full[mask_stage2] = THRESH2 + (adj_norm_full[mask_stage2] - THRESH2) * attenuation2
-
-            norm_adj_full = np.minimum(norm_adj_full, HARD_CAP)
-        except Exception:
-            norm_adj_full = speed_pred.copy()
+        params = memo.run('params', (memo.keys['history'], ratio.ratio),
+                          lambda: stages.predict_params(history, ratio.ratio))
+
+        # 生成曲线
+        curve = memo.run('curve', (params.pred, start_at, self.meta['end_at'], seasonality.version,
+                                  seasonality.panic_ease_power, seasonality.panic_scaler, CosineModeler.VERSION),
+                         lambda: stages.generate_curve(params.pred, start_at, self.meta['end_at'], seasonality, self.modeler))
+        logger.debug(f"target_scale={self.target_scale}, target_total_hours={curve.total_hours}, debug_hours={self.debug_hours}")
+
+        # 观测当前分数和时间（用于 scaling 诊断与积分）
+        # 只使用冻结时刻之前的数据 (debug_hours / 回测)；full_target_data 仅用于绘制真实的"未来"
+        observed = stages.observe(self.target_data)
+        observed_key = input_key(target_key, _frame_columns(observed.history, ('time', 'hours_elapsed', 'ep', 'value')))
+
+        # 6. 输出缩放 (首日 18:00 -> 当前) 与 24h 回测修正
+        scale_cfg = (float(cfg.get('scale_min', 0.5)), float(cfg.get('scale_max', 2.0)))
+        scale = memo.run('scale', (memo.keys['curve'], observed_key, self.target_scale, seasonality.tz_offset, scale_cfg),
+                         lambda: stages.output_scale(curve, observed, self.target_scale, start_at, seasonality.tz_offset, *scale_cfg))
+        corr_cfg = (float(cfg.get('corr_min', 0.6)), float(cfg.get('corr_max', 1.6)))
+        final_scale = memo.run('backtest', (memo.keys['scale'], corr_cfg),
+                               lambda: stages.backtest_correction(curve, observed, scale, self.target_scale, *corr_cfg))
+
+        # 7. 顶部平滑 (两段衰减 + 硬上限)
+        smooth_cfg = (float(cfg.get('smooth_thresh1', 0.5)), float(cfg.get('smooth_thresh2', 0.65)), float(cfg.get('smooth_hard_cap', 0.8)))
+        smoothed = memo.run('smoothing', (memo.keys['backtest'], final_scale, smooth_cfg),
+                            lambda: stages.top_smoothing(curve, observed, final_scale, self.target_scale, *smooth_cfg))
+        norm_adj_full = smoothed.norm_full
+
+        # 8. 积分得到预测分数线
+        forecast = memo.run('forecast', (memo.keys['smoothing'],),
+                            lambda: stages.integrate_scores(smoothed, observed))
+        full_t_score, full_score = forecast.t_hours, forecast.score
+        target_df = target.frame
 
         # Pass the adjusted normalized prediction into plotting so visual matches numeric output
         # Build output filename: default ./output/pred_{eventid}_{timestamp}.png
@@ -1230,6 +1368,7 @@ class DataHandler:
             output_path = None
 
         # call plot_final and optionally capture return; protect with try/except
+        plot_ret = None
         try:
 
 
@@ -1239,21 +1378,12 @@ class DataHandler:
             #    output_path=output_path, return_type=return_type
             #)
             try:
-                import json
-                json_out = {
-                    "result": True,
-                    "cutoffs": [
-                        {
-                            "time": int(self.meta['start_at'] + t * 3600 * 1000),
-                            "ep": int(ep)
-                        }
-                        for t, ep in zip(full_t_score, full_score)
-                    ]
-                }
+                json_out = memo.run('export', (memo.keys['forecast'], start_at),
+                                    lambda: stages.export_cutoffs(forecast, start_at))
                 #-3标记只是针对国服的预测
-                json_path = f"ycx{tiers}-3.json"
-                with open(json_path, "w", encoding="utf-8") as f:
-                    json.dump(json_out, f, ensure_ascii=False)
+                write_json_atomic(json_path, json_out)
+                self.last_output = json_out
+                self._last_runs[tiers] = {'fingerprint': fingerprint, 'output': json_out, 'json_path': json_path}
                 print(f"预测 JSON 已输出: {json_path}")
                 logger.info(f"Saved JSON cutoffs to {json_path}")
             except Exception as e:
@@ -1286,6 +1416,176 @@ class DataHandler:
             return plot_ret
         return None
 
+    @metrics.stage('sweep')
+    def sweep(self, overrides, tiers=1000, curves=False):
+        """
+        What-if 扫描：在已加载的数据上一次评估多组配置，不必为每组重新执行
+        DataHandler -> find_similar_events -> run_prediction。调用前需已 load_target_data / find_similar_events。
+        不写 JSON，也不修改 self.config / self.last_output。
+
+        Parameters:
+        - overrides: [{knob: value}, ...] 或网格 {knob: [values]} (笛卡尔积)；
+                     knob 见 prediction_stages.SWEEP_KNOBS，未指定的取当前配置
+        - curves: True 时同时返回每组配置的预测分数线 (与 ycx{tier}-3.json 格式相同)
+
+        Returns:
+        - pandas.DataFrame: 每组一行，列为各 knob 与 ratio / scale / final_scale / final_score；
+          curves=True 时返回 (DataFrame, [dict])
+        """
+        if isinstance(overrides, dict):
+            overrides = stages.config_grid(overrides)
+        unknown = sorted({k for o in overrides for k in o} - set(stages.SWEEP_KNOBS))
+        if unknown:
+            raise ValueError(f"无法扫描的参数: {unknown} (可用: {', '.join(stages.SWEEP_KNOBS)})")
+
+        self._activate_tier(tiers)
+        seasonality = self.seasonality
+        # 恐慌期参数以节律处理器创建时的取值为准 (与 run_prediction 一致)
+        base = {k: self.config.get(k, DEFAULT_CONFIG[k]) for k in stages.SWEEP_KNOBS}
+        base['panic_ease_power'] = seasonality.panic_ease_power
+        base['panic_scaler'] = seasonality.panic_scaler
+        configs = [dict(base, **o) for o in overrides]
+        if not configs:
+            empty = pd.DataFrame(columns=[*stages.SWEEP_KNOBS, 'ratio', 'scale', 'final_scale', 'final_score'])
+            return (empty, []) if curves else empty
+
+        _, _, _, history, ratio = self._upstream_stages(tiers)
+        observed = stages.observe(self.target_data)
+        result = stages.sweep_configs(
+            configs, ratio, history, observed, self.target_scale,
+            self.meta['start_at'], self.meta['end_at'], seasonality, self.modeler,
+        )
+        table = pd.DataFrame(result.configs)
+        table['ratio'] = result.ratio
+        table['scale'] = result.scale
+        table['final_scale'] = result.final_scale
+        table['final_score'] = result.scores[:, -1].astype(np.int64) if result.scores.shape[1] else 0
+        logger.info(f"Sweep: tier={tiers} configs={len(configs)}")
+        if not curves:
+            return table
+        return table, [
+            stages.export_cutoffs(stages.Forecast(result.t_hours, scores), self.meta['start_at'])
+            for scores in result.scores
+        ]
+
+    def _upstream_stages(self, tiers):
+        """
+        与 SWEEP_KNOBS 无关的前段 (对比窗口、目标/历史强度、比率混合)，run_prediction 与 sweep 共用。
+        返回 (memo, target_key, TargetIntensity, HistoryIntensity, RatioResult)。
+        """
+        # 各阶段按输入键复用上次的结果 (见 prediction_stages)；只有输入变化的阶段及其下游会重新计算
+        memo = self._stage_memos.get(tiers)
+        if memo is None:
+            memo = self._stage_memos[tiers] = StageMemo()
+        memo.begin()
+        cfg = self.config
+        seasonality = self.seasonality
+        target_key = input_key(_frame_columns(self.target_data, ('time', 'hours_elapsed', 'norm_speed', 'ep', 'value')))
+
+        # 1. 确定对比窗口 (Comparison Window)
+        # 终点：使用已观测的最新进度（若 caller 未传入 debug_hours 则已在 load_target_data 自动检测），
+        # 上限由配置项 t_end_cap 控制（默认72小时）
+        window = stages.comparison_window(
+            self.target_data, self.debug_hours,
+            float(cfg.get('t_start_cmp', 6.0)), float(cfg.get('t_end_cap', 72.0)),
+        )
+        print(f"锁定对比区间: [ {window.t_start}h ~ {window.t_end}h ] (end_source={window.end_source})")
+
+        # 2. 计算【当前活动】在该区间的强度
+        target = memo.run('target', (window, target_key, seasonality.version),
+                          lambda: stages.target_intensity(self.target_data, seasonality, window))
+
+        # 3. 计算【历史活动】在【同一区间】的强度 & 拟合参数
+        self._prepare_history_events(self.history_events)
+        prepared = []
+        history_parts = [window]
+        for h in self.history_events:
+            df_clean, popt = self._prepare_history_event(h)
+            prepared.append((h['event_id'], df_clean, popt))
+            # 按 history_intensity 实际读取的列的内容计算，不能只看行数 (数据可能行数不变而内容变化)
+            frame_key = input_key(_frame_columns(df_clean, ('hours_elapsed', 'skeleton_speed', 'norm_speed')))
+            history_parts.append((h['event_id'], h.get('tier'), frame_key,
+                                  None if popt is None else tuple(np.asarray(popt, dtype=float).tolist())))
+        history_parts.append(seasonality.version)
+        history = memo.run('history', history_parts, lambda: stages.history_intensity(prepared, window))
+
+        # 4. 计算 Ratio
+        ratio_cfg = (float(cfg.get('t_end_cap', 72.0)), float(cfg.get('ratio_min', 0.25)), float(cfg.get('ratio_max', 4.0)))
+        ratio = memo.run('ratio', (memo.keys['target'], memo.keys['history'], ratio_cfg),
+                         lambda: stages.blend_ratio(target, history, *ratio_cfg))
+        return memo, target_key, target, history, ratio
+
+    def _prediction_fingerprint(self, tiers):
+        """run_prediction 全部输入的摘要；与上次相同时预测结果也相同"""
+        df = self.target_data
+        if df is not None and len(df) > 0:
+            last = df.iloc[-1]
+            target = (len(df), int(last['time']), float(last['ep']))
+        else:
+            target = None
+        # 历史拟合结果也是输入：先处理待 (重新) 拟合的活动，拟合失败改用默认参数后，
+        # FIT_RETRY_SECONDS 到期的重试即使目标数据不变也会执行，成功后指纹随参数变化
+        self._prepare_history_events(self.history_events)
+        history = []
+        for h in self.history_events:
+            _, popt = self._history_prepared.get((h['event_id'], h.get('tier')), (None, None))
+            history.append((h['event_id'], None if popt is None else tuple(np.asarray(popt, dtype=float).tolist())))
+        return (
+            tiers,
+            target,
+            self.meta.get('start_at'),
+            self.target_scale,
+            self.debug_limit_ts,
+            self.debug_hours,
+            tuple(history),
+            json.dumps(self.config, sort_keys=True, default=str),
+            self.seasonality.version,
+            CosineModeler.VERSION,
+        )
+
+    def run_prediction_batch(self, tiers, count=None, incremental=False, json_path_fmt=None):
+        """
+        一次性预测多个 tier，共享与 tier 无关的工作：
+        活动元数据、目标 T10 scale、候选活动列表、候选活动的 meta 与 T10 scale、节律表。
+        每个 tier 仍然各自获取 tracker 数据、寻找历史活动并输出 ycx{tier}-3.json。
+        incremental=True 时 tracker 未更新的 tier 只需一次条件请求 (304)，并沿用上次的预测结果。
+
+        Parameters:
+        - tiers: 档位列表，例如 [100, 500, 1000, 2000]
+        - incremental: 传给 load_target_data，用于常驻刷新
+        - json_path_fmt: 输出路径模板，例如 "ycx{tier}-3"；None 时使用 run_prediction 的默认路径
+
+        Returns:
+        - dict: tier -> 预测 JSON (dict)，失败的 tier 为 None
+        """
+        results = {}
+        if self._auto_progress:
+            self.debug_limit_ts = None
+            self.debug_hours = None
+        # 由第一个 tracker 有更新的 tier 计算；所有 tier 都未变化时不请求 eventtop
+        self._shared_target_scale = _PENDING
+        try:
+            for tier in tiers:
+                try:
+                    self.load_target_data(tier, incremental=incremental)
+                    self._activate_tier(tier)
+                    if not self.history_events:
+                        self.find_similar_events(count, tiers=tier)
+                    if not self.history_events:
+                        print(f"T{tier}: 没找到历史活动，跳过。")
+                        results[tier] = None
+                        continue
+                    json_path = json_path_fmt.format(tier=tier) if json_path_fmt else None
+                    self.run_prediction(tiers=tier, json_path=json_path)
+                    results[tier] = self.last_output
+                except Exception as e:
+                    logger.warning(f"Batch prediction failed for tier={tier}: {e}")
+                    results[tier] = None
+        finally:
+            self._shared_target_scale = None
+        return results
+
+    @metrics.stage('plot')
     def plot_final(self, target_df, t_pred, y_skeleton, y_final, t_score, y_score, output_path=None, return_type=None):
         """
         Draw prediction plots with Real Date-Time X-axis (Fixed for Timezone Alignment).
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from calendar_service import DAY_TYPE_NAMES
+from config import SEASONALITY_CONFIG
+
+# ==========================================
+# 节律表存储 (SeasonalityTable)
+# ==========================================
+# 每个 (server, tier, event_type) 一张表，保存为 npz：
+#   mean / median / std: (2, 24) float64，行为 DAY_TYPE_NAMES，无数据的小时为 nan
+#   count: (2, 24) int64；events: 参与统计的活动 ID；version: 表内容的哈希
+# 路径: {table_dir}/{server}/{tier}/{event_type 或 all}.npz，由 distribution_builder.build_tables 生成。
+# 读取结果在进程内缓存 (按文件 mtime 失效)，多个 DataHandler / tier 共用，不再逐个解析 JSON。
+# 找不到对应的表时依次回退: 同 tier 的 all 表 -> base_speed_distribution.json (国服 T1000)。
+
+TABLE_FORMAT = 1
+
+
+class SeasonalityTable:
+    def __init__(self, mean, median, std, count, events=(), server=None, tier=None, event_type=None, built_at=None):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.median = np.asarray(median, dtype=np.float64)
+        self.std = np.asarray(std, dtype=np.float64)
+        self.count = np.asarray(count, dtype=np.int64)
+        self.events = np.asarray(events, dtype=np.int64)
+        self.server = server
+        self.tier = tier
+        self.event_type = event_type
+        self.built_at = built_at
+        # 只读共享：缓存中的表被多个 SeasonalityHandler 引用
+        for arr in (self.mean, self.median, self.std, self.count, self.events):
+            arr.setflags(write=False)
+        self.version = hashlib.sha1(
+            self.mean.tobytes() + self.median.tobytes() + self.std.tobytes() + self.count.tobytes()
+        ).hexdigest()[:16]
+
+    @property
+    def key(self):
+        return (self.server, self.tier, self.event_type)
+
+    @classmethod
+    def from_summary(cls, summary, events=(), server=None, tier=None, event_type=None):
+        """由 base_speed_distribution.json 格式 ({day_type: {hour: {mean, median, std, count}}}) 构造"""
+        arrays = {name: np.full((len(DAY_TYPE_NAMES), 24), np.nan) for name in ('mean', 'median', 'std')}
+        count = np.zeros((len(DAY_TYPE_NAMES), 24), dtype=np.int64)
+        for row, dtype in enumerate(DAY_TYPE_NAMES):
+            hours = (summary or {}).get(dtype) or {}
+            for h in range(24):
+                item = hours.get(str(h), hours.get(h))
+                if not item:
+                    continue
+                for name in arrays:
+                    if item.get(name) is not None:
+                        arrays[name][row, h] = float(item[name])
+                count[row, h] = int(item.get('count', 0))
+        return cls(arrays['mean'], arrays['median'], arrays['std'], count, events,
+                   server=server, tier=tier, event_type=event_type)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez_compressed(
+            tmp,
+            format=np.int64(TABLE_FORMAT),
+            mean=self.mean, median=self.median, std=self.std, count=self.count, events=self.events,
+            meta=np.str_(json.dumps({
+                'server': self.server,
+                'tier': self.tier,
+                'event_type': self.event_type,
+                'built_at': self.built_at or int(time.time()),
+            })),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """读取表；格式不符或损坏时返回 None。"""
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                if int(z['format']) != TABLE_FORMAT:
+                    return None
+                meta = json.loads(str(z['meta']))
+                return cls(z['mean'], z['median'], z['std'], z['count'], z['events'],
+                           server=meta.get('server'), tier=meta.get('tier'),
+                           event_type=meta.get('event_type'), built_at=meta.get('built_at'))
+        except Exception:
+            return None
+
+
+def table_path(server, tier, event_type=None, root=None):
+    root = root or SEASONALITY_CONFIG['table_dir']
+    return os.path.join(root, str(server), str(tier), f"{event_type or 'all'}.npz")
+
+
+# path -> (mtime, SeasonalityTable 或 None)
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+
+def _cached(path, loader):
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _TABLES_LOCK:
+        hit = _TABLES.get(path)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+    table = loader(path)
+    with _TABLES_LOCK:
+        _TABLES[path] = (mtime, table)
+    return table
+
+
+def _load_legacy_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+    except Exception:
+        return None
+    if not summary:
+        return None
+    return SeasonalityTable.from_summary(summary, server=3, tier=1000)
+
+
+def load_table(server, tier, event_type=None, fallback_json=None):
+    """
+    (server, tier, event_type) 的节律表 (只读，进程内共享)；
+    依次回退到同 tier 的 all 表与 fallback_json，都不存在时返回 None。
+    """
+    candidates = []
+    if event_type:
+        candidates.append(table_path(server, tier, event_type))
+    candidates.append(table_path(server, tier))
+    for path in candidates:
+        table = _cached(path, SeasonalityTable.load)
+        if table is not None:
+            return table
+    if fallback_json:
+        return _cached(os.path.abspath(fallback_json), _load_legacy_json)
+    return None
+
+
+def clear_cache():
+    with _TABLES_LOCK:
+        _TABLES.clear()
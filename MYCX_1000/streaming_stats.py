@@ -0,0 +1,179 @@
+import math
+
+import numpy as np
+
+# ==========================================
+# 可合并的流式统计量 (RunningStats / TDigest)
+# ==========================================
+# 小时分布只需要 mean / std / median / count，不必保存全部样本：
+#   - count / sum / sumsq 直接相加即可合并，得到 mean 与 std
+#   - 中位数 (及其他分位数) 由 merging t-digest 估计，质心数量受 compression 限制
+# 新活动的样本折叠进去只需 O(该活动样本数) 的工作量，内存占用与样本总数无关。
+# 合并后 count / mean / std 与一次性统计全部样本相同 (仅有浮点求和顺序的差别)；
+# 分位数只是近似值，且与 add / merge 的顺序有关，不同顺序得到的 median 会有微小差异。
+
+
+class TDigest:
+    """
+    Merging t-digest (k1 尺度函数)。质心按均值排序保存为两个 numpy 数组；
+    样本较少时每个样本都是独立的质心，分位数是精确的。
+    """
+
+    def __init__(self, compression=100):
+        self.compression = float(compression)
+        self.means = np.empty(0, dtype=np.float64)
+        self.weights = np.empty(0, dtype=np.float64)
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    def _k(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind='mergesort')
+        means, weights = means[order], weights[order]
+        total = float(weights.sum())
+        if len(means) <= 1 or total <= 0:
+            self.means, self.weights = means, weights
+            return
+        out_means, out_weights = [], []
+        cur_mean, cur_weight = float(means[0]), float(weights[0])
+        done = 0.0  # 当前质心之前的累计权重
+        k_limit = self._k(0.0) + 1
+        for m, w in zip(means[1:].tolist(), weights[1:].tolist()):
+            if self._k((done + cur_weight + w) / total) <= k_limit:
+                cur_weight += w
+                cur_mean += (m - cur_mean) * w / cur_weight
+            else:
+                out_means.append(cur_mean)
+                out_weights.append(cur_weight)
+                done += cur_weight
+                k_limit = self._k(done / total) + 1
+                cur_mean, cur_weight = m, w
+        out_means.append(cur_mean)
+        out_weights.append(cur_weight)
+        self.means = np.asarray(out_means, dtype=np.float64)
+        self.weights = np.asarray(out_weights, dtype=np.float64)
+
+    def add(self, values):
+        """加入一批样本 (每个样本权重为 1)。"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return self
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(values.size)]))
+        return self
+
+    def merge(self, other):
+        """并入另一个 digest (原地)。"""
+        if other.weights.size == 0:
+            return self
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(np.concatenate([self.means, other.means]),
+                       np.concatenate([self.weights, other.weights]))
+        return self
+
+    def quantile(self, q):
+        """分位数 q (0~1) 的估计；没有样本时返回 nan。"""
+        if self.weights.size == 0:
+            return float('nan')
+        if self.weights.size == 1:
+            return float(self.means[0])
+        total = float(self.weights.sum())
+        # 每个质心的均值位于其权重区间的中点，区间之间线性插值，两端延伸到 min / max
+        centers = np.cumsum(self.weights) - self.weights / 2
+        x = np.concatenate([[0.0], centers, [total]])
+        y = np.concatenate([[self.min], self.means, [self.max]])
+        return float(np.interp(q * total, x, y))
+
+    def to_json(self):
+        return {
+            'compression': self.compression,
+            'min': self.min if self.weights.size else None,
+            'max': self.max if self.weights.size else None,
+            'means': self.means.tolist(),
+            'weights': self.weights.tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        digest = cls(data.get('compression', 100))
+        digest.means = np.asarray(data.get('means', []), dtype=np.float64)
+        digest.weights = np.asarray(data.get('weights', []), dtype=np.float64)
+        if digest.weights.size:
+            digest.min = float(data['min'])
+            digest.max = float(data['max'])
+        return digest
+
+
+class RunningStats:
+    """一个 (day_type, 小时) 桶的充分统计量：count / sum / sumsq + TDigest。"""
+
+    def __init__(self, compression=100):
+        self.count = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.digest = TDigest(compression)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return self
+        self.count += int(values.size)
+        self.sum += float(values.sum())
+        self.sumsq += float(np.dot(values, values))
+        self.digest.add(values)
+        return self
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        self.digest.merge(other.digest)
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else float('nan')
+
+    @property
+    def std(self):
+        """总体标准差 (与 np.std 默认的 ddof=0 一致)"""
+        if not self.count:
+            return float('nan')
+        mean = self.mean
+        return math.sqrt(max(self.sumsq / self.count - mean * mean, 0.0))
+
+    @property
+    def median(self):
+        return self.digest.quantile(0.5)
+
+    def summary(self):
+        """base_speed_distribution.json 中一个小时段的条目；没有样本时为 None"""
+        if not self.count:
+            return None
+        return {
+            "mean": self.mean,
+            "median": self.median,
+            "std": self.std,
+            "count": self.count,
+        }
+
+    def to_json(self):
+        return {'count': self.count, 'sum': self.sum, 'sumsq': self.sumsq, 'digest': self.digest.to_json()}
+
+    @classmethod
+    def from_json(cls, data):
+        stats = cls()
+        stats.count = int(data['count'])
+        stats.sum = float(data['sum'])
+        stats.sumsq = float(data['sumsq'])
+        stats.digest = TDigest.from_json(data['digest'])
+        return stats
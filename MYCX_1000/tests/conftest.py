@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试直接导入 MYCX_1000 下的模块 (与脚本的运行方式相同)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+
+from cache import DiskCache
+
+# DiskCache：相同内容只存一份 blob；LRU 淘汰按 blob 释放空间；过期条目只有带验证器时才保留给 get_stale。
+
+
+def _blobs(cache):
+    return sorted(name for _, _, files in os.walk(cache.blob_dir) for name in files)
+
+
+def test_identical_values_share_one_blob(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.put('a', {'result': False})
+    cache.put('b', {'result': False})
+    cache.put('c', {'result': True})
+    assert len(_blobs(cache)) == 2
+    # 只有最后一个引用被删除时 blob 才会删除
+    cache._drop('a')
+    assert cache.get('b') == {'result': False}
+    cache._drop('b')
+    assert len(_blobs(cache)) == 1
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    for i in range(6):
+        cache.put(f"k{i}", {'i': i, 'pad': 'x' * 2000})
+    size = cache._db().execute('SELECT MAX(size) FROM entries').fetchone()[0]
+    # 最近读取过的 k0 保留，未读取的最早条目先被淘汰
+    cache.get('k0')
+    cache.max_bytes = size * 3
+    cache.flush()
+    assert cache.get('k0') == {'i': 0, 'pad': 'x' * 2000}
+    assert cache.get('k1') is None
+    assert cache.get('k5') is not None
+    assert len(_blobs(cache)) <= 3
+
+
+def test_expired_entries_kept_only_with_validators(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.put('plain', {'v': 1}, ttl=-1)
+    cache.put('etag', {'v': 2}, ttl=-1, validators={'etag': '"abc"'})
+    assert cache.get('plain') is None
+    assert cache.get_stale('plain') == (None, None)
+    assert cache.get('etag') is None
+    assert cache.get_stale('etag') == ({'v': 2}, {'etag': '"abc"'})
+
+
+def test_entries_visible_across_instances(tmp_path):
+    # 另一个进程 (这里用另一个实例) 写入的条目立即可见，不会覆盖彼此的索引
+    first = DiskCache(str(tmp_path))
+    second = DiskCache(str(tmp_path))
+    first.put('a', {'v': 1})
+    second.put('b', {'v': 2})
+    assert second.get('a') == {'v': 1}
+    assert first.get('b') == {'v': 2}
+
+
+def test_failed_commit_does_not_poison_connection(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    real = cache._conn
+
+    class FailingCommit:
+        failed = False
+
+        def __getattr__(self, name):
+            return getattr(real, name)
+
+        def execute(self, sql, *args):
+            if sql == 'COMMIT' and not FailingCommit.failed:
+                FailingCommit.failed = True
+                raise sqlite3.OperationalError('database is locked')
+            return real.execute(sql, *args)
+
+    cache._conn = FailingCommit()
+    try:
+        cache.put('a', {'v': 1})
+    except sqlite3.OperationalError:
+        pass
+    assert not real.in_transaction
+    cache.put('b', {'v': 2})
+    assert cache.get('b') == {'v': 2}
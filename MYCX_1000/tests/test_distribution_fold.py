@@ -0,0 +1,80 @@
+import numpy as np
+
+from calendar_service import DAY_TYPE_NAMES
+from distribution_builder import DistributionState, fold_results
+
+# --update 只把新结束的活动折叠进已保存的状态；这里检查它与完整重建的一致性：
+# count / mean / std 只与样本集合有关，median 来自 t-digest，与折叠顺序有关，只能在误差范围内一致。
+
+N_EVENTS = 12
+MEDIAN_TOLERANCE = 0.01
+
+
+def _event(event_id, samples=600):
+    rng = np.random.default_rng(event_id)
+    return {
+        'status': 'ok',
+        'final': True,
+        'event_type': 'story' if event_id % 2 else 'challenge',
+        'scale': 1.0,
+        'day_type': rng.integers(0, 2, samples).astype(np.int8),
+        'hour': rng.integers(0, 24, samples).astype(np.int8),
+        'norm': rng.beta(2.0, 5.0, samples) * 1.2,
+    }
+
+
+def _rebuild(event_ids):
+    states = {None: DistributionState(), 'story': DistributionState(event_type='story')}
+    fold_results(states, {eid: _event(eid) for eid in event_ids})
+    return states
+
+
+def _update(states, event_ids):
+    # 与 build_states(update=True) 相同：状态经过保存 / 读取后再折叠新活动
+    states = {key: DistributionState.from_json(state.to_json()) for key, state in states.items()}
+    fold_results(states, {eid: _event(eid) for eid in event_ids})
+    return states
+
+
+def _assert_equivalent(updated, rebuilt):
+    for key in rebuilt:
+        assert updated[key].events == rebuilt[key].events
+        for day_type, hours in rebuilt[key].buckets.items():
+            for h, expected in enumerate(hours):
+                actual = updated[key].buckets[day_type][h]
+                assert actual.count == expected.count
+                if not expected.count:
+                    continue
+                np.testing.assert_allclose(actual.mean, expected.mean, rtol=1e-12)
+                np.testing.assert_allclose(actual.std, expected.std, rtol=1e-9)
+                assert abs(actual.median - expected.median) <= MEDIAN_TOLERANCE
+
+
+def _exact_medians(event_ids):
+    samples = {}
+    for eid in event_ids:
+        ev = _event(eid)
+        for d, h, v in zip(ev['day_type'].tolist(), ev['hour'].tolist(), ev['norm'].tolist()):
+            samples.setdefault((d, h), []).append(v)
+    return {key: float(np.median(values)) for key, values in samples.items()}
+
+
+def test_fold_one_more_event_matches_rebuild():
+    ids = list(range(1, N_EVENTS + 1))
+    updated = _update(_rebuild(ids), [N_EVENTS + 1])
+    _assert_equivalent(updated, _rebuild(ids + [N_EVENTS + 1]))
+
+
+def test_late_older_event_only_changes_median_within_tolerance():
+    # 较早的活动在之后才结束并通过 --update 加入：折叠顺序与完整重建不同
+    ids = list(range(1, N_EVENTS + 1))
+    late = 5
+    updated = _update(_rebuild([eid for eid in ids if eid != late]), [late])
+    _assert_equivalent(updated, _rebuild(ids))
+
+
+def test_digest_median_close_to_exact():
+    ids = list(range(1, N_EVENTS + 1))
+    state = _rebuild(ids)[None]
+    for (d, h), exact in _exact_medians(ids).items():
+        assert abs(state.buckets[DAY_TYPE_NAMES[d]][h].median - exact) <= MEDIAN_TOLERANCE
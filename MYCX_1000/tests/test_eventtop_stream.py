@@ -0,0 +1,99 @@
+import json
+import random
+
+import numpy as np
+import pandas as pd
+
+from eventtop_stream import EventtopPoints, TopSpeedTracker, iter_points, max_speed, read_points
+
+# 流式解析与 TopSpeedTracker 应与原实现 (json 整体解码 + pandas groupby.diff + nlargest(3)) 一致：
+# 任意切块方式、任意刷新切分 (包括切在同一时刻的点之间) 都得到相同的结果。
+
+
+def _rows(seed=1, hours=50, players=20):
+    rng = random.Random(seed)
+    rows = []
+    for t in range(0, 3600000 * hours, 3600000):
+        for uid in range(players):
+            if rng.random() < 0.7:
+                rows.append({'time': t, 'uid': uid, 'value': t // 1000 * (uid + 1) + rng.randint(0, 99)})
+    return rows
+
+
+def _body(rows):
+    return json.dumps({'points': rows, 'users': [{'uid': 1, 'name': 'x'}]}).encode('utf-8')
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _buffer(rows):
+    buf = EventtopPoints()
+    for r in rows:
+        buf.append(r['time'], r['uid'], r['value'])
+    return buf
+
+
+def _reference_speed(rows, limit_ts=None):
+    """原 pandas 实现"""
+    df = pd.DataFrame(rows)
+    if limit_ts is not None:
+        df = df[df['time'] <= limit_ts].copy()
+    df = df.sort_values(['uid', 'time'])
+    df['speed'] = df.groupby('uid')['value'].diff() / (df.groupby('uid')['time'].diff() / 60000)
+    valid = df[(df['speed'] > 0) & (df['speed'] < 1000000)]['speed']
+    return float(np.mean(valid.nlargest(3).values))
+
+
+def test_iter_points_matches_json_for_any_chunking():
+    rows = _rows(hours=5)
+    data = _body(rows)
+    expected = [(r['time'], r['uid'], r['value']) for r in rows]
+    for size in (1, 7, 64, 1000, len(data)):
+        assert list(iter_points(_chunks(data, size))) == expected
+
+
+def test_iter_points_generic_fallback_and_non_objects():
+    # 字段顺序不同的点走通用解码；不是对象的元素被跳过
+    data = b'{"points": [{"uid": 2, "value": 5, "time": 10}, 3, "x", [1], {"time": 20, "uid": 2, "value": 9}]}'
+    assert list(iter_points(_chunks(data, 5))) == [(10, 2, 5), (20, 2, 9)]
+
+
+def test_read_points_limit_and_until():
+    rows = _rows(hours=10)
+    data = _body(rows)
+    head = read_points(_chunks(data, 256), limit=50)
+    assert len(head) == 50 and not head.complete
+    until = 3600000 * 4
+    cut = read_points(_chunks(data, 256), until_ts=until)
+    assert len(cut) == sum(1 for r in rows if r['time'] <= until)
+
+
+def test_max_speed_matches_pandas():
+    rows = _rows()
+    assert max_speed(_buffer(rows)) == _reference_speed(rows)
+    assert max_speed(_buffer(rows[:500])) == _reference_speed(rows[:500])
+
+
+def test_tracker_incremental_matches_full():
+    rows = _rows()
+    full = _reference_speed(rows)
+    rng = random.Random(2)
+    for _ in range(50):
+        # 刷新之间可以切在任意位置，包括同一时刻的点之间；每次刷新返回至今的完整数组
+        cut = rng.randrange(1, len(rows))
+        tracker = TopSpeedTracker()
+        tracker.update(_buffer(rows[:cut]))
+        tracker.update(_buffer(rows))
+        assert tracker.scale() == full
+
+
+def test_tracker_until_ts_matches_truncated():
+    rows = _rows()
+    points = _buffer(rows)
+    tracker = TopSpeedTracker()
+    for hours in (6, 12, 30, 49):
+        limit_ts = 3600000 * hours
+        tracker.update(points, until_ts=limit_ts)
+        assert tracker.scale() == _reference_speed(rows, limit_ts)
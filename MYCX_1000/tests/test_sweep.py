@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import prediction_stages as stages
+from predictor import CosineModeler, SeasonalityHandler
+
+# sweep_configs 一次评估多组配置；每一组都应与逐阶段的单配置流水线 (run_prediction 的计算顺序) 完全相同。
+
+JSON_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'base_speed_distribution.json')
+START_AT = 1740812400000            # 2025-03-01 15:00 (UTC+8)
+TOTAL_HOURS = 190.0
+TARGET_SCALE = 1500.0
+
+CONFIGS = [
+    {},
+    {'smooth_hard_cap': 0.05},
+    {'smooth_thresh1': 0.03, 'smooth_thresh2': 0.06, 'smooth_hard_cap': 0.08},
+    {'ratio_max': 0.5},
+    {'scale_min': 0.8, 'scale_max': 0.9},
+    {'corr_min': 0.99, 'corr_max': 1.0},
+    {'panic_ease_power': 2.0, 'panic_scaler': 1.6},
+    {'ratio_min': 1.5, 'panic_scaler': 0.5},
+]
+BASE = {
+    'ratio_min': 0.25, 'ratio_max': 4.0, 'scale_min': 0.5, 'scale_max': 2.0, 'corr_min': 0.6, 'corr_max': 1.6,
+    'smooth_thresh1': 0.5, 'smooth_thresh2': 0.65, 'smooth_hard_cap': 0.8, 'panic_ease_power': 1.0, 'panic_scaler': 1.1,
+}
+
+
+def _observed(hours=100.0):
+    h = np.arange(0.0, hours + 1e-9, 0.5)
+    ep = (TARGET_SCALE * 60 * (0.15 * h + 0.0004 * h ** 2 + 0.01 * np.sin(h / 24 * 2 * np.pi))).astype(np.int64)
+    frame = pd.DataFrame({'time': START_AT + (h * 3600000).astype(np.int64), 'hours_elapsed': h, 'ep': ep})
+    return stages.observe(frame)
+
+
+def _history():
+    params = [np.array([0.05, 0.001, 0.00001, 0.5, 24.0]), np.array([0.06, 0.0008, 0.00002, 0.7, 30.0])]
+    return stages.HistoryIntensity(params, [0.08, 0.09], [0.3, 0.35])
+
+
+def _single(config, history, chosen, observed):
+    """单组配置：与 DataHandler.run_prediction 相同的阶段顺序"""
+    seasonality = SeasonalityHandler(json_path=JSON_PATH, panic_ease_power=config['panic_ease_power'],
+                                     panic_scaler=config['panic_scaler'])
+    ratio = float(np.clip(chosen, config['ratio_min'], config['ratio_max']))
+    params = stages.predict_params(history, ratio)
+    curve = stages.generate_curve(params.pred, START_AT, START_AT + TOTAL_HOURS * 3600000, seasonality, CosineModeler())
+    scale = stages.output_scale(curve, observed, TARGET_SCALE, START_AT, seasonality.tz_offset,
+                                config['scale_min'], config['scale_max'])
+    final_scale = stages.backtest_correction(curve, observed, scale, TARGET_SCALE, config['corr_min'], config['corr_max'])
+    smoothed = stages.top_smoothing(curve, observed, final_scale, TARGET_SCALE, config['smooth_thresh1'],
+                                    config['smooth_thresh2'], config['smooth_hard_cap'])
+    return stages.export_cutoffs(stages.integrate_scores(smoothed, observed), START_AT)
+
+
+def test_sweep_matches_single_config_chain():
+    observed = _observed()
+    history = _history()
+    chosen = 1.3
+    ratio = stages.RatioResult(chosen, chosen, None, chosen, 0.085)
+    configs = [dict(BASE, **c) for c in CONFIGS]
+    result = stages.sweep_configs(configs, ratio, history, observed, TARGET_SCALE, START_AT,
+                                  START_AT + TOTAL_HOURS * 3600000, SeasonalityHandler(json_path=JSON_PATH),
+                                  CosineModeler())
+    finals = set()
+    for config, scores in zip(configs, result.scores):
+        swept = stages.export_cutoffs(stages.Forecast(result.t_hours, scores), START_AT)
+        assert swept == _single(config, history, chosen, observed)
+        finals.add(swept['cutoffs'][-1]['ep'])
+    # 各组配置确实得到不同的结果 (否则比较没有意义)
+    assert len(finals) > len(configs) // 2
@@ -0,0 +1,94 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import config
+import transport
+from eventtop_stream import stream_points
+
+# 录制后再回放：每个请求得到与录制时相同的状态码、内容与内容类型，流式解析的结果也相同；
+# 未录制的请求与断网时一样抛出 ConnectionError。
+
+POINTS = {'points': [{'time': t * 3600000, 'uid': u, 'value': t * 1000 + u} for t in range(30) for u in range(10)]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith('/eventtop'):
+            status, body = 200, json.dumps(POINTS).encode('utf-8')
+        elif self.path.startswith('/missing'):
+            status, body = 404, b'{"result": false}'
+        else:
+            status, body = 200, json.dumps({'result': True, 'path': self.path}).encode('utf-8')
+        body = gzip.compress(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_port}"
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    # configure_session 在录制 / 回放时会关闭本地缓存与历史存储；测试结束后恢复
+    monkeypatch.setitem(config.CACHE_CONFIG, 'enabled', config.CACHE_CONFIG.get('enabled'))
+    monkeypatch.setitem(config.HISTORY_STORE_CONFIG, 'enabled', config.HISTORY_STORE_CONFIG.get('enabled'))
+    monkeypatch.setattr(transport, '_ARCHIVES', {})
+
+
+def _session(mode, path):
+    session = requests.Session()
+    transport.configure_session(session, mode=mode, archive_path=path)
+    return session
+
+
+def test_record_then_replay_round_trip(server, tmp_path, monkeypatch):
+    path = str(tmp_path / 'fixtures.zip')
+    urls = [f"{server}/api/meta?event=1", f"{server}/missing?event=2"]
+
+    recording = _session('record', path)
+    recorded = [recording.get(url) for url in urls]
+    live_points = stream_points(recording, f"{server}/eventtop?event=1")
+    transport.save_recordings()
+
+    # 回放时从磁盘上的归档读取，而不是录制时的内存对象
+    monkeypatch.setattr(transport, '_ARCHIVES', {})
+    replaying = _session('replay', path)
+    for url, original in zip(urls, recorded):
+        replayed = replaying.get(url)
+        assert replayed.status_code == original.status_code
+        assert replayed.content == original.content
+        assert replayed.headers['Content-Type'] == 'application/json'
+    replayed_points = stream_points(replaying, f"{server}/eventtop?event=1")
+    assert replayed_points.to_json() == live_points.to_json()
+    assert len(replayed_points) == len(POINTS['points'])
+
+
+def test_replay_miss_raises_connection_error(server, tmp_path):
+    path = str(tmp_path / 'fixtures.zip')
+    recording = _session('record', path)
+    recording.get(f"{server}/api/meta?event=1")
+    transport.save_recordings()
+
+    replaying = _session('replay', path)
+    with pytest.raises(requests.ConnectionError):
+        replaying.get(f"{server}/api/meta?event=999")
@@ -0,0 +1,202 @@
+import atexit
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+import zipfile
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from config import CACHE_CONFIG, HISTORY_STORE_CONFIG, TRANSPORT_CONFIG
+
+# ==========================================
+# 可替换的 HTTP 传输层 (录制 / 回放)
+# ==========================================
+# 所有网络请求都经过 requests Session，因此在 Session 上挂载不同的 Adapter 即可切换数据来源：
+#   live   直接访问 bestdori.com (默认)
+#   record 正常访问网络，同时把每个响应写入压缩归档 (zip)
+#   replay 只从归档读取响应，不访问网络；可模拟网络延迟
+# 归档结构: index.json (METHOD URL -> 状态码 / 响应头 / 内容文件名) + bodies/<sha1>
+# 用法 (环境变量，见 config.TRANSPORT_CONFIG):
+#   MYCX_TRANSPORT=record MYCX_FIXTURES=fixtures/ev300.zip python predictor.py
+#   MYCX_TRANSPORT=replay MYCX_FIXTURES=fixtures/ev300.zip MYCX_REPLAY_LATENCY=0.2 python predictor.py
+
+
+def _request_key(request):
+    return f"{request.method} {request.url}"
+
+
+class FixtureArchive:
+    """录制的响应集合；读取时整体载入内存，写入时原子替换归档文件。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}  # key -> {'status', 'headers', 'body'}
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def load(self):
+        with zipfile.ZipFile(self.path, 'r') as zf:
+            index = json.loads(zf.read('index.json').decode('utf-8'))
+            for key, meta in index.items():
+                self._entries[key] = {
+                    'status': meta['status'],
+                    'headers': meta['headers'],
+                    'body': zf.read(meta['body']),
+                }
+        return self
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def put(self, key, status, headers, body):
+        with self._lock:
+            self._entries[key] = {'status': status, 'headers': headers, 'body': body}
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            index = {}
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+                for key, entry in sorted(self._entries.items()):
+                    name = f"bodies/{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+                    zf.writestr(name, entry['body'])
+                    index[key] = {'status': entry['status'], 'headers': entry['headers'], 'body': name}
+                zf.writestr('index.json', json.dumps(index, ensure_ascii=False, indent=1))
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+
+def _build_response(request, status, headers, body):
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers = CaseInsensitiveDict(headers)
+    resp.raw = io.BytesIO(body)
+    resp.url = request.url
+    resp.request = request
+    resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+    # 内容已完整在内存中：.content / .json() / iter_content(stream=True) 都直接使用它
+    resp._content = body
+    resp._content_consumed = True
+    return resp
+
+
+class RecordingAdapter(HTTPAdapter):
+    """正常发送请求，并把完整响应写入归档。"""
+
+    def __init__(self, archive, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        resp = super().send(request, **kwargs)
+        body = resp.content  # 读取完整内容 (录制模式下流式请求不会提前停止)
+        # 内容已解压，去掉与编码/长度相关的头，回放时按原样返回 body
+        headers = {k: v for k, v in resp.headers.items()
+                   if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+        self.archive.put(_request_key(request), resp.status_code, headers, body)
+        return resp
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    只从归档返回响应。未录制的请求抛出 requests.ConnectionError，与断网时的行为一致。
+    latency: 每个请求的模拟延迟 (秒)；jitter: 延迟的相对抖动幅度，按 URL 确定，结果可复现。
+    """
+
+    def __init__(self, archive, latency=0.0, jitter=0.0):
+        super().__init__()
+        self.archive = archive
+        self.latency = float(latency or 0.0)
+        self.jitter = float(jitter or 0.0)
+        self.misses = []
+
+    def _delay(self, key):
+        if self.latency <= 0:
+            return 0.0
+        if self.jitter <= 0:
+            return self.latency
+        rng = random.Random(hashlib.sha1(key.encode('utf-8')).digest())
+        return max(0.0, self.latency * (1.0 + self.jitter * rng.uniform(-1.0, 1.0)))
+
+    def send(self, request, **kwargs):
+        key = _request_key(request)
+        entry = self.archive.get(key)
+        delay = self._delay(key)
+        if delay:
+            time.sleep(delay)
+        if entry is None:
+            self.misses.append(key)
+            raise requests.ConnectionError(f"No recorded fixture for {key}")
+        return _build_response(request, entry['status'], entry['headers'], entry['body'])
+
+    def close(self):
+        pass
+
+
+_ARCHIVES = {}
+_ARCHIVE_LOCK = threading.Lock()
+
+
+def _archive_for(path, mode):
+    with _ARCHIVE_LOCK:
+        archive = _ARCHIVES.get(path)
+        if archive is None:
+            archive = FixtureArchive(path)
+            if os.path.exists(path):
+                archive.load()
+            elif mode == 'replay':
+                raise FileNotFoundError(f"Fixture archive not found: {path}")
+            if mode == 'record':
+                atexit.register(archive.save)
+            _ARCHIVES[path] = archive
+        return archive
+
+
+def configure_session(session, mode=None, archive_path=None, latency=None, jitter=None, adapter_kwargs=None):
+    """
+    按 TRANSPORT_CONFIG (或参数) 为 Session 挂载传输层；live 模式不做任何改动。
+    record / replay 模式下关闭本地 HTTP 缓存与历史存储，保证每个请求都经过传输层。
+    adapter_kwargs: 录制模式下 RecordingAdapter 的连接池 / 重试参数 (http_client.adapter_kwargs)，
+                    与 live 的 HTTPAdapter 相同；未指定时使用 HTTPAdapter 的默认值。
+    返回挂载的 Adapter (live 模式为 None)。
+    """
+    mode = (mode or TRANSPORT_CONFIG.get('mode') or 'live').lower()
+    if mode == 'live':
+        return None
+    if mode not in ('record', 'replay'):
+        raise ValueError(f"Unknown transport mode: {mode}")
+    path = archive_path or TRANSPORT_CONFIG['archive']
+    archive = _archive_for(path, mode)
+    if mode == 'record':
+        adapter = RecordingAdapter(archive, **(adapter_kwargs or {}))
+    else:
+        adapter = ReplayAdapter(
+            archive,
+            latency=TRANSPORT_CONFIG.get('latency', 0.0) if latency is None else latency,
+            jitter=TRANSPORT_CONFIG.get('jitter', 0.0) if jitter is None else jitter,
+        )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if TRANSPORT_CONFIG.get('bypass_local_stores', True):
+        CACHE_CONFIG['enabled'] = False
+        HISTORY_STORE_CONFIG['enabled'] = False
+    return adapter
+
+
+def save_recordings():
+    """立即写出所有录制中的归档 (进程退出时也会自动写出)。"""
+    for archive in list(_ARCHIVES.values()):
+        archive.save()